@@ -19,8 +19,14 @@ from .models import (
     Result,
     Procuration,
     UserComp,
+    GroupTally,
+    ChoiceTally,
+    ResultsSnapshot,
+    Job,
+    OutboxMail,
 )
-from .pollsmail import PollsMail
+from .pollsmail import PollsMail, new_attachment
+from .tools import close_event
 
 
 class CompanyAdmin(admin.ModelAdmin):
@@ -94,13 +100,15 @@ class EventAdmin(admin.ModelAdmin):
         "quorum",
         "rule",
         "current",
+        "starting",
+        "closed",
     ]
-    list_display = ("event_name", "event_start_date", "event_end_date", "company", "quorum", "rule", "current")
+    list_display = ("event_name", "event_start_date", "event_end_date", "company", "quorum", "rule", "current", "closed")
     ordering = ("event_start_date", "event_name")
     filter_horizontal = ("groups",)
     inlines = [QuestionInLine, ChoiceInLine]
 
-    actions = ["invite_users", "reinit_event"]
+    actions = ["invite_users", "close_events", "reinit_event"]
 
     def invite_users(self, request, queryset):
         for event in queryset:
@@ -128,8 +136,10 @@ class EventAdmin(admin.ModelAdmin):
 
                 html_string = render_to_string("polls/resolutions.html", context_data)
                 html = HTML(string=html_string, base_url=request.build_absolute_uri())
+                # Each invitation has its own file : mails are sent later, maybe after another invitation
+                attach = new_attachment("resolutions.pdf")
                 document = html.write_pdf(
-                    os.path.join(settings.MEDIA_ROOT, "pdf/resolutions.pdf"),
+                    settings.MEDIA_ROOT + attach,
                     stylesheets=[
                         CSS(os.path.join(settings.STATIC_ROOT, "polls/css/polls.css")),
                         CSS(
@@ -141,7 +151,7 @@ class EventAdmin(admin.ModelAdmin):
                 )
 
                 # Send email to users
-                PollsMail("invite", event, attach="pdf/resolutions.pdf")
+                PollsMail("invite", event, attach=attach)
 
                 # Message acknowledgement
                 message_usr = "Les participants à l'événement {} ont été invités".format(
@@ -151,6 +161,19 @@ class EventAdmin(admin.ModelAdmin):
 
     invite_users.short_description = "Inviter les participants"
 
+    def close_events(self, request, queryset):
+        for event in queryset.filter(closed=False):
+            if close_event(event):
+                self.message_user(request, "Evénement {} clôturé : les résultats sont figés".format(event.event_name))
+            else:
+                self.message_user(
+                    request,
+                    "L'événement {} est en cours de lancement : il ne peut pas encore être clôturé".format(event.event_name),
+                    level=messages.ERROR,
+                )
+
+    close_events.short_description = "Clôturer l'événement"
+
     def reinit_event(self, request, queryset):
         # =================================================================
         # SUPERUSER ONLY : allows to set event to "not started" for tests
@@ -158,7 +181,10 @@ class EventAdmin(admin.ModelAdmin):
         for event in queryset:
             # Set event to "not started"
             event.current = False
+            event.starting = False
+            event.closed = False
             event.save()
+            ResultsSnapshot.objects.filter(event=event).delete()
 
             Procuration.objects.filter(event=event).delete()
             question_list = Question.objects.filter(event=event)
@@ -167,6 +193,9 @@ class EventAdmin(admin.ModelAdmin):
             for question in question_list:
                 UserVote.objects.filter(question=question).delete()
                 Result.objects.filter(question=question).delete()
+                GroupTally.objects.filter(question=question).delete()
+                ChoiceTally.objects.filter(question=question).delete()
+                question.update_results_version()
 
             # Reinitialize complete view
             nb_questions = len(question_list)
@@ -245,8 +274,22 @@ class ProcurationAdmin(admin.ModelAdmin):
         return obj.proxy.id
 
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "kind", "company", "event", "status", "progress", "created_date", "end_date")
+    list_filter = ("status", "kind")
+    readonly_fields = ("created_date", "end_date")
+
+
+class OutboxMailAdmin(admin.ModelAdmin):
+    list_display = ("id", "company", "subject", "status", "attempts", "next_try", "created_date", "sent_date")
+    list_filter = ("status", "company")
+    readonly_fields = ("created_date", "sent_date")
+
+
 admin.site.register(Company, CompanyAdmin)
 admin.site.register(Event, EventAdmin)
 admin.site.register(UserGroup, UserGroupAdmin)
 admin.site.register(UserVote, UserVoteAdmin)
 admin.site.register(UserComp, UserCompAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(OutboxMail, OutboxMailAdmin)
@@ -0,0 +1,130 @@
+# -*-coding:Utf-8 -*
+
+''' Exports of members, voting status and results : rows are streamed, never held in memory as a whole '''
+
+import csv
+import tempfile
+
+from django.db.models import Exists, OuterRef, Subquery
+from django.http import StreamingHttpResponse, FileResponse
+from django.utils import timezone
+
+import openpyxl
+
+from .models import UserComp, UserVote, Question, Result
+
+
+# Rows are read from the database by chunks of this size
+CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+class Echo:
+    """ File-like object returning what is written : each csv row is sent as soon as it is written """
+
+    def write(self, value):
+        return value
+
+
+def members_rows(company):
+    """ Members of a company, for each of their groups """
+    yield ["Groupe", "Nom", "Prénom", "Username", "Mail", "Téléphone", "Administrateur"]
+    member_list = (
+        UserComp.objects.filter(company=company)
+        .order_by("usergroup__group_name", "user__last_name", "user__first_name", "id")
+        .values_list(
+            "usergroup__group_name", "user__last_name", "user__first_name",
+            "user__username", "user__email", "phone_num", "is_admin",
+        )
+    )
+    for group_name, last_name, first_name, username, email, phone_num, is_admin in member_list.iterator(
+        chunk_size=CHUNK_SIZE
+    ):
+        yield [group_name, last_name, first_name, username, email, phone_num, yes_no(is_admin)]
+
+
+def participation_rows(event):
+    """ Participation of each member of the event's groups, for each question """
+    yield ["Résolution n°", "Groupe", "Nom", "Prénom", "Username", "A voté", "Date du vote"]
+    for question in Question.get_question_list(event):
+        user_vote = UserVote.objects.filter(question=question, user=OuterRef("pk"))
+        member_list = (
+            UserComp.objects.filter(usergroup__event=event)
+            .annotate(
+                has_voted=Exists(user_vote.filter(has_voted=True)),
+                date_vote=Subquery(user_vote.values("date_vote")[:1]),
+            )
+            .order_by("usergroup__group_name", "user__last_name", "user__first_name", "id")
+            .values_list(
+                "usergroup__group_name", "user__last_name", "user__first_name",
+                "user__username", "has_voted", "date_vote",
+            )
+        )
+        for group_name, last_name, first_name, username, has_voted, date_vote in member_list.iterator(
+            chunk_size=CHUNK_SIZE
+        ):
+            yield [
+                question.question_no, group_name, last_name, first_name, username,
+                yes_no(has_voted), local_datetime(date_vote),
+            ]
+
+
+def results_rows(event):
+    """ Votes of each group of the event, for each question and choice """
+    yield ["Résolution n°", "Résolution", "Groupe", "Poids", "Choix", "Votes"]
+    result_list = (
+        Result.objects.filter(event=event)
+        .order_by("question__question_no", "usergroup__group_name", "choice__choice_no")
+        .values_list(
+            "question__question_no", "question__question_text", "usergroup__group_name",
+            "group_weight", "choice__choice_text", "votes",
+        )
+    )
+    yield from (list(row) for row in result_list.iterator(chunk_size=CHUNK_SIZE))
+
+
+def yes_no(value):
+    return "Oui" if value else "Non"
+
+
+def local_datetime(value):
+    """ Spreadsheets do not handle time zones : dates are exported in local time """
+    if value is None:
+        return None
+    return timezone.localtime(value).replace(tzinfo=None)
+
+
+def export_response(rows, filename, file_format):
+    """
+    Response sending rows as a csv or xlsx file
+    csv rows are streamed as they are read ; xlsx rows are written to a temporary
+    file by a write-only workbook, which is then streamed
+    """
+    if file_format == "csv":
+        writer = csv.writer(Echo(), delimiter=";")
+        # Byte order mark, for spreadsheets to read accents
+        content = iter_with_bom(writer.writerow(row) for row in rows)
+        response = StreamingHttpResponse(content, content_type=CONTENT_TYPES["csv"])
+    elif file_format == "xlsx":
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet()
+        for row in rows:
+            ws.append(row)
+        export_file = tempfile.TemporaryFile()
+        wb.save(export_file)
+        export_file.seek(0)
+        response = FileResponse(export_file, content_type=CONTENT_TYPES["xlsx"])
+    else:
+        raise ValueError("Format d'export inconnu : {}".format(file_format))
+
+    response["Content-Disposition"] = 'attachment; filename="{}.{}"'.format(filename, file_format)
+    return response
+
+
+def iter_with_bom(lines):
+    yield "\ufeff"
+    yield from lines
@@ -0,0 +1,154 @@
+# -*-coding:Utf-8 -*
+
+''' Background jobs : long tasks run out of the request, with their progress saved in the database '''
+
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from .models import Event, Job, JobAbandoned
+from .tools import init_event, import_users_file, get_import_counts
+
+
+logger = logging.getLogger(__name__)
+
+# Job functions, by kind : each one is called with the job and its parameters
+JOBS = {}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Set in the run_jobs worker : web processes are never forked by a job
+_worker_process = False
+
+
+def register_job(kind):
+    """ Decorator registering a function to run the jobs of a kind """
+    def decorator(function):
+        JOBS[kind] = function
+        return function
+    return decorator
+
+
+def get_executor():
+    """ Pool of threads running jobs of this process, created on first use """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.JOBS_WORKERS, thread_name_prefix="polls-job")
+    return _executor
+
+
+def set_worker_process():
+    """ Called by the run_jobs worker : jobs may start processes """
+    global _worker_process
+    _worker_process = True
+
+
+def is_worker_process():
+    return _worker_process
+
+
+def submit_job(kind, company=None, event=None, runner=None, **params):
+    """
+    Create a job and have it run according to runner (default : JOBS_RUNNER setting) :
+        "thread" : by a pool of threads of this process, once the job's creation is committed
+        "worker" : by the run_jobs management command
+        "sync" : immediately, before returning
+    """
+    runner = runner or settings.JOBS_RUNNER
+    job = Job.create_job(kind, company=company, event=event, **params)
+    if runner == "sync":
+        run_job(job.id)
+        job.refresh_from_db()
+    elif runner == "thread":
+        transaction.on_commit(lambda: get_executor().submit(run_job_thread, job.id))
+    return job
+
+
+def run_job(job_id):
+    """ Run a pending job : returns False if it was already run """
+    job = Job.claim(job_id)
+    if job is None:
+        return False
+
+    try:
+        JOBS[job.kind](job, **job.get_params())
+    except Exception as error:
+        logger.exception("Job %s failed", job)
+        job.set_failed(str(error))
+    else:
+        job.set_done()
+    return True
+
+
+def run_job_thread(job_id):
+    """ Run a job in a thread of the pool : the thread's database connection is closed afterwards """
+    try:
+        run_job(job_id)
+    finally:
+        connection.close()
+
+
+def run_pending_jobs():
+    """ Run all pending jobs, oldest first : returns the number of jobs run """
+    return sum(run_job(job_id) for job_id in Job.get_pending_jobs().values_list("id", flat=True))
+
+
+def start_event(event):
+    """
+    Launch an event in the background : until it is current, the event is shown as starting
+    A launch whose job is dead (see Job.release_dead_jobs) is started again
+    Returns the launch job, None if the event is already launched or closed, or being launched
+    """
+    with transaction.atomic():
+        # The event's row is locked : it is launched by one request only
+        event = Event.objects.select_for_update().get(id=event.id)
+        if event.starting and Job.release_dead_jobs(event, "launch_event"):
+            Event.objects.filter(id=event.id).update(starting=False)
+            event.starting = False
+        if not event.set_starting():
+            return None
+        return submit_job("launch_event", event=event)
+
+
+@register_job("launch_event")
+def launch_event(job):
+    event = Event.objects.get(id=job.event_id)
+    try:
+        init_event(event, progress=job.set_progress)
+    except JobAbandoned:
+        # Launch started again by another job
+        raise
+    except Exception:
+        # Launch can be started again
+        Event.objects.filter(id=event.id).update(starting=False)
+        raise
+
+
+@register_job("import_users")
+def import_users(job, path, sheet):
+    """
+    Import users from a file saved when it was uploaded : counts and messages are saved in the job's result
+    Passwords are hashed by a pool of processes in the run_jobs worker only, the web processes
+    (and their threads, database connections...) are not forked : elsewhere, they are hashed one by one
+    """
+    # Processes are started only if a batch is large enough to be hashed in parallel
+    pool = ProcessPoolExecutor(max_workers=settings.PASSWORD_HASH_WORKERS) if is_worker_process() else None
+    try:
+        with default_storage.open(path, "rb") as users_file:
+            nb_lines, nb_users, err_messages, warn_messages = import_users_file(
+                job.company, users_file, sheet, progress=job.set_progress, pool=pool
+            )
+    finally:
+        default_storage.delete(path)
+        if pool is not None:
+            pool.shutdown()
+
+    result = get_import_counts(nb_lines, nb_users, err_messages, warn_messages)
+    result.update(errors=err_messages, warnings=warn_messages)
+    job.set_progress(100, result=result)
@@ -0,0 +1,139 @@
+# -*-coding:Utf-8 -*
+
+'''
+Votes journal : ballots are appended to a local file, then counted in batches
+The journal is locked with fcntl : it is available on Unix only
+'''
+
+import glob
+import json
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows : the journal cannot be used
+    fcntl = None
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+from .models import UserVote, JournalPosition
+
+
+def check_journal():
+    """ The journal is locked with fcntl, which is not available on Windows """
+    if fcntl is None:
+        raise ImproperlyConfigured("The votes journal (VOTES_JOURNAL setting) is available on Unix only")
+
+
+def get_reservation_key(ballot, vote_no):
+    return "polls:journal_vote:{}:{}:{}".format(ballot["question"], ballot["user"], vote_no)
+
+
+def journal_ballot(ballot, path=None):
+    """
+    Reserve one of the user's votes, then append his ballot to the journal
+    Votes already counted are known from the ballot ; votes journaled but not counted yet
+    are reserved in the shared cache, one key per vote : concurrent requests cannot
+    reserve the same vote, so that a journaled ballot is not refused when it is counted
+    Returns False if all user's votes are already reserved
+    """
+    shared_cache = caches["shared"]
+    nb_counted = ballot["rights"] - ballot["nb_user_votes"]
+    for vote_no in range(nb_counted, ballot["rights"]):
+        key = get_reservation_key(ballot, vote_no)
+        if shared_cache.add(key, ballot["date"], settings.VOTES_JOURNAL_RESERVATION_TIMEOUT):
+            break
+    else:
+        return False
+
+    try:
+        append_ballot(ballot, path)
+    except Exception:
+        shared_cache.delete(key)
+        raise
+    return True
+
+
+def append_ballot(ballot, path=None):
+    """
+    Append a ballot to the journal, and wait for it to be written on disk
+    Each ballot is one line written at once : concurrent writers do not mix their lines
+    """
+    check_journal()
+    path = path or settings.VOTES_JOURNAL
+    line = (json.dumps(ballot) + "\n").encode()
+
+    while True:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            # The journal may have been taken by the flusher in the meantime : write in the new one
+            if os.path.exists(path) and os.fstat(fd).st_ino == os.stat(path).st_ino:
+                os.write(fd, line)
+                os.fsync(fd)
+                return
+        finally:
+            os.close(fd)
+
+
+def flush_journal(path=None, batch_size=None):
+    """
+    Count ballots of the journal in batches
+    The journal is renamed first, so that new ballots go to a new file
+    Journals left by an interrupted flush are replayed first
+    Returns the number of ballots read
+    """
+    check_journal()
+    path = path or settings.VOTES_JOURNAL
+    batch_size = batch_size or settings.VOTES_JOURNAL_BATCH
+
+    nb_ballots = 0
+    for journal in sorted(glob.glob(glob.escape(path) + ".*")):
+        nb_ballots += apply_journal(journal, batch_size)
+
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        journal = "{}.{}".format(path, time.time_ns())
+        os.rename(path, journal)
+        nb_ballots += apply_journal(journal, batch_size)
+
+    return nb_ballots
+
+
+def apply_journal(journal, batch_size):
+    """
+    Count ballots of a journal file, one transaction per batch
+    The position reached is saved with each batch : in case of crash,
+    the journal is replayed from the last counted batch only
+    """
+    nb_ballots = 0
+    with open(journal, "rb") as journal_file:
+        # Wait for ballots being written when the journal was renamed
+        fcntl.flock(journal_file, fcntl.LOCK_EX)
+        position, created = JournalPosition.objects.get_or_create(journal=journal)
+        journal_file.seek(position.position)
+
+        while True:
+            ballots = []
+            while len(ballots) < batch_size:
+                line = journal_file.readline()
+                if not line.endswith(b"\n"):
+                    # End of file, or ballot partly written before a crash
+                    break
+                ballots.append(json.loads(line))
+            if not ballots:
+                break
+
+            with transaction.atomic():
+                UserVote.apply_ballots(ballots)
+                position.position = journal_file.tell()
+                position.save()
+            nb_ballots += len(ballots)
+
+    os.remove(journal)
+    position.delete()
+    return nb_ballots
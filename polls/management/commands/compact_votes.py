@@ -0,0 +1,37 @@
+# -*-coding:Utf-8 -*
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.models import Ballot
+
+
+class Command(BaseCommand):
+    help = "Count the ballots of the ledger not compacted yet in results and tallies"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=float, default=0,
+            help="Seconds between two compactions : the ledger is compacted until stopped. "
+                 "Default : compact once",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of ballots counted in each transaction",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            nb_ballots = 0
+            while True:
+                nb_batch = Ballot.compact(options["batch_size"])
+                if not nb_batch:
+                    break
+                nb_ballots += nb_batch
+            if nb_ballots:
+                self.stdout.write("{} bulletin(s) comptabilisé(s)".format(nb_ballots))
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,36 @@
+# -*-coding:Utf-8 -*
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.journal import flush_journal
+
+
+class Command(BaseCommand):
+    help = "Count the ballots of the votes journal (VOTES_JOURNAL setting)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=float, default=0,
+            help="Seconds between two flushes : the journal is flushed until stopped. "
+                 "Default : flush once",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.VOTES_JOURNAL_BATCH,
+            help="Number of ballots counted in each transaction",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.VOTES_JOURNAL:
+            raise CommandError("No votes journal : VOTES_JOURNAL setting is not set")
+
+        while True:
+            nb_ballots = flush_journal(batch_size=options["batch_size"])
+            if nb_ballots:
+                self.stdout.write("{} bulletin(s) comptabilisé(s)".format(nb_ballots))
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
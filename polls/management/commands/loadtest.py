@@ -0,0 +1,232 @@
+# -*-coding:Utf-8 -*
+
+import http.cookiejar
+import math
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.shortcuts import reverse
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from polls.models import Company, UserComp, UserGroup, Event, Question, Choice
+from polls.tools import init_event
+
+
+STEPS = ["login", "question", "vote", "chart_data"]
+# Expected response status of each step : login redirects to the home page
+STEP_STATUS = {"login": 302, "question": 200, "vote": 200, "chart_data": 200}
+PASSWORD = "loadtest"
+
+
+def percentile(values, pct):
+    """ Nearest-rank percentile of a list of values """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+class ClientSession:
+    """ Voter's requests sent to the application in the same process, with Django's test client """
+
+    def __init__(self):
+        host = "localhost"
+        if settings.ALLOWED_HOSTS and settings.ALLOWED_HOSTS[0] != "*":
+            host = settings.ALLOWED_HOSTS[0].lstrip(".")
+        self.client = Client(HTTP_HOST=host)
+
+    def start(self, login_url):
+        pass
+
+    def get(self, path, data=None):
+        return self.client.get(path, data).status_code
+
+    def post(self, path, data, headers={}):
+        return self.client.post(path, data, **{"HTTP_" + key.upper().replace("-", "_"): value for key, value in headers.items()}).status_code
+
+
+class HttpSession:
+    """ Voter's requests sent to a running server, with cookies and CSRF token """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies))
+
+    def csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == settings.CSRF_COOKIE_NAME:
+                return cookie.value
+        return ""
+
+    def send(self, path, data=None, headers={}, method="GET"):
+        url = self.base_url + path
+        if data is not None and method == "GET":
+            url += "?" + urllib.parse.urlencode(data)
+            data = None
+        if data is not None:
+            data = urllib.parse.urlencode(data).encode()
+        request = urllib.request.Request(url, data=data, headers=headers, method=method)
+        try:
+            with self.opener.open(request) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            return error.code
+
+    def start(self, login_url):
+        # CSRF cookie is set by the login page
+        self.send(login_url)
+
+    def get(self, path, data=None):
+        return self.send(path, data)
+
+    def post(self, path, data, headers={}):
+        headers = dict(headers, Referer=self.base_url + path)
+        headers["X-CSRFToken"] = self.csrf_token()
+        data = dict(data, csrfmiddlewaretoken=self.csrf_token())
+        return self.send(path, data, headers, method="POST")
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure how many voters the application handles : a synthetic event is created, "
+        "then simulated voters log in, display the question, vote and get charts data concurrently"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--voters", type=int, default=100, help="Number of simulated voters")
+        parser.add_argument("--concurrency", type=int, default=10, help="Number of voters at the same time")
+        parser.add_argument(
+            "--url",
+            help="Base URL of a running server (e.g. http://localhost:8000). "
+                 "Default : requests are sent to the application in this process, with SQL queries counted",
+        )
+        parser.add_argument("--keep", action="store_true", help="Keep the synthetic event and users")
+
+    def handle(self, *args, **options):
+        if options["voters"] < 1 or options["concurrency"] < 1:
+            raise CommandError("Number of voters and concurrency must be at least 1")
+
+        company, event, choice_list, user_list = self.create_event(options["voters"])
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+                measures = list(executor.map(
+                    lambda i: self.run_voter(options["url"], event, user_list[i], choice_list[i % len(choice_list)]),
+                    range(len(user_list)),
+                ))
+            duration = time.perf_counter() - start
+            self.report(measures, duration, options)
+        finally:
+            if not options["keep"]:
+                User.objects.filter(id__in=[user.id for user in user_list]).delete()
+                company.logo.delete(save=False)
+                company.delete()
+
+    def create_event(self, nb_voters):
+        """ Synthetic company, voters and event, launched and ready for votes """
+        name = "Load test {}".format(timezone.now().strftime("%Y%m%d%H%M%S%f"))
+        company = Company.create_company(
+            name, "SA", "00000000000000", "1 rue du test", 75000, "Paris", logo="loadtest.jpg"
+        )
+
+        # Password is hashed once for all voters
+        # Usernames fit the login form's length : short prefix unique to this test
+        prefix = "lt{}-".format(uuid.uuid4().hex[:8])
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([
+            User(username=prefix + str(i), password=password, last_name="Votant {}".format(i))
+            for i in range(nb_voters)
+        ])
+        user_list = list(User.objects.filter(username__startswith=prefix).order_by("id"))
+        usercomp_list = UserComp.bulk_create_usercomps(company, [UserComp(user=user) for user in user_list])
+
+        group = UserGroup.create_group(company, "Votants", weight=100, user_list=usercomp_list)
+        event = Event.create_event(company, name, timezone.now(), groups=[group])
+        Question.create_question(event, 1, "Résolution de test")
+        choice_list = [
+            Choice.create_choice(event, 1, "Pour"),
+            Choice.create_choice(event, 2, "Contre"),
+        ]
+        init_event(event)
+
+        return company, event, choice_list, user_list
+
+    def run_voter(self, url, event, user, choice):
+        """ One voter's path through the application : returns each step's duration, status and queries """
+        comp_slug = event.company.comp_slug
+        session = HttpSession(url) if url else ClientSession()
+        requests = {
+            "login": lambda: session.post(
+                reverse("polls:login"), {"username": user.username, "password": PASSWORD}
+            ),
+            "question": lambda: session.get(reverse("polls:question", args=(comp_slug, event.slug, 1))),
+            "vote": lambda: session.post(
+                reverse("polls:vote", args=(comp_slug, event.slug, 1)),
+                {"choice": choice.id},
+                {"Idempotency-Key": uuid.uuid4().hex},
+            ),
+            "chart_data": lambda: session.get(
+                reverse("polls:chart_data"), {"comp_slug": comp_slug, "event_slug": event.slug, "question_no": 1}
+            ),
+        }
+
+        measures = {}
+        try:
+            session.start(reverse("polls:login"))
+            for step in STEPS:
+                # SQL queries can only be counted in this process
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    try:
+                        status = requests[step]()
+                    except Exception:
+                        status = None
+                    duration = time.perf_counter() - start
+                measures[step] = (duration, status, None if url else len(queries))
+        finally:
+            connection.close()
+
+        return measures
+
+    def report(self, measures, duration, options):
+        nb_votes = sum(1 for measure in measures if measure["vote"][1] == STEP_STATUS["vote"])
+        self.stdout.write("Votants : {}, simultanés : {}, durée : {:.2f} s, débit : {:.1f} votes/s".format(
+            options["voters"], options["concurrency"], duration, nb_votes / duration
+        ))
+        self.stdout.write("{:<12}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}{:>10}".format(
+            "étape", "envois", "erreurs", "moy. ms", "p50 ms", "p90 ms", "p99 ms", "max ms", "requêtes"
+        ))
+        for step in STEPS:
+            durations = [measure[step][0] * 1000 for measure in measures]
+            errors = sum(1 for measure in measures if measure[step][1] != STEP_STATUS[step])
+            queries = [measure[step][2] for measure in measures if measure[step][2] is not None]
+            self.stdout.write("{:<12}{:>8}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10}".format(
+                step,
+                len(durations),
+                errors,
+                sum(durations) / len(durations),
+                percentile(durations, 50),
+                percentile(durations, 90),
+                percentile(durations, 99),
+                max(durations),
+                "{:.1f}".format(sum(queries) / len(queries)) if queries else "-",
+            ))
+
+        if connection.vendor == "sqlite" and options["concurrency"] > 1:
+            self.stdout.write(
+                "SQLite n'accepte qu'une écriture à la fois : les erreurs \"database is locked\" "
+                "sont attendues avec plusieurs votants simultanés"
+            )
@@ -0,0 +1,22 @@
+# -*-coding:Utf-8 -*
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import Http404
+
+from polls.models import Ballot, Event
+
+
+class Command(BaseCommand):
+    help = "Rebuild results, tallies and users' votes of an event from the ballots' ledger"
+
+    def add_arguments(self, parser):
+        parser.add_argument("comp_slug", help="Company's slug")
+        parser.add_argument("event_slug", help="Event's slug")
+
+    def handle(self, *args, **options):
+        try:
+            event = Event.get_event(options["comp_slug"], options["event_slug"])
+        except Http404:
+            raise CommandError("Evénement introuvable")
+        nb_ballots = Ballot.rebuild(event)
+        self.stdout.write("Evénement {} : {} bulletin(s) recomptabilisé(s)".format(event.event_name, nb_ballots))
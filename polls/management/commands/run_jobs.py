@@ -0,0 +1,30 @@
+# -*-coding:Utf-8 -*
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.jobs import run_pending_jobs, set_worker_process
+
+
+class Command(BaseCommand):
+    help = "Run pending background jobs (JOBS_RUNNER setting set to \"worker\", users' imports)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=float, default=0,
+            help="Seconds between two checks for pending jobs : jobs are run until stopped. "
+                 "Default : run pending jobs once",
+        )
+
+    def handle(self, *args, **options):
+        # Jobs run here may start processes (users' import)
+        set_worker_process()
+        while True:
+            nb_jobs = run_pending_jobs()
+            if nb_jobs:
+                self.stdout.write("{} tâche(s) exécutée(s)".format(nb_jobs))
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,31 @@
+# -*-coding:Utf-8 -*
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.pollsmail import send_pending_mails
+
+
+class Command(BaseCommand):
+    help = (
+        "Send mails of the outbox (MAIL_RUNNER setting set to \"worker\"), "
+        "and try again those which could not be sent"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=float, default=0,
+            help="Seconds between two checks for mails to send : mails are sent until stopped. "
+                 "Default : send due mails once",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            nb_mails = send_pending_mails()
+            if nb_mails:
+                self.stdout.write("{} mail(s) envoyé(s)".format(nb_mails))
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0057_auto_20211206_2346'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupTally',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group_weight', models.IntegerField(default=0, verbose_name='poids')),
+                ('nb_users', models.IntegerField(default=0, verbose_name='nombre de votants')),
+                ('nb_votes', models.IntegerField(default=0, verbose_name='nombre de votes')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.Event', verbose_name='événement')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.Question', verbose_name='résolution')),
+                ('usergroup', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.UserGroup', verbose_name="groupe d'utilisateurs")),
+            ],
+            options={
+                'verbose_name': 'Décompte par groupe',
+                'verbose_name_plural': 'Décomptes par groupe',
+            },
+        ),
+        migrations.CreateModel(
+            name='ChoiceTally',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('votes', models.IntegerField(default=0, verbose_name='nombre de votes')),
+                ('prop_score', models.IntegerField(default=0, verbose_name='score à la proportionnelle (votes x poids)')),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.Choice', verbose_name='choix')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.Event', verbose_name='événement')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.Question', verbose_name='résolution')),
+            ],
+            options={
+                'verbose_name': 'Décompte par choix',
+                'verbose_name_plural': 'Décomptes par choix',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='grouptally',
+            constraint=models.UniqueConstraint(fields=('question', 'usergroup'), name='unique_group_tally_per_question'),
+        ),
+        migrations.AddConstraint(
+            model_name='choicetally',
+            constraint=models.UniqueConstraint(fields=('question', 'choice'), name='unique_choice_tally_per_question'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0058_auto_20261018_1308'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='results_version',
+            field=models.IntegerField(default=0, verbose_name='version des résultats'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0059_auto_20261018_1311'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='closed',
+            field=models.BooleanField(default=False, verbose_name='clôturé'),
+        ),
+        migrations.CreateModel(
+            name='ResultsSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('closing_date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date de clôture')),
+                ('results', models.TextField(verbose_name='résultats')),
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='polls.Event', verbose_name='événement')),
+            ],
+            options={
+                'verbose_name': 'Résultats figés',
+                'verbose_name_plural': 'Résultats figés',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0060_auto_20261018_1317'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JournalPosition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('journal', models.CharField(max_length=255, unique=True, verbose_name='journal')),
+                ('position', models.BigIntegerField(default=0, verbose_name='position')),
+            ],
+            options={
+                'verbose_name': 'Position du journal des votes',
+                'verbose_name_plural': 'Positions du journal des votes',
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0061_auto_20261018_1324'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ballot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_vote', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date du vote')),
+                ('compacted', models.BooleanField(db_index=True, default=False, verbose_name='comptabilisé')),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.Choice', verbose_name='choix')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.Event', verbose_name='événement')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.Question', verbose_name='résolution')),
+                ('usergroup', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.UserGroup', verbose_name="groupe d'utilisateurs")),
+                ('uservote', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.UserVote', verbose_name='vote utilisateur')),
+            ],
+            options={
+                'verbose_name': 'Bulletin',
+                'verbose_name_plural': 'Bulletins',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0062_auto_20261018_1327'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='uservote',
+            constraint=models.UniqueConstraint(fields=('user', 'question'), name='unique_user_vote'),
+        ),
+    ]
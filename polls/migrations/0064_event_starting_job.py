@@ -0,0 +1,37 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0063_uservote_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='starting',
+            field=models.BooleanField(default=False, verbose_name='en cours de lancement'),
+        ),
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50, verbose_name='type')),
+                ('params', models.TextField(default='{}', verbose_name='paramètres')),
+                ('status', models.CharField(choices=[('PENDING', 'En attente'), ('RUNNING', 'En cours'), ('DONE', 'Terminé'), ('FAILED', 'Echec')], db_index=True, default='PENDING', max_length=10, verbose_name='statut')),
+                ('progress', models.IntegerField(default=0, verbose_name='avancement')),
+                ('message', models.TextField(blank=True, verbose_name='message')),
+                ('created_date', models.DateTimeField(auto_now_add=True, verbose_name='date de création')),
+                ('end_date', models.DateTimeField(blank=True, null=True, verbose_name='date de fin')),
+                ('company', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.Company', verbose_name='société')),
+                ('event', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.Event', verbose_name='événement')),
+            ],
+            options={
+                'verbose_name': 'Tâche',
+            },
+        ),
+    ]
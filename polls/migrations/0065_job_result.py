@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0064_event_starting_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='result',
+            field=models.TextField(default='{}', verbose_name='résultat'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0065_job_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='objet')),
+                ('message', models.TextField(verbose_name='message')),
+                ('from_email', models.CharField(max_length=255, verbose_name='expéditeur')),
+                ('to', models.TextField(default='[]', verbose_name='destinataires')),
+                ('cc', models.TextField(default='[]', verbose_name='copie')),
+                ('bcc', models.TextField(default='[]', verbose_name='copie cachée')),
+                ('attach', models.CharField(blank=True, max_length=255, verbose_name='pièce jointe')),
+                ('status', models.CharField(choices=[('PENDING', 'En attente'), ('SENDING', "En cours d'envoi"), ('SENT', 'Envoyé'), ('FAILED', 'Echec')], default='PENDING', max_length=10, verbose_name='statut')),
+                ('attempts', models.IntegerField(default=0, verbose_name='tentatives')),
+                ('next_try', models.DateTimeField(default=django.utils.timezone.now, verbose_name='prochaine tentative')),
+                ('sender_id', models.CharField(blank=True, max_length=32, verbose_name='envoi')),
+                ('error', models.TextField(blank=True, verbose_name='erreur')),
+                ('created_date', models.DateTimeField(auto_now_add=True, verbose_name='date de création')),
+                ('sent_date', models.DateTimeField(blank=True, null=True, verbose_name="date d'envoi")),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.Company', verbose_name='société')),
+            ],
+            options={
+                'verbose_name': 'Mail',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='outboxmail',
+            index=models.Index(fields=['status', 'next_try'], name='outbox_due'),
+        ),
+    ]
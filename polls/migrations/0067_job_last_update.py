@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:46
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0066_outboxmail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='last_update',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='dernière mise à jour'),
+        ),
+    ]
@@ -1,15 +1,27 @@
 # -*-coding:Utf-8 -*
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.core.cache import cache
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from django.db.models import Count, Q
+from django.utils.dateparse import parse_datetime
+from django.db.models import Count, Q, F, OuterRef, Subquery, Exists, IntegerField
+from django.db.models.functions import Coalesce
 from django.conf import settings
 from django.core.validators import RegexValidator
 from django.utils.text import slugify
 from django.core.files.uploadedfile import SimpleUploadedFile
 
+import datetime
+import json
+import uuid
+from collections import Counter
+
+from .tally import Tally, to_percentages
+from .proxies import ProxyGraph
+
+
 class Company(models.Model):
     """
     Company informations
@@ -60,7 +72,7 @@ class Company(models.Model):
         comp = cls.objects.create(
             company_name=company_name,
             comp_slug=slugify(company_name),
-            logo=SimpleUploadedFile(name=logo, content=b'content', content_type='image/jpeg'),
+            logo=SimpleUploadedFile(name=logo, content=b'content', content_type='image/jpeg') if logo else None,
             use_groups=use_groups,
             rule=rule,
             upd_rule=upd_rule,
@@ -115,6 +127,40 @@ class UserComp(models.Model):
         usr_comp.save()
         return usr_comp
 
+    @classmethod
+    def bulk_create_usercomps(cls, company, usercomp_list):
+        """
+        Create users' profiles of a company in bulk : profiles, then their membership
+        to the company's default group, are inserted with one statement each
+        Returns the new UserComps
+        """
+        for usr_comp in usercomp_list:
+            usr_comp.company = company
+        with transaction.atomic():
+            cls.objects.bulk_create(usercomp_list)
+            # Primary keys are not set by bulk_create on every database : they are read again
+            usercomp_list = list(
+                cls.objects.filter(company=company, user_id__in=[usr_comp.user_id for usr_comp in usercomp_list])
+            )
+            cls.add_to_default_groups(usercomp_list)
+        return usercomp_list
+
+    @classmethod
+    def add_to_default_groups(cls, usercomp_list):
+        """ Add users to their company's default hidden group, with one statement """
+        if not usercomp_list:
+            return
+        default_groups = dict(
+            UserGroup.objects.filter(
+                company_id__in={usr_comp.company_id for usr_comp in usercomp_list},
+                group_name="Default Group",
+            ).values_list("company_id", "id")
+        )
+        UserGroup.users.through.objects.bulk_create([
+            UserGroup.users.through(usergroup_id=default_groups[usr_comp.company_id], usercomp_id=usr_comp.id)
+            for usr_comp in usercomp_list
+        ])
+
     @classmethod
     def get_users_in_comp(cls, comp_slug):
         """Checks if user is in related company"""
@@ -161,9 +207,9 @@ class UserGroup(models.Model):
         new_group.save()
 
         if user: new_group.users.add(user)
-        
-        for usr in user_list:
-            new_group.users.add(usr)
+
+        # Users are added with one statement
+        new_group.users.add(*user_list)
         return new_group
 
     @classmethod
@@ -196,6 +242,8 @@ class Event(models.Model):
     event_end_date = models.DateField("date de fin de l'événement", null=True, blank=True)
     slug = models.SlugField()
     current = models.BooleanField("en cours", default=False)
+    starting = models.BooleanField("en cours de lancement", default=False)
+    closed = models.BooleanField("clôturé", default=False)
     quorum = models.IntegerField(default=33)
     rule = models.CharField(
         "mode de scrutin", max_length=5, choices=rules, default="MAJ"
@@ -257,9 +305,69 @@ class Event(models.Model):
         ).order_by("-event_start_date")
 
     def set_current(self):
-        """ Set the event to be "in progress" """
-        self.current = True
-        self.save()
+        """
+        Set the event being launched to be "in progress"
+        Returns False if it is not being launched anymore (closed meanwhile...) : it is left unchanged
+        """
+        started = Event.objects.filter(id=self.id, starting=True, closed=False).update(current=True, starting=False)
+        if started:
+            self.current, self.starting = True, False
+        return started > 0
+
+    def set_starting(self):
+        """
+        Set the event to be launched : votes are initialized in the background
+        Returns False if the event is already launched, being launched or closed
+        """
+        started = Event.objects.filter(id=self.id, current=False, starting=False, closed=False).update(starting=True)
+        if started:
+            self.starting = True
+        return started > 0
+
+    def set_closed(self):
+        """ Set the event to be over : votes and results can not change anymore """
+        Event.objects.filter(id=self.id).update(current=False, closed=True)
+        self.current = False
+        self.closed = True
+
+    def get_results(self):
+        """
+        Calculate results of all the event's questions in one pass
+        The number of queries does not depend on the number of questions
+        Returns a list of dicts with the question, its results and related chart data
+        Results of a closed event are read from its snapshot
+        """
+        if self.closed:
+            snapshot = ResultsSnapshot.get_results(self)
+            if snapshot is not None:
+                return snapshot
+
+        question_list = list(Question.get_question_list(self))
+        results = ChoiceTally.get_event_results(self)
+
+        if len(results) < len(question_list):
+            # Some questions have no tally : compute them from results
+            tally_results = Result.get_event_tallies(self).get_results()
+            choice_list = None
+            for question in question_list:
+                if question.id in results:
+                    continue
+                if question.id in tally_results:
+                    results[question.id] = tally_results[question.id]
+                else:
+                    if choice_list is None:
+                        choice_list = [(choice.id, choice.choice_text) for choice in Choice.get_choice_list(self)]
+                    results[question.id] = Tally(self.rule, choice_list).get_results()
+
+        event_results = []
+        for question in question_list:
+            question.event = self
+            event_results.append({
+                "question": question,
+                "results": results[question.id],
+                "chart_results": question.get_chart_results(results[question.id]),
+            })
+        return event_results
 
 
 class Question(models.Model):
@@ -271,6 +379,7 @@ class Question(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, verbose_name="événement")
     question_text = models.TextField("texte de la résolution")
     question_no = models.IntegerField("numéro de résolution")
+    results_version = models.IntegerField("version des résultats", default=0)
 
     class Meta:
         verbose_name = "Résolution"
@@ -338,60 +447,51 @@ class Question(models.Model):
             return None
         
 
-    def get_results(self):
-        """ Calculates votes' results for a question """
-        # Calcultate global results for the question
-        evt_group_list = UserGroup.get_group_list(self.event)
+    @classmethod
+    def get_results_etag(cls, comp_slug, event_slug, question_no):
+        """ Identify the current version of a question's results, None if not found """
+        version = cls.objects.filter(
+            event__company__comp_slug=comp_slug, event__slug=event_slug, question_no=question_no
+        ).values_list("id", "results_version", "event__rule").first()
+        if version is None:
+            return None
+        return "-".join(str(elt) for elt in version)
 
-        # Initialize global results data
-        global_choice_list = Choice.get_choice_list(self.event).values(
-            "choice_text"
-        )
-        group_vote = {}
-        group_vote = {}
-        for choice in global_choice_list:
-            group_vote[choice["choice_text"]] = 0
-
-        # Gather votes info for each group
-        for evt_group in evt_group_list:
-            total_votes = UserGroup.objects.filter(id=evt_group.id).aggregate(
-                Count("users")
-            )["users__count"]
-
-            result_list = Result.get_vote_list(
-                self.event, evt_group, self.question_no
-            ).values("choice__choice_text", "votes", "group_weight")
-
-            labels = [choice["choice__choice_text"] for choice in result_list]
-            values = [choice["votes"] for choice in result_list]
-
-            # Calculate aggregate results
-            weight = result_list[0]["group_weight"]
-            if self.event.rule == "MAJ":
-                # Règles à définir : cas d'égalité, cas où pas de valeur
-                max_val = values.index(max(values))
-                group_vote[labels[max_val]] += weight
-            elif self.event.rule == "PROP":
-                # Calculate totals per choice, including group's weight
-                # Addition of each group's result
-                for i, choice in enumerate(labels):
-                    if choice in group_vote:
-                        group_vote[choice] += values[i] * weight / 100
-
-        if self.event.rule == "PROP":
-            # Calculate percentage for each choice
-            total_votes = 0
-            for val in group_vote.values():
-                total_votes += val
-            if total_votes > 0:
-                for choice, value in group_vote.items():
-                    group_vote[choice] = round((value / total_votes) * 100, 2)
+    def update_results_version(self):
+        """ Results changed : set a new version so that clients refresh them """
+        Question.update_results_versions([self.id])
+
+    @classmethod
+    def update_results_versions(cls, question_ids):
+        """
+        Results of several questions changed : set new versions
+        Live results streams are told through the cache, once the change is committed
+        """
+        question_ids = list(question_ids)
+        cls.objects.filter(id__in=question_ids).update(results_version=F("results_version") + 1)
+        transaction.on_commit(lambda: cls.signal_results_changed(question_ids))
 
+    @classmethod
+    def signal_results_changed(cls, question_ids):
+        """ Cheap signal read by live results streams : they read results' versions only when it changes """
+        cache.set_many({cls.get_results_signal_key(question_id): uuid.uuid4().hex for question_id in question_ids})
+
+    @staticmethod
+    def get_results_signal_key(question_id):
+        return "polls:results_changed:{}".format(question_id)
+
+    def get_results(self):
+        """ Calculates votes' results for a question """
+        group_vote = ChoiceTally.get_results(self.event, self)
+        if group_vote is None:
+            # Event launched before tallies were kept up to date : compute them from results
+            group_vote = Result.get_tally(self.event, self).get_results()
         return group_vote
 
-    def get_chart_results(self):
-        """  Set up results data to be displayed """
-        group_vote = self.get_results()
+    def get_chart_results(self, group_vote=None):
+        """  Set up results data to be displayed - results are calculated if not provided """
+        if group_vote is None:
+            group_vote = self.get_results()
 
         # Setup global info for charts
         global_labels = []
@@ -404,13 +504,13 @@ class Question(models.Model):
 
         group_data = {"labels": global_labels, "values": global_values}
 
-        chart_background_colors = settings.BACKGROUND_COLORS
-        chart_border_colors = settings.BORDER_COLORS
+        chart_background_colors = list(settings.BACKGROUND_COLORS)
+        chart_border_colors = list(settings.BORDER_COLORS)
 
         # Extends color lists to fit with nb values to display
         while len(chart_background_colors) < nb_votes:
             chart_background_colors += settings.BACKGROUND_COLORS
-            chart_border_colors += settings.BACKGROUND_COLORS
+            chart_border_colors += settings.BORDER_COLORS
 
         data = {
             "chart_data": group_data,
@@ -518,6 +618,9 @@ class UserVote(models.Model):
     class Meta:
         verbose_name = "Vote utilisateurs et pouvoirs"
         verbose_name_plural = "Votes utilisateurs et pouvoirs"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "question"], name="unique_user_vote"),
+        ]
 
     def __str__(self):
         return (
@@ -551,67 +654,246 @@ class UserVote(models.Model):
         # If no choices are precised but has_voted is set to True, we consider this stands for 1 vote
         if has_voted == True: nb_votes = max(len(choices), 1)
 
+        # User's vote status and related results are saved in the same transaction
+        with transaction.atomic():
+            user_vote = cls.get_user_vote(event, user, question)
+            if user_vote is None:
+                # First vote
+                user_vote = cls(
+                    event=event,
+                    user=user,
+                    question=question,
+                    has_voted=has_voted,
+                    nb_user_votes=nb_user_votes - nb_votes,
+                )
+                user_vote.save()
+            else:
+                # Update vote : votes left are decreased by the database
+                cls.objects.filter(id=user_vote.id).update(
+                    nb_user_votes=F("nb_user_votes") - nb_votes,
+                    has_voted=has_voted,
+                    date_vote=timezone.now(),
+                )
+                user_vote.refresh_from_db(fields=["nb_user_votes", "has_voted", "date_vote"])
+
+            # Update result in case of actual vote
+            if user_vote.has_voted == True and len(choices) > 0:
+                usergroup_id = Result.add_vote(user, event, question, choices)
+                Ballot.record([
+                    {
+                        "uservote": user_vote.id,
+                        "event": event.id,
+                        "question": question.id,
+                        "usergroup": usergroup_id,
+                        "choice": getattr(choice, "id", choice),
+                    }
+                    for choice in choices
+                ])
+
+        return user_vote
+
+    @classmethod
+    def cast_vote(cls, user, comp_slug, event_slug, question_no, choice_id):
+        """
+        Record a user's vote for a choice, as sent by the vote page
+        User's rights, group and choice are checked with one query, then rights,
+        results and tallies are updated within one transaction : the number of
+        queries depends neither on the number of groups nor on the number of choices
+        Returns the number of votes the user has left, None if the vote is refused
+        """
+        with transaction.atomic():
+            ballot = cls.get_ballot(user, comp_slug, event_slug, question_no, choice_id)
+            if ballot is None or not cls.apply_ballots([ballot]):
+                return None
+
+        return ballot["nb_user_votes"] - 1
+
+    @classmethod
+    def get_ballot(cls, user, comp_slug, event_slug, question_no, choice_id):
+        """
+        Check a user's vote with one query : user's rights and group, choice and event's status
+        Until the user's first vote, his rights are derived from his group and confirmed procurations
+        Returns the ballot to be counted, None if the vote is refused
+        """
+        user_vote = cls.objects.filter(user=user, question=OuterRef("pk"))
+        ballot = (
+            Question.objects.filter(
+                event__slug=event_slug,
+                event__company__comp_slug=comp_slug,
+                question_no=question_no,
+            )
+            .annotate(
+                user_vote_id=Subquery(user_vote.values("id")[:1]),
+                votes_left=Subquery(user_vote.values("nb_user_votes")[:1]),
+                usergroup=Subquery(
+                    UserGroup.objects.filter(event=OuterRef("event"), users=user).values("id")[:1]
+                ),
+                valid_choice=Exists(Choice.objects.filter(id=choice_id, event=OuterRef("event"))),
+                proxy_given=Exists(
+                    Procuration.objects.filter(event=OuterRef("event"), user=user, proxy_confirmed=True)
+                ),
+                proxy_received=Subquery(
+                    Procuration.objects.filter(event=OuterRef("event"), proxy=user, proxy_confirmed=True)
+                    .order_by()
+                    .values("proxy")
+                    .annotate(nb_proxies=Count("id"))
+                    .values("nb_proxies"),
+                    output_field=IntegerField(),
+                ),
+            )
+            .values(
+                "id", "event", "user_vote_id", "votes_left", "usergroup", "valid_choice",
+                "proxy_given", "proxy_received", "event__current", "event__closed",
+            )
+            .first()
+        )
+        if ballot is None:
+            return None
+
+        rights = cls.count_rights(ballot["proxy_received"] or 0, ballot["proxy_given"])
+        nb_user_votes = rights if ballot["user_vote_id"] is None else ballot["votes_left"]
+        if (
+            ballot["usergroup"] is None
+            or not ballot["valid_choice"]
+            or not ballot["event__current"]
+            or ballot["event__closed"]
+            or nb_user_votes <= 0
+        ):
+            return None
+
+        return {
+            "uservote": ballot["user_vote_id"],
+            "user": user.id,
+            "rights": rights,
+            "event": ballot["event"],
+            "question": ballot["id"],
+            "usergroup": ballot["usergroup"],
+            "choice": choice_id,
+            "nb_user_votes": nb_user_votes,
+            "date": timezone.now().isoformat(),
+        }
+
+    @classmethod
+    def apply_ballots(cls, ballots):
+        """
+        Count a batch of ballots - must be called within a transaction
+        Each ballot is accepted only if its user has votes left ; results, tallies
+        and results' versions are then updated once per group, question and choice
+        Returns the accepted ballots
+        """
+        accepted = []
+        for ballot in ballots:
+            date_vote = parse_datetime(ballot["date"]) if "date" in ballot else timezone.now()
+            if ballot["uservote"] is None:
+                # User's first vote for the question : his row is stored with the votes he has left
+                try:
+                    with transaction.atomic():
+                        user_vote = cls.objects.create(
+                            event_id=ballot["event"],
+                            user_id=ballot["user"],
+                            question_id=ballot["question"],
+                            nb_user_votes=ballot["rights"] - 1,
+                            has_voted=True,
+                            date_vote=date_vote,
+                        )
+                    accepted.append(dict(ballot, uservote=user_vote.id))
+                    continue
+                except IntegrityError:
+                    # Stored meanwhile by a concurrent vote : rights are checked below
+                    user_vote = cls.objects.get(user_id=ballot["user"], question_id=ballot["question"])
+                    ballot = dict(ballot, uservote=user_vote.id)
+
+            # Rights are checked again by the update itself, in case of concurrent votes
+            if cls.objects.filter(id=ballot["uservote"], nb_user_votes__gt=0).update(
+                nb_user_votes=F("nb_user_votes") - 1,
+                has_voted=True,
+                date_vote=date_vote,
+            ):
+                accepted.append(ballot)
+
+        # Ballots are recorded in the ledger, then counted now or by the next compaction
+        compacted = not settings.VOTES_COMPACTION
+        Ballot.record(accepted, compacted=compacted)
+        if compacted:
+            Ballot.count(accepted)
+
+        return accepted
+
+    @staticmethod
+    def count_rights(proxy_received, proxy_given):
+        """ Number of votes of a user : none if he gave his proxy, one more for each proxy received """
+        if proxy_received:
+            return 1 + proxy_received
+        return 0 if proxy_given else 1
+
+    @classmethod
+    def get_user_rights(cls, event, user):
+        """ Number of votes of a user for each question, from his confirmed procurations """
+        proxy_list = Procuration.objects.filter(event=event, proxy_confirmed=True)
+        return cls.count_rights(
+            proxy_list.filter(proxy=user).count(),
+            proxy_list.filter(user=user).exists(),
+        )
+
+    @classmethod
+    def get_voter_status(cls, event, user, question):
+        """
+        Return user's vote status
+        Until the user votes, no row is stored : his status is derived from his rights
+        """
         user_vote = cls.get_user_vote(event, user, question)
         if user_vote is None:
-            # First vote
             user_vote = cls(
                 event=event,
                 user=user,
                 question=question,
-                has_voted=has_voted,
-                nb_user_votes=nb_user_votes - nb_votes,
-            )
-        else:
-            # Update vote
-            user_vote.nb_user_votes, user_vote.has_voted, user_vote.date_vote = (
-                user_vote.nb_user_votes - nb_votes,
-                has_voted,
-                timezone.now(),
+                nb_user_votes=cls.get_user_rights(event, user),
             )
-        user_vote.save()
-
-        # Update result in case of actual vote
-        if user_vote.has_voted == True and len(choices) > 0:
-            Result.add_vote(user, event, question, choices)
-
         return user_vote
 
     @classmethod
-    def init_uservotes(cls, event):
+    def get_rights_map(cls, event):
         """
-        Initializae user votes table
-        When the event is launchend, gather all info related to the vote, including procurations,
-            to define each user rights to vote
+        Number of votes of each user of the event, from the event's procurations graph
+        Returns a dict usercomp id -> number of votes
         """
-        event_user_list = [
-            user for user in UserComp.objects.filter(usergroup__event=event)
-        ]
-        question_list = Question.get_question_list(event)
-        user_group_list = UserGroup.get_group_list(event)
-        event_choice_list = Choice.get_choice_list(event)
-        for question in question_list:
-            for event_user in event_user_list:
-                nb_user_votes = 1
-                proxy_list, user_proxy, user_proxy_list = Procuration.get_proxy_status(
-                    event, event_user
-                )
-
-                if user_proxy:
-                    nb_user_votes = 0
-                elif user_proxy_list:
-                    nb_user_votes += len(user_proxy_list)
+        proxy_graph = Procuration.get_proxy_graph(event)
+        return {
+            user_id: cls.count_rights(*proxy_graph.get_proxy_counts(user_id))
+            for user_id in proxy_graph.members
+        }
 
-                cls.set_vote(event, event_user, question, nb_user_votes=nb_user_votes)
+    @classmethod
+    def init_uservotes(cls, event, question_list=None):
+        """
+        Initialize votes of the event when it is launched
+        Users' votes are not stored upfront : their rights are derived from their group and
+        confirmed procurations when they vote, so that launching does not depend on the
+        number of users. Results and tallies of the questions (default : all questions of the event)
+        are inserted in bulk, in one transaction
+        """
+        with transaction.atomic():
+            if question_list is None:
+                question_list = Question.get_question_list(event)
+            question_list = list(question_list)
+            user_group_list = list(UserGroup.get_group_list(event).annotate(nb_members=Count("users")))
+            event_choice_list = list(Choice.get_choice_list(event))
+
+            Result.objects.bulk_create([
+                Result(
+                    event=event,
+                    usergroup=usr_group,
+                    choice=event_choice,
+                    question=question,
+                    group_weight=usr_group.weight,
+                )
+                for question in question_list
+                for event_choice in event_choice_list
+                for usr_group in user_group_list
+            ])
 
-            for event_choice in event_choice_list:
-                for usr_group in user_group_list:
-                    Result.objects.create(
-                        event=event,
-                        usergroup=usr_group,
-                        choice=event_choice,
-                        question=question,
-                        group_weight=usr_group.weight,
-                    )
+            GroupTally.init_tallies(event, question_list, user_group_list, event_choice_list)
+            Question.update_results_versions(question.id for question in question_list)
 
 
 class Result(models.Model):
@@ -644,16 +926,82 @@ class Result(models.Model):
 
     @classmethod
     def add_vote(cls, user, event, question, choices):
-        for choice in choices:
-            res = cls.objects.get(
-                event=event,
-                usergroup__users=user,
-                usergroup__event=event,
-                question=question,
-                choice=choice,
+        """
+        Count user's votes with increments computed by the database :
+        concurrent votes on the same question can not overwrite each other
+        """
+        with transaction.atomic():
+            usergroup_id = UserGroup.objects.filter(
+                event=event, users=user
+            ).values_list("id", flat=True).first()
+            if usergroup_id is None:
+                raise cls.DoesNotExist("User is not part of the event's groups")
+
+            # A proxyholder may give several votes to the same choice
+            for choice, nb_votes in Counter(choices).items():
+                cls.objects.filter(
+                    event=event,
+                    usergroup_id=usergroup_id,
+                    question=question,
+                    choice=choice,
+                ).update(votes=F("votes") + nb_votes)
+
+            if choices:
+                GroupTally.add_vote(event, question, usergroup_id, choices)
+                question.update_results_version()
+
+        return usergroup_id
+
+    @classmethod
+    def get_tally(cls, event, question):
+        """ Gather the votes of all the event's groups for a question """
+        tally = cls.get_event_tallies(event, question=question).get(question.id)
+        if tally is None:
+            # Event not launched yet : no result, but choices are displayed anyway
+            tally = Tally(event.rule, [(choice.id, choice.choice_text) for choice in Choice.get_choice_list(event)])
+        return tally
+
+    @classmethod
+    def get_event_tallies(cls, event, question=None):
+        """
+        Gather the votes of all the event's groups, for each question (or a single one)
+        The whole questions x groups x choices matrix, with each group's number
+        of users, is loaded with one single query
+        Returns tallies per question id - questions with no result are missing
+        """
+        # Number of users is read from the group's tally, or counted for events
+        # launched before tallies were kept
+        tally_users = GroupTally.objects.filter(
+            question=OuterRef("question"), usergroup=OuterRef("usergroup")
+        ).values("nb_users")
+        nb_users = (
+            UserGroup.users.through.objects.filter(usergroup=OuterRef("usergroup"))
+            .order_by()
+            .values("usergroup")
+            .annotate(nb_users=Count("usercomp"))
+            .values("nb_users")
+        )
+        rows = cls.objects.filter(event=event)
+        if question is not None:
+            rows = rows.filter(question=question)
+        rows = (
+            rows.annotate(nb_users=Coalesce(
+                Subquery(tally_users, output_field=IntegerField()),
+                Subquery(nb_users, output_field=IntegerField()),
+            ))
+            .order_by("question", "usergroup__group_name", "usergroup", "choice__choice_no")
+            .values(
+                "question",
+                "usergroup",
+                "usergroup__group_name",
+                "group_weight",
+                "nb_users",
+                "choice",
+                "choice__choice_text",
+                "votes",
             )
-            res.votes += 1
-            res.save()
+        )
+        return Tally.from_event_rows(event.rule, rows)
 
     @classmethod
     def get_vote_list(cls, event, evt_group, question):
@@ -665,6 +1013,571 @@ class Result(models.Model):
         ).order_by("choice__choice_no")
 
 
+class GroupTally(models.Model):
+    """
+    Running totals of a group for a question
+    Rows are created when the event is launched, then updated with each vote
+    in the same transaction as results, so that reading results does not
+    require to count users and votes again
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, verbose_name="événement")
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, verbose_name="résolution")
+    usergroup = models.ForeignKey(
+        UserGroup, on_delete=models.CASCADE, verbose_name="groupe d'utilisateurs"
+    )
+    group_weight = models.IntegerField("poids", default=0)
+    nb_users = models.IntegerField("nombre de votants", default=0)
+    nb_votes = models.IntegerField("nombre de votes", default=0)
+
+    class Meta:
+        verbose_name = "Décompte par groupe"
+        verbose_name_plural = "Décomptes par groupe"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["question", "usergroup"], name="unique_group_tally_per_question"
+            )
+        ]
+
+    @classmethod
+    def init_tallies(cls, event, question_list, group_list, choice_list):
+        """
+        Initialize tallies of all questions when the event is launched, in bulk
+        Groups' number of users is read from a "nb_members" annotation if any
+        """
+        cls.objects.bulk_create([
+            cls(
+                event=event,
+                question=question,
+                usergroup=usr_group,
+                group_weight=usr_group.weight,
+                nb_users=usr_group.nb_members if hasattr(usr_group, "nb_members") else usr_group.nb_users,
+            )
+            for question in question_list
+            for usr_group in group_list
+        ])
+        ChoiceTally.objects.bulk_create([
+            ChoiceTally(event=event, question=question, choice=choice)
+            for question in question_list
+            for choice in choice_list
+        ])
+
+    @classmethod
+    def add_vote(cls, event, question, usergroup_id, choices):
+        """
+        Update group's and choices' tallies with a user's votes
+        Must be called within the transaction that updates results
+        Counts are increased by the database, with no lock taken beforehand : the
+        leading choice of each group (MAJ rule) is derived from results when they are read
+        """
+        group_weight = cls.objects.filter(
+            question=question, usergroup_id=usergroup_id
+        ).values_list("group_weight", flat=True).first()
+        if group_weight is None:
+            # Event launched before tallies were kept : nothing to update
+            return
+
+        # PROP score is kept as an integer sum of votes x weight : no rounding drift
+        for choice, nb_votes in Counter(choices).items():
+            ChoiceTally.objects.filter(question=question, choice=choice).update(
+                votes=F("votes") + nb_votes,
+                prop_score=F("prop_score") + nb_votes * group_weight,
+            )
+
+        cls.objects.filter(question=question, usergroup_id=usergroup_id).update(
+            nb_votes=F("nb_votes") + len(choices)
+        )
+
+
+class ChoiceTally(models.Model):
+    """
+    Running totals of a choice for a question, for all groups
+    PROP scores are kept, so that global results are read from a few rows
+    whatever the number of votes. MAJ scores depend on each group's leading
+    choice : they are derived from the groups x choices results when read
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, verbose_name="événement")
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, verbose_name="résolution")
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, verbose_name="choix")
+    votes = models.IntegerField("nombre de votes", default=0)
+    # Sum of votes x groups' weights : score is this sum / 100
+    prop_score = models.IntegerField("score à la proportionnelle (votes x poids)", default=0)
+
+    class Meta:
+        verbose_name = "Décompte par choix"
+        verbose_name_plural = "Décomptes par choix"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["question", "choice"], name="unique_choice_tally_per_question"
+            )
+        ]
+
+    @classmethod
+    def get_results(cls, event, question, tally=None):
+        """
+        Read global results of a question - None if no tally is available
+        With the MAJ rule, results are derived from the question's tally, read if not provided
+        """
+        if event.rule == "MAJ" and tally is not None:
+            return tally.get_results()
+        return cls.get_event_results(event, question=question).get(question.id)
+
+    @classmethod
+    def get_event_results(cls, event, question=None):
+        """
+        Read global results of all the event's questions (or a single one) with one query
+        Returns results per question id - questions with no tally are missing
+        """
+        if event.rule == "MAJ":
+            # Each group gives its weight to its leading choice, read from its results :
+            # the rule is applied to all questions at once
+            return Result.get_event_tallies(event, question=question).get_results()
+
+        tally_list = cls.objects.filter(event=event)
+        if question is not None:
+            tally_list = tally_list.filter(question=question)
+        tally_list = tally_list.order_by("question", "choice__choice_no").values_list(
+            "question", "choice__choice_text", "prop_score"
+        )
+
+        results = {}
+        for question_id, choice, prop_score in tally_list:
+            group_vote = results.setdefault(question_id, {})
+            if event.rule == "PROP":
+                group_vote[choice] = prop_score / 100
+
+        if event.rule == "PROP":
+            for group_vote in results.values():
+                to_percentages(group_vote)
+
+        return results
+
+
+class ResultsSnapshot(models.Model):
+    """
+    Results of a closed event, frozen once for all
+    Global and groups' results, turnout and quorum status of each question are
+    read from one single row, whatever later changes on groups and users
+    """
+    event = models.OneToOneField(Event, on_delete=models.CASCADE, verbose_name="événement")
+    closing_date = models.DateTimeField("date de clôture", default=timezone.now)
+    results = models.TextField("résultats")   # JSON : list of questions' results
+
+    class Meta:
+        verbose_name = "Résultats figés"
+        verbose_name_plural = "Résultats figés"
+
+    def __str__(self):
+        return "Résultats de l'événement {}".format(self.event_id)
+
+    @classmethod
+    def save_results(cls, event, event_results):
+        """ Freeze the event's results - replace any previous snapshot """
+        snapshot, created = cls.objects.update_or_create(
+            event=event,
+            defaults={"results": json.dumps(event_results), "closing_date": timezone.now()},
+        )
+        return snapshot
+
+    @classmethod
+    def get_results(cls, event):
+        """ Read frozen results of all the event's questions - None if the event has no snapshot """
+        results = cls.objects.filter(event=event).values_list("results", flat=True).first()
+        if results is None:
+            return None
+        return json.loads(results)
+
+    @classmethod
+    def get_chart_data(cls, event, question_no):
+        """ Read frozen charts data of a question - None if not found """
+        for question_results in cls.get_results(event) or []:
+            if question_results["question"]["question_no"] == question_no:
+                return question_results["chart_data"]
+        return None
+
+
+class Ballot(models.Model):
+    """
+    Ledger of all ballots : one row inserted for each vote, never updated but to be compacted
+    Ballots not compacted yet are still to be counted in results and tallies
+    Results, tallies and users' votes can be rebuilt from the ledger
+    """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, verbose_name="événement")
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, verbose_name="résolution")
+    usergroup = models.ForeignKey(
+        UserGroup, on_delete=models.CASCADE, verbose_name="groupe d'utilisateurs"
+    )
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, verbose_name="choix")
+    uservote = models.ForeignKey(UserVote, on_delete=models.CASCADE, verbose_name="vote utilisateur")
+    date_vote = models.DateTimeField("date du vote", default=timezone.now)
+    compacted = models.BooleanField("comptabilisé", default=False, db_index=True)
+
+    class Meta:
+        verbose_name = "Bulletin"
+        verbose_name_plural = "Bulletins"
+
+    def __str__(self):
+        return "Bulletin {} pour le choix {} de la question {}".format(
+            self.id, self.choice_id, self.question_id
+        )
+
+    @classmethod
+    def record(cls, ballots, compacted=True):
+        """ Insert ballots in the ledger, with one query """
+        cls.objects.bulk_create([
+            cls(
+                event_id=ballot["event"],
+                question_id=ballot["question"],
+                usergroup_id=ballot["usergroup"],
+                choice_id=ballot["choice"],
+                uservote_id=ballot["uservote"],
+                date_vote=parse_datetime(ballot["date"]) if "date" in ballot else timezone.now(),
+                compacted=compacted,
+            )
+            for ballot in ballots
+        ])
+
+    @classmethod
+    def count(cls, ballots):
+        """
+        Count ballots in results and tallies - must be called within a transaction
+        Results, tallies and results' versions are updated once per group, question and choice
+        """
+        result_votes = Counter(
+            (ballot["event"], ballot["question"], ballot["usergroup"], ballot["choice"]) for ballot in ballots
+        )
+        for (event_id, question_id, usergroup_id, choice_id), nb_votes in result_votes.items():
+            Result.objects.filter(
+                event_id=event_id, question_id=question_id, usergroup_id=usergroup_id, choice_id=choice_id
+            ).update(votes=F("votes") + nb_votes)
+
+        group_votes = {}
+        for ballot in ballots:
+            group_votes.setdefault((ballot["event"], ballot["question"], ballot["usergroup"]), []).append(ballot["choice"])
+        for (event_id, question_id, usergroup_id), choices in group_votes.items():
+            GroupTally.add_vote(event_id, question_id, usergroup_id, choices)
+
+        question_list = {ballot["question"] for ballot in ballots}
+        if question_list:
+            Question.update_results_versions(question_list)
+
+    @classmethod
+    def compact(cls, batch_size=500):
+        """
+        Count ballots not compacted yet, in one transaction
+        Ballots are flagged first : a batch also taken by another compaction is given up
+        Returns the number of ballots counted
+        """
+        with transaction.atomic():
+            ballots = list(
+                cls.objects.filter(compacted=False)
+                .order_by("id")
+                .values("id", "event", "question", "usergroup", "choice")[:batch_size]
+            )
+            ballot_ids = [ballot["id"] for ballot in ballots]
+            if cls.objects.filter(id__in=ballot_ids, compacted=False).update(compacted=True) != len(ballots):
+                transaction.set_rollback(True)
+                return 0
+            cls.count(ballots)
+
+        return len(ballots)
+
+    @classmethod
+    def rebuild(cls, event):
+        """
+        Rebuild results, tallies and users' votes of an event from its ledger
+        Users' votes left are their rights minus their ballots
+        """
+        with transaction.atomic():
+            cls.objects.filter(event=event, compacted=False).update(compacted=True)
+            ballots = list(
+                cls.objects.filter(event=event)
+                .order_by("id")
+                .values("event", "question", "usergroup", "choice", "uservote", "date_vote")
+            )
+
+            # Results and tallies are counted again from zero
+            Result.objects.filter(event=event).update(votes=0)
+            GroupTally.objects.filter(event=event).delete()
+            ChoiceTally.objects.filter(event=event).delete()
+            user_group_list = list(UserGroup.get_group_list(event).annotate(nb_members=Count("users")))
+            GroupTally.init_tallies(
+                event, Question.get_question_list(event), user_group_list, list(Choice.get_choice_list(event))
+            )
+            cls.count(ballots)
+
+            user_ballots = {}
+            for ballot in ballots:
+                user_ballots.setdefault(ballot["uservote"], []).append(ballot["date_vote"])
+            rights = UserVote.get_rights_map(event)
+            for user_vote in UserVote.objects.filter(event=event):
+                vote_dates = user_ballots.get(user_vote.id, [])
+                user_vote.nb_user_votes = rights.get(user_vote.user_id, 0) - len(vote_dates)
+                user_vote.has_voted = len(vote_dates) > 0
+                user_vote.date_vote = max(vote_dates) if vote_dates else None
+                user_vote.save()
+
+        return len(ballots)
+
+
+class JournalPosition(models.Model):
+    """
+    Position reached while counting a votes journal's ballots
+    Saved with each batch, so that an interrupted flush resumes where it stopped
+    """
+    journal = models.CharField("journal", max_length=255, unique=True)
+    position = models.BigIntegerField("position", default=0)
+
+    class Meta:
+        verbose_name = "Position du journal des votes"
+        verbose_name_plural = "Positions du journal des votes"
+
+    def __str__(self):
+        return "{} : {}".format(self.journal, self.position)
+
+
+class JobAbandoned(Exception):
+    """ Raised in a job found dead and replaced by another one, when it saves its progress """
+
+
+class Job(models.Model):
+    """
+    Long task run in the background, such as an event's launch
+    Its status and progress are saved, so that pages can follow it while it runs
+    A job whose progress has not changed for JOBS_STALE_TIMEOUT is considered dead (process stopped...)
+    """
+    statuses = [
+        ("PENDING", "En attente"),
+        ("RUNNING", "En cours"),
+        ("DONE", "Terminé"),
+        ("FAILED", "Echec"),
+    ]
+    kind = models.CharField("type", max_length=50)
+    company = models.ForeignKey(
+        Company, on_delete=models.CASCADE, null=True, blank=True, verbose_name="société"
+    )
+    event = models.ForeignKey(
+        Event, on_delete=models.CASCADE, null=True, blank=True, verbose_name="événement"
+    )
+    params = models.TextField("paramètres", default="{}")
+    status = models.CharField("statut", max_length=10, choices=statuses, default="PENDING", db_index=True)
+    progress = models.IntegerField("avancement", default=0)
+    message = models.TextField("message", blank=True)
+    result = models.TextField("résultat", default="{}")
+    created_date = models.DateTimeField("date de création", auto_now_add=True)
+    end_date = models.DateTimeField("date de fin", null=True, blank=True)
+    last_update = models.DateTimeField("dernière mise à jour", default=timezone.now)
+
+    class Meta:
+        verbose_name = "Tâche"
+
+    def __str__(self):
+        return "{} n° {} : {}".format(self.kind, self.id, self.get_status_display())
+
+    @classmethod
+    def create_job(cls, kind, company=None, event=None, **params):
+        if company is None and event is not None:
+            company = event.company
+        return cls.objects.create(kind=kind, company=company, event=event, params=json.dumps(params))
+
+    @classmethod
+    def claim(cls, job_id):
+        """ Set a pending job as running : returns it, or None if it already ran """
+        if not cls.objects.filter(id=job_id, status="PENDING").update(status="RUNNING", last_update=timezone.now()):
+            return None
+        return cls.objects.get(id=job_id)
+
+    @classmethod
+    def get_pending_jobs(cls):
+        return cls.objects.filter(status="PENDING").order_by("id")
+
+    @classmethod
+    def get_event_job(cls, event, kind):
+        """ Latest job of a kind for an event """
+        return cls.objects.filter(event=event, kind=kind).order_by("-id").first()
+
+    @classmethod
+    def release_dead_jobs(cls, event, kind):
+        """
+        Set as failed the jobs of a kind for an event which are pending or running, but whose
+        progress has not changed for JOBS_STALE_TIMEOUT : their process stopped without ending them
+        Returns True if no job of this kind is alive for the event
+        """
+        now = timezone.now()
+        alive_list = cls.objects.filter(event=event, kind=kind, status__in=["PENDING", "RUNNING"])
+        alive_list.filter(last_update__lt=now - datetime.timedelta(seconds=settings.JOBS_STALE_TIMEOUT)).update(
+            status="FAILED", end_date=now, message="Tâche interrompue"
+        )
+        return not alive_list.exists()
+
+    def get_params(self):
+        return json.loads(self.params)
+
+    def get_result(self):
+        return json.loads(self.result)
+
+    def set_progress(self, progress, message=None, result=None):
+        """
+        Save the job's progress (percentage), and optionally its partial result :
+        they are read by the status page while the job runs
+        Raises JobAbandoned if the job was found dead meanwhile : it has been replaced
+        """
+        self.progress = int(progress)
+        fields = {"progress": self.progress, "last_update": timezone.now()}
+        if message is not None:
+            self.message = fields["message"] = message
+        if result is not None:
+            self.result = fields["result"] = json.dumps(result)
+        if not Job.objects.filter(id=self.id).exclude(status="FAILED").update(**fields):
+            raise JobAbandoned("Tâche {} interrompue".format(self.id))
+
+    def set_done(self, message=None):
+        self.set_end("DONE", message)
+
+    def set_failed(self, message):
+        self.set_end("FAILED", message)
+
+    def set_end(self, status, message=None):
+        self.status = status
+        self.end_date = timezone.now()
+        fields = {"status": self.status, "end_date": self.end_date, "last_update": self.end_date}
+        if status == "DONE":
+            self.progress = fields["progress"] = 100
+        if message is not None:
+            self.message = fields["message"] = message
+        Job.objects.filter(id=self.id).update(**fields)
+
+    def get_status(self):
+        """ Job's status, as sent to the status page """
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "message": self.message,
+            "result": self.get_result(),
+        }
+
+
+class OutboxMail(models.Model):
+    """
+    Email waiting to be sent : mails are saved by requests and sent by a worker,
+    with the SMTP settings of their company
+    A mail which could not be sent is tried again later, until MAIL_MAX_ATTEMPTS
+    """
+    statuses = [
+        ("PENDING", "En attente"),
+        ("SENDING", "En cours d'envoi"),
+        ("SENT", "Envoyé"),
+        ("FAILED", "Echec"),
+    ]
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, verbose_name="société")
+    subject = models.CharField("objet", max_length=255)
+    message = models.TextField("message")
+    from_email = models.CharField("expéditeur", max_length=255)
+    to = models.TextField("destinataires", default="[]")
+    cc = models.TextField("copie", default="[]")
+    bcc = models.TextField("copie cachée", default="[]")
+    attach = models.CharField("pièce jointe", max_length=255, blank=True)
+    status = models.CharField("statut", max_length=10, choices=statuses, default="PENDING")
+    attempts = models.IntegerField("tentatives", default=0)
+    next_try = models.DateTimeField("prochaine tentative", default=timezone.now)
+    sender_id = models.CharField("envoi", max_length=32, blank=True)
+    error = models.TextField("erreur", blank=True)
+    created_date = models.DateTimeField("date de création", auto_now_add=True)
+    sent_date = models.DateTimeField("date d'envoi", null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Mail"
+        indexes = [models.Index(fields=["status", "next_try"], name="outbox_due")]
+
+    def __str__(self):
+        return "{} : {}".format(self.subject, ", ".join(self.get_to()))
+
+    @classmethod
+    def new_mail(cls, company, subject, message, to, cc=[], bcc=[], attach=""):
+        """ Mail to queue (not saved) """
+        return cls(
+            company=company,
+            subject=subject,
+            message=message,
+            from_email=company.hname,
+            to=json.dumps(to),
+            cc=json.dumps(cc),
+            bcc=json.dumps(bcc),
+            attach=attach,
+        )
+
+    @classmethod
+    def queue_mails(cls, mail_list):
+        return cls.objects.bulk_create(mail_list)
+
+    @classmethod
+    def get_due_mails(cls, company=None):
+        """
+        Mails to send now : pending ones, and those whose sending did not end in time
+        (sender stopped while sending)
+        """
+        mail_list = cls.objects.filter(status__in=["PENDING", "SENDING"], next_try__lte=timezone.now())
+        if company is not None:
+            mail_list = mail_list.filter(company=company)
+        return mail_list
+
+    @classmethod
+    def claim_mails(cls, sender_id, company_id, size):
+        """
+        Set due mails of a company as being sent by a sender : returns them, oldest first
+        They are due again after MAIL_SENDING_TIMEOUT seconds if the sender does not end
+        """
+        id_list = list(
+            cls.get_due_mails().filter(company_id=company_id).order_by("id").values_list("id", flat=True)[:size]
+        )
+        cls.objects.filter(id__in=id_list, status__in=["PENDING", "SENDING"]).update(
+            status="SENDING",
+            sender_id=sender_id,
+            next_try=timezone.now() + datetime.timedelta(seconds=settings.MAIL_SENDING_TIMEOUT),
+        )
+        return list(cls.objects.filter(id__in=id_list, status="SENDING", sender_id=sender_id).order_by("id"))
+
+    @classmethod
+    def set_sent(cls, mail_list):
+        cls.objects.filter(id__in=[mail.id for mail in mail_list]).update(
+            status="SENT", sent_date=timezone.now(), error=""
+        )
+
+    def set_error(self, error):
+        """ Try again later, with a delay doubled at each attempt, or give up after MAIL_MAX_ATTEMPTS """
+        self.attempts += 1
+        self.error = str(error)
+        if self.attempts >= settings.MAIL_MAX_ATTEMPTS:
+            self.status = "FAILED"
+        else:
+            self.status = "PENDING"
+            self.next_try = timezone.now() + datetime.timedelta(
+                seconds=settings.MAIL_RETRY_DELAY * 2 ** (self.attempts - 1)
+            )
+        OutboxMail.objects.filter(id=self.id).update(
+            status=self.status, attempts=self.attempts, next_try=self.next_try, error=self.error
+        )
+
+    @classmethod
+    def get_unused_attachments(cls, attach_list):
+        """ Attachments of attach_list which no mail is waiting to be sent with """
+        used = set(
+            cls.objects.filter(attach__in=attach_list, status__in=["PENDING", "SENDING"])
+            .values_list("attach", flat=True)
+        )
+        return [attach for attach in attach_list if attach not in used]
+
+    def get_to(self):
+        return json.loads(self.to)
+
+    def get_cc(self):
+        return json.loads(self.cc)
+
+    def get_bcc(self):
+        return json.loads(self.bcc)
+
+
 class Procuration(models.Model):
     """
     Procuration management
@@ -694,58 +1607,95 @@ class Procuration(models.Model):
         verbose_name = "Procuration"
 
     @classmethod
-    def get_proxy_status(cls, event, user):
+    def get_proxy_graph(cls, event):
+        """ Procurations of all members of the event, with one query """
+        user_proxy = cls.objects.filter(event=event, user=OuterRef("pk"))
+        member_list = (
+            UserComp.objects.filter(usergroup__event=event)
+            .select_related("user")
+            .annotate(
+                group_id=F("usergroup"),
+                proxy_id=Subquery(user_proxy.values("proxy")[:1]),
+                proxy_confirmed=Subquery(user_proxy.values("proxy_confirmed")[:1]),
+            )
+        )
+        return ProxyGraph(event, member_list)
+
+    @classmethod
+    def get_proxy_status(cls, event, user, proxy_graph=None):
+        """
+        User's procurations for the event :
+            - users who could receive his proxy, if he has no proxy and is not proxyholder
+            - his proxyholder, if he gave his proxy
+            - procurations he received, if he is proxyholder
+        """
+        if proxy_graph is None:
+            proxy_graph = cls.get_proxy_graph(event)
         user_proxy_list = []
         proxy_list = []
         user_proxy = None
-        if len(cls.objects.filter(proxy=user, event=event)) > 0:
+        held_list = proxy_graph.get_held_list(user)
+        if held_list:
             # Case user is proxyholder => get proxy list
-            user_proxy_list = cls.objects.filter(
-                proxy=user, event=event
-            ).order_by("usercomp__user__last_name")
-        elif len(cls.objects.filter(user=user)) > 0:
+            user_proxy_list = [
+                cls(event=event, user=member, proxy=user, proxy_confirmed=confirmed)
+                for member, confirmed in held_list
+            ]
+        elif proxy_graph.get_proxy(user) is not None:
             # Case user has given proxy => get proxyholder
-            usv = cls.objects.get(user=user)
-            user_proxy = UserComp.objects.get(id=usv.proxy.id)
+            user_proxy = proxy_graph.get_proxy(user)
         else:
             # Case user has no proxy and is not proxyholder
-            # => get list of users that could receive his proxy
-            # Get list of users from the same group (that is linked to the event),
-            # except the user himself and those who already gave proxy
-            # As values are restricted to user_id, we need to transform them
-            # into a list usable in the next request
-            id_list = [
-                int(proxy["user__id"]) for proxy in cls.objects.all().values("user__id")
-            ]
-            user_group = UserGroup.objects.get(event=event, users=user)
-            proxy_list = (
-                UserComp.objects.filter(usergroup=user_group)
-                .exclude(id=user.id)
-                .exclude(id__in=id_list)
-                .order_by("user__last_name")
-            )
+            # => get list of users from the same group, except the user himself and those who already gave proxy
+            proxy_list = proxy_graph.get_eligible_proxies(user)
         return proxy_list, user_proxy, user_proxy_list
 
+    @staticmethod
+    def proxies_open(event):
+        """
+        Procurations can be changed until the event is launched : users' rights are derived
+        from them when they vote, so they must not change once votes are possible
+        Must be called within a transaction : the event's row is locked, so that it is not launched meanwhile
+        """
+        return Event.objects.select_for_update().filter(
+            id=event.id, current=False, starting=False, closed=False
+        ).exists()
+
     @classmethod
     def set_user_proxy(cls, event, user, proxy):
-        cls.objects.create(
-            event=event, user=user, proxy=proxy, proxy_date=timezone.now()
-        )
+        """ Returns False if procurations can not be changed anymore """
+        with transaction.atomic():
+            if not cls.proxies_open(event):
+                return False
+            cls.objects.create(
+                event=event, user=user, proxy=proxy, proxy_date=timezone.now()
+            )
+        return True
 
     @classmethod
     def confirm_proxy(cls, event, user, proxy_id):
-        proc = cls.objects.get(user__id=proxy_id, proxy=user, event=event)
-        if not proc.proxy_confirmed:
-            proc.proxy_confirmed, proc.confirm_date = True, timezone.now()
-            proc.save()
+        """ Returns False if procurations can not be changed anymore """
+        with transaction.atomic():
+            if not cls.proxies_open(event):
+                return False
+            proc = cls.objects.get(user__id=proxy_id, proxy=user, event=event)
+            if not proc.proxy_confirmed:
+                proc.proxy_confirmed, proc.confirm_date = True, timezone.now()
+                proc.save()
+        return True
 
     @classmethod
     def cancel_proxy(cls, event, user, *args):
-        if len(args) == 1:
-            # Case a proxyholder refuse a proxy request
-            cls.objects.filter(
-                event=event, user__id=user, proxy=args[0]
-            ).delete()
-        else:
-            # Case a user cancels his proxy's request
-            cls.objects.filter(event=event, user=user).delete()
+        """ Returns False if procurations can not be changed anymore """
+        with transaction.atomic():
+            if not cls.proxies_open(event):
+                return False
+            if len(args) == 1:
+                # Case a proxyholder refuse a proxy request
+                cls.objects.filter(
+                    event=event, user__id=user, proxy=args[0]
+                ).delete()
+            else:
+                # Case a user cancels his proxy's request
+                cls.objects.filter(event=event, user=user).delete()
+        return True
@@ -1,9 +1,24 @@
 # -*-coding:Utf-8 -*
 
+import logging
+import mimetypes
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 from django.core.mail import EmailMessage, get_connection
 from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Company, UserComp, OutboxMail
+from .jobs import get_executor
+
+
+logger = logging.getLogger(__name__)
 
-from .models import Company, UserComp
+# Directory of the outbox's attachments, in MEDIA_ROOT
+OUTBOX_ATTACHMENTS = "outbox/"
 
 # Base texts for emails
 invite_text = """Bonjour {} {},
@@ -98,14 +113,8 @@ class PollsMail:
         self.actions[action]()
 
     def send_email_info(self):
-        # Send email method
-        with get_connection(
-            host=self.company.host,
-            port=self.company.port,
-            username=self.company.hname,
-            password=self.company.fax,
-            use_tls=self.company.use_tls,
-        ) as connection:
+        # Send email method : mail is sent immediately
+        with company_connection(self.company) as connection:
 
             self.msg = EmailMessage(
                 self.subject,
@@ -119,47 +128,60 @@ class PollsMail:
 
             self.msg.send()
 
-    def invite_users_message(self):
-        # Send invitation to all users
-        # Do not use send_email_info() method to open connexion only once
-        connection = get_connection(
-            host=self.company.host,
-            port=self.company.port,
-            username=self.company.hname,
-            password=self.company.fax,
-            use_tls=self.company.use_tls,
-        )
-
-        self.subject = "Invitation et ordre du jour"
-        for user in UserComp.objects.filter(usergroup__event=self.event):
-            if user.user.email:
-                self.recipient_list = [user.user.email]
-                self.message = invite_text.format(
-                    user.user.first_name,
-                    user.user.last_name,
-                    self.event.event_name,
-                    str(self.event.event_start_date),
-                )
-
-                self.msg = EmailMessage(
+    def queue_email_info(self):
+        # Mail is saved in the outbox, and sent out of the request
+        queue_mails(
+            self.company,
+            [
+                OutboxMail.new_mail(
+                    self.company,
                     self.subject,
                     self.message,
-                    self.company.hname,
                     self.recipient_list,
                     cc=self.cc_list,
                     bcc=self.bcc_list,
-                    connection=connection,
                 )
+            ],
+        )
 
-                if hasattr(self, "attach"):
-                    self.msg.attach_file(settings.MEDIA_ROOT + self.attach)
-                self.msg.send()
+    def invite_users_message(self):
+        # Send invitation to all users
+        # Recipients are read with one query, and invitations saved in the outbox
+        # with one statement : they are sent by batches over parallel connections
+        self.subject = "Invitation et ordre du jour"
+        recipient_list = (
+            UserComp.objects.filter(usergroup__event=self.event)
+            .exclude(user__email="")
+            .order_by("user__last_name", "id")
+            .values_list("id", "user__first_name", "user__last_name", "user__email")
+            .distinct()
+        )
 
-        connection.close()
+        mail_list = [
+            OutboxMail.new_mail(
+                self.company,
+                self.subject,
+                invite_text.format(
+                    first_name,
+                    last_name,
+                    self.event.event_name,
+                    str(self.event.event_start_date),
+                ),
+                [email],
+                cc=self.cc_list,
+                bcc=self.bcc_list,
+                attach=getattr(self, "attach", ""),
+            )
+            for user_id, first_name, last_name, email in recipient_list
+        ]
+        self.nb_mails = len(mail_list)
+        queue_mails(self.company, mail_list)
+        if not mail_list:
+            delete_attachments([getattr(self, "attach", "")])
 
     def ask_proxy_message(self):
         self.subject = "Pouvoir"
-        self.cc_list += self.sender
+        self.cc_list = self.cc_list + self.sender
         self.message = ask_proxy.format(
             self.proxy.user.first_name,
             self.event.event_name,
@@ -168,7 +190,7 @@ class PollsMail:
             self.user.user.last_name,
         )
 
-        self.send_email_info()
+        self.queue_email_info()
 
     def confirm_proxy_message(self):
         self.proxy = UserComp.objects.get(id=self.proxy_id)
@@ -177,7 +199,7 @@ class PollsMail:
             self.proxy.user.first_name, self.user.user.first_name, self.user.user.last_name
         )
 
-        self.send_email_info()
+        self.queue_email_info()
 
     def test_mail(self):
         self.company = self.comp
@@ -188,3 +210,154 @@ class PollsMail:
         self.recipient_list = ["gressinc@gmail.com"]
 
         self.send_email_info()
+
+
+def new_attachment(file_name):
+    """
+    Path (relative to MEDIA_ROOT) of a new attachment for the outbox, in its own directory :
+    it is never overwritten, so that mails sent later or tried again send the file they were queued with
+    It is deleted once all its mails are sent or failed
+    """
+    attach = "{}{}/{}".format(OUTBOX_ATTACHMENTS, uuid.uuid4().hex, file_name)
+    os.makedirs(os.path.dirname(settings.MEDIA_ROOT + attach))
+    return attach
+
+
+def delete_attachments(attach_list):
+    """ Delete the outbox's attachments of attach_list which no mail is waiting for anymore """
+    attach_list = [attach for attach in attach_list if attach.startswith(OUTBOX_ATTACHMENTS)]
+    if not attach_list:
+        return
+    for attach in OutboxMail.get_unused_attachments(attach_list):
+        shutil.rmtree(os.path.dirname(settings.MEDIA_ROOT + attach), ignore_errors=True)
+
+
+def company_connection(company):
+    """ Connection to the company's mail server """
+    return get_connection(
+        host=company.host,
+        port=company.port,
+        username=company.hname,
+        password=company.fax,
+        use_tls=company.use_tls,
+    )
+
+
+def queue_mails(company, mail_list):
+    """
+    Save mails in the outbox, and have them sent according to MAIL_RUNNER setting :
+        "thread" : by the background jobs' threads, once the mails are committed
+        "worker" : by the send_mails management command
+        "sync" : immediately, before returning
+    """
+    OutboxMail.queue_mails(mail_list)
+    if settings.MAIL_RUNNER == "sync":
+        send_pending_mails(company)
+    elif settings.MAIL_RUNNER == "thread":
+        transaction.on_commit(lambda: get_executor().submit(send_mails_thread, company.id))
+
+
+def send_mails_thread(company_id):
+    """ Send a company's mails in a background thread : the thread's database connection is closed afterwards """
+    try:
+        send_pending_mails(Company.objects.get(id=company_id))
+    except Exception:
+        logger.exception("Sending mails of company %s failed", company_id)
+    finally:
+        connection.close()
+
+
+def send_pending_mails(company=None):
+    """
+    Send due mails of the outbox (of all companies by default) : returns the number of mails sent
+    Mails of a company are sent by batches of MAIL_BATCH, each batch over its own connection
+    to the company's server, with at most MAIL_WORKERS connections at the same time
+    Mails which could not be sent are tried again later
+    Attachments are deleted once all their mails are sent or failed
+    """
+    sender_id = uuid.uuid4().hex
+    # Attachments are read only once
+    attachments = {}
+    nb_sent = 0
+    company_list = [company] if company else Company.objects.filter(
+        id__in=OutboxMail.get_due_mails().values("company")
+    )
+    for comp in company_list:
+        while True:
+            mail_list = OutboxMail.claim_mails(sender_id, comp.id, settings.MAIL_WORKERS * settings.MAIL_BATCH)
+            if not mail_list:
+                break
+
+            msg_list = []
+            for mail in mail_list:
+                try:
+                    msg_list.append((mail, get_message(mail, attachments)))
+                except OSError as error:
+                    mail.set_error(error)
+            batch_list = [
+                msg_list[i:i + settings.MAIL_BATCH]
+                for i in range(0, len(msg_list), settings.MAIL_BATCH)
+            ]
+            if not batch_list:
+                continue
+
+            # Threads only talk to the mail server : outbox is updated by this one
+            with ThreadPoolExecutor(max_workers=min(settings.MAIL_WORKERS, len(batch_list))) as executor:
+                results = list(executor.map(lambda batch: send_batch(comp, batch), batch_list))
+            for sent_list, error_list in results:
+                OutboxMail.set_sent(sent_list)
+                for mail, error in error_list:
+                    logger.warning("Mail %s not sent : %s", mail.id, error)
+                    mail.set_error(error)
+                nb_sent += len(sent_list)
+
+    delete_attachments(list(attachments))
+    return nb_sent
+
+
+def get_message(mail, attachments):
+    """ Email message of an outbox's mail : attachments' content is kept in a dict, by path """
+    msg = EmailMessage(
+        mail.subject,
+        mail.message,
+        mail.from_email,
+        mail.get_to(),
+        cc=mail.get_cc(),
+        bcc=mail.get_bcc(),
+    )
+    if mail.attach:
+        if mail.attach not in attachments:
+            file_path = settings.MEDIA_ROOT + mail.attach
+            with open(file_path, "rb") as f:
+                attachments[mail.attach] = (
+                    os.path.basename(file_path),
+                    f.read(),
+                    mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+                )
+        msg.attach(*attachments[mail.attach])
+    return msg
+
+
+def send_batch(company, batch):
+    """
+    Send messages over one connection : returns the mails sent, and those not sent with their error
+    batch is a list of (mail, message)
+    """
+    try:
+        mail_connection = company_connection(company)
+        mail_connection.open()
+    except Exception as error:
+        return [], [(mail, error) for mail, msg in batch]
+
+    sent_list, error_list = [], []
+    try:
+        for mail, msg in batch:
+            try:
+                mail_connection.send_messages([msg])
+            except Exception as error:
+                error_list.append((mail, error))
+            else:
+                sent_list.append(mail)
+    finally:
+        mail_connection.close()
+    return sent_list, error_list
@@ -0,0 +1,72 @@
+# -*-coding:Utf-8 -*
+
+''' Procurations of an event : who gave his proxy to whom, among the event's members '''
+
+
+class ProxyGraph:
+    """
+    Procurations of all members of an event
+    Built from the event's members, each one annotated with his group and the proxy
+    he gave for this event (if any) : status of every member is then answered with
+    no further query
+    """
+
+    def __init__(self, event, members=[]):
+        self.event = event
+        self.members = {}
+        self.groups = {}
+        self.given = {}
+        self.held = {}
+        for member in members:
+            self.add_member(member)
+
+    def add_member(self, member):
+        """
+        Add a member (UserComp annotated with group_id, proxy_id and proxy_confirmed)
+        A member of several groups of the event appears once for each group
+        """
+        self.members.setdefault(member.id, member)
+        self.groups.setdefault(member.id, set()).add(member.group_id)
+        if member.proxy_id is not None and member.id not in self.given:
+            self.given[member.id] = (member.proxy_id, bool(member.proxy_confirmed))
+            self.held.setdefault(member.proxy_id, []).append((member.id, bool(member.proxy_confirmed)))
+
+    def is_member(self, user):
+        return user.id in self.members
+
+    def get_proxy(self, user):
+        """ Member the user gave his proxy to, None if he did not """
+        if user.id not in self.given:
+            return None
+        return self.members.get(self.given[user.id][0])
+
+    def get_held_list(self, user):
+        """ Members who gave their proxy to the user, with the confirmation status : list of (member, confirmed) """
+        return sorted(
+            [(self.members[user_id], confirmed) for user_id, confirmed in self.held.get(user.id, [])],
+            key=lambda held: self.sort_key(held[0]),
+        )
+
+    def get_eligible_proxies(self, user):
+        """ Members who can receive the user's proxy : same group, and did not give their own proxy """
+        groups = self.groups.get(user.id, set())
+        return sorted(
+            [
+                member
+                for member_id, member in self.members.items()
+                if member_id != user.id
+                and member_id not in self.given
+                and self.groups[member_id] & groups
+            ],
+            key=self.sort_key,
+        )
+
+    def get_proxy_counts(self, user_id):
+        """ Confirmed procurations of a member : number of proxies received, and whether he gave his own """
+        proxy_received = sum(1 for held_id, confirmed in self.held.get(user_id, []) if confirmed)
+        proxy_given = self.given.get(user_id, (None, False))[1]
+        return proxy_received, proxy_given
+
+    @staticmethod
+    def sort_key(member):
+        return (member.user.last_name, member.id)
@@ -1,18 +1,58 @@
 # -*-coding:Utf-8 -*
 
+import threading
+from contextlib import contextmanager
+
 from .models import Company, UserGroup, UserComp
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+
+# Companies and users created within bulk_memberships(), for each thread
+_bulk = threading.local()
+
+
+@contextmanager
+def bulk_memberships():
+    """
+    Mass creation of companies and users : default groups and memberships to them,
+    usually created by the signals below for each instance, are inserted at the end
+    with one statement each
+    """
+    if getattr(_bulk, "companies", None) is not None:
+        # Already within a bulk creation : done by the outer one
+        yield
+        return
+
+    _bulk.companies, _bulk.usercomps = [], []
+    try:
+        with transaction.atomic():
+            yield
+            UserGroup.objects.bulk_create([
+                UserGroup(company_id=company_id, group_name="Default Group", weight=100, hidden=True)
+                for company_id in _bulk.companies
+            ])
+            UserComp.add_to_default_groups(_bulk.usercomps)
+    finally:
+        _bulk.companies, _bulk.usercomps = None, None
+
+
 # Create a default hidden group when a new company is created
 @receiver(post_save, sender=Company)
 def create_default_group(sender, instance, created, **kwargs):
     if created:
-        UserGroup.create_group(instance, "Default Group", weight=100, hidden=True)
+        if getattr(_bulk, "companies", None) is not None:
+            _bulk.companies.append(instance.id)
+        else:
+            UserGroup.create_group(instance, "Default Group", weight=100, hidden=True)
 
 # Each new user is added to the company's default hidden group
 @receiver(post_save, sender=UserComp)
 def add_to_default_group(sender, instance, created, **kwargs):
     if created:
-        def_group = instance.company.get_default_group()
-        def_group.users.add(instance)
+        if getattr(_bulk, "usercomps", None) is not None:
+            _bulk.usercomps.append(instance)
+        else:
+            def_group = instance.company.get_default_group()
+            def_group.users.add(instance)
@@ -164,131 +164,200 @@ $(document).ready(function() {
     //      EVENTS MANAGEMENT FUNCTIONS
     // =====================================
 
+    // Background jobs (event launch, users' import) : progress is displayed,
+    // then the page is reloaded once the job is done
+    function follow_job() {
+        var job_bar = $('#job_progress');
+        $.ajax({
+            method: "GET",
+            url: job_bar.attr("data-url"),
+            success: function(data) {
+                job_bar.css("width", data.progress + "%").attr("aria-valuenow", data.progress);
+                if ("nb_users" in data.result) {
+                    $('#job_message').text(
+                        data.result.nb_users + " utilisateur(s) créé(s), " + data.result.nb_warnings +
+                        " avertissement(s), " + data.result.nb_errors + " erreur(s)"
+                    );
+                }
+                if (data.status === "DONE" || (data.status === "FAILED" && job_bar.attr("data-reload-on-end"))) {
+                    location.reload();
+                }
+                else if (data.status === "FAILED") {
+                    job_bar.removeClass("bg-warning").addClass("bg-danger");
+                    $('#job_message').text("Le lancement de l'événement a échoué : " + data.message);
+                }
+                else {
+                    setTimeout(follow_job, 1000);
+                }
+            },
+            error: function() {
+                setTimeout(follow_job, 5000);
+            },
+        })
+    }
+
+    if ($('#job_progress').attr("data-url")) {
+        follow_job();
+    }
+    else if ($('#job_progress').length) {
+        // Launch started by someone else : the page is reloaded until the event is in progress
+        setTimeout(function() { location.reload(); }, 3000);
+    }
+
     // Charts creation
     function create_chart() {
         // As the template can either show the result or ask user to vote,
         // we need to check if the results are shown before actually launch the dedicated function
         if ($('#global_chart').length) {
             var ctx = $('#global_chart');
-            var prog_bar = $('#global_nb_votes');
-            var total_votes = 0;
-            var nb_votes = 0;
-            var quorum = parseInt($('#quorum').attr("data-quorum")) / 100;
-            var labels = [];
-            var values = [];
-            var backgroundColor = [];
-            var borderColor = [];
 
             $.ajax({
                 // Ajax request to look for new data
+                // ifModified: the server answers "304 Not Modified" if no vote occurred since last request
                 method: "GET",
                 url: ctx.attr("url-endpoint"),
-                data: {event_slug: ctx.attr("event-slug"), question_no: ctx.attr("question-no")},
-                success: function(data) {
-                    charts_data = data.chart_data['global'];
-                    nb_charts = data.nb_charts;
-
-                    backgroundColor = data.backgroundColor;
-                    borderColor = data.borderColor;
-
-
-                    // Global results chart
-                    setChartData();
-
-                    // Group results charts
-                    for (var i = 1; i <= nb_charts; i++) {
-                        ctx = $(`#chart${i}`);
-                        prog_bar = $(`#nb_votes${i}`);
-
-                        charts_data = data.chart_data[`chart${i}`];
-
-                        setChartData();
-
+                data: chart_params(ctx),
+                ifModified: true,
+                success: function(data, textStatus) {
+                    if (textStatus === "notmodified") {
+                        return;
                     }
+                    display_charts(data);
                 },
                 error: function(error_data){
                     console.log("error");
                     console.log(error_data);
                 }
             })
-        
-            function setChartData() {
-                total_votes = charts_data['total_votes'];
-                nb_votes = charts_data['nb_votes'];
+        }
+    }
 
-                // Sets the max value for progress bar
-                prog_bar.attr("aria-valuemax", total_votes);
+    function chart_params(ctx) {
+        return {comp_slug: ctx.attr("comp-slug"), event_slug: ctx.attr("event-slug"), question_no: ctx.attr("question-no")};
+    }
 
-                // If nb votes > quorum (min nb votes for the results to be valid)
-                // then displays the progress bar in green (orange by default)
-                if (nb_votes / total_votes > quorum) {
-                    prog_bar.removeClass("bg-warning").addClass("bg-success");
-                }
+    // Charts display, from data sent by the server
+    function display_charts(data) {
+        var ctx = $('#global_chart');
+        var prog_bar = $('#global_nb_votes');
+        var total_votes = 0;
+        var nb_votes = 0;
+        var quorum = parseInt($('#quorum').attr("data-quorum")) / 100;
+        var labels = [];
+        var values = [];
+        var backgroundColor = data.backgroundColor;
+        var borderColor = data.borderColor;
+        var charts_data = data.chart_data['global'];
+        var nb_charts = data.nb_charts;
 
-                // change chart and progress bar display only if changes occurred
-                if (prog_bar.attr("aria-valuenow") !== String(nb_votes)) {
-                    prog_bar.attr("aria-valuenow", nb_votes);
-                    display_prog = `${nb_votes} / ${total_votes}`;
-                    prog_bar.text(display_prog);
-                    progress = (nb_votes / total_votes) * 100;
-                    display_width = `width: ${progress}%`;
-                    prog_bar.attr("style", display_width);
-
-                    labels = charts_data['labels'];
-                    values = charts_data['values'];
-            
-                    setChart();
-                }
-            
+        // Global results chart
+        setChartData();
+
+        // Group results charts
+        for (var i = 1; i <= nb_charts; i++) {
+            ctx = $(`#chart${i}`);
+            prog_bar = $(`#nb_votes${i}`);
+
+            charts_data = data.chart_data[`chart${i}`];
+
+            setChartData();
+
+        }
+
+        function setChartData() {
+            total_votes = charts_data['total_votes'];
+            nb_votes = charts_data['nb_votes'];
+
+            // Sets the max value for progress bar
+            prog_bar.attr("aria-valuemax", total_votes);
+
+            // If nb votes > quorum (min nb votes for the results to be valid)
+            // then displays the progress bar in green (orange by default)
+            if (nb_votes / total_votes > quorum) {
+                prog_bar.removeClass("bg-warning").addClass("bg-success");
             }
-            
-            
-            function setChart(){
-                // Design standard chart.js chart
-                var myChart = new Chart(ctx, {
-                    type: 'doughnut',
-                    data: {
-                        labels: labels,
-                        datasets: [{
-                            label: '# of Votes',
-                            data: values,
-                            backgroundColor: backgroundColor,
-                            borderColor: borderColor,
-                            hoverBackgroundColor: borderColor,
-                            borderWidth: 1
-                        }]
+
+            // change chart and progress bar display only if changes occurred
+            if (prog_bar.attr("aria-valuenow") !== String(nb_votes)) {
+                prog_bar.attr("aria-valuenow", nb_votes);
+                display_prog = `${nb_votes} / ${total_votes}`;
+                prog_bar.text(display_prog);
+                progress = (nb_votes / total_votes) * 100;
+                display_width = `width: ${progress}%`;
+                prog_bar.attr("style", display_width);
+
+                labels = charts_data['labels'];
+                values = charts_data['values'];
+
+                setChart();
+            }
+
+        }
+
+
+        function setChart(){
+            // Design standard chart.js chart
+            var myChart = new Chart(ctx, {
+                type: 'doughnut',
+                data: {
+                    labels: labels,
+                    datasets: [{
+                        label: '# of Votes',
+                        data: values,
+                        backgroundColor: backgroundColor,
+                        borderColor: borderColor,
+                        hoverBackgroundColor: borderColor,
+                        borderWidth: 1
+                    }]
+                },
+                options: {
+                    legend: {
+                        display: true,
+                        position: 'bottom'
                     },
-                    options: {
-                        legend: {
-                            display: true,
-                            position: 'bottom'
-                        },
-                        title: {
-                            display: true,
-                            text: 'Nombre de votes'
-                        }
+                    title: {
+                        display: true,
+                        text: 'Nombre de votes'
                     }
-                });
-            }
+                }
+            });
         }
     }
 
 
     // Toggle button management
     // Activate or deactivate auto-refresh
+    var chart_source = null;
     $('#switch').on("mousedown", function (e) {
         if ($(this).hasClass("unactive")) {
             // Activate auto-refresh
-            // At regular interval, launch request to get new data
             $(this).removeClass("unactive").addClass("active");
-            IntervalID = setInterval(create_chart, 5000);
-            $(this).attr('inter-id', IntervalID)
+            let ctx = $('#global_chart');
+            if (window.EventSource && ctx.attr("stream-endpoint")) {
+                // The server pushes new data as soon as votes occur
+                // (the browser reconnects by itself when the stream ends)
+                chart_source = new EventSource(ctx.attr("stream-endpoint") + "?" + $.param(chart_params(ctx)));
+                chart_source.addEventListener("chart", function (event) {
+                    display_charts(JSON.parse(event.data));
+                });
+            }
+            else {
+                // At regular interval, launch request to get new data
+                IntervalID = setInterval(create_chart, 5000);
+                $(this).attr('inter-id', IntervalID)
+            }
         }
         else {
             // Unactivate auto-refresh - Stop regular request
             $(this).removeClass("active").addClass("unactive");
-            IntervalID = $(this).attr('inter-id');
-            clearInterval(IntervalID);
+            if (chart_source) {
+                chart_source.close();
+                chart_source = null;
+            }
+            else {
+                IntervalID = $(this).attr('inter-id');
+                clearInterval(IntervalID);
+            }
         }
     })
 
@@ -298,6 +367,16 @@ $(document).ready(function() {
     // =====================================
 
     var vote_form = $('#vote')
+    var vote_retries = 3;
+
+    function idempotency_key() {
+        // Unique key for each vote : a vote sent again is not counted twice
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + Math.random().toString(36).slice(2);
+    }
+
     // Ajax POST request to send user's vote choice
     vote_form.on("submit", function(event) {
         event.preventDefault();
@@ -306,12 +385,25 @@ $(document).ready(function() {
         if (user_vote > 0) {
             post_url = vote_form.attr('data-url');
             data = {choice: user_vote, event: vote_form.attr('data-event'), question: vote_form.attr('data-question')}
+            send_vote(idempotency_key(), vote_retries);
+        }
+
+        function send_vote(key, retries) {
             $.ajax({
                 method: "POST",
                 url: post_url,
                 data: data,
+                headers: {"Idempotency-Key": key},
                 success: handleSuccess,
-                error: handleError,
+                error: function(jqXHR, textStatus, errorThrown) {
+                    // Network failure or vote still in progress : send the same vote again
+                    if ((jqXHR.status === 0 || jqXHR.status === 409 || jqXHR.status >= 502) && retries > 0) {
+                        setTimeout(function() { send_vote(key, retries - 1); }, 1000);
+                    }
+                    else {
+                        handleError(jqXHR, textStatus, errorThrown);
+                    }
+                },
             })
         }
 
@@ -339,6 +431,12 @@ $(document).ready(function() {
         }
 
         function handleError(jqXHR, textStatus, errorThrown){
+            if (jqXHR.status === 403) {
+                // Vote refused : no vote left or event not in progress anymore
+                $('[name="choice"]').prop('checked', false).attr('disabled', true);
+                $('#submit-btn').attr('disabled', true);
+                $('#submit-btn').removeClass('btn-success').addClass('btn-grey');
+            }
             console.log(jqXHR);
             console.log(textStatus);
             console.log(errorThrown);
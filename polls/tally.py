@@ -0,0 +1,208 @@
+# -*-coding:Utf-8 -*
+
+''' Votes tally of an event : questions x groups x choices array and rules '''
+
+import numpy as np
+
+
+class EventTally(dict):
+    """
+    Votes of all groups of an event for all its questions, per question id
+    Votes are stored in one questions x groups x choices array of counts, with a
+    questions x groups array of weights : rules (MAJ / PROP) are applied to all
+    questions at once. Each question's Tally is a view on these arrays
+    """
+
+    def __init__(self, rule, question_ids, choices, groups):
+        """
+        choices : list of (choice id, label), in display order
+        groups : list of (group id, name), in the event's group order
+        """
+        super().__init__()
+        self.rule = rule
+        self.question_ids = list(question_ids)
+        self.choice_ids = [choice_id for choice_id, label in choices]
+        self.labels = [label for choice_id, label in choices]
+        self.group_ids = [group_id for group_id, name in groups]
+        self.group_names = [name for group_id, name in groups]
+        shape = (len(self.question_ids), len(self.group_ids), len(self.choice_ids))
+        self.votes = np.zeros(shape, dtype=np.int64)
+        self.weights = np.zeros(shape[:2], dtype=np.int64)
+        self.users = np.zeros(shape[:2], dtype=np.int64)
+        # Groups having results for each question
+        self.has_group = np.zeros(shape[:2], dtype=bool)
+
+    @classmethod
+    def from_rows(cls, rule, rows, choices=None):
+        """
+        Build the tallies from Result rows ordered by question, group then choice
+        Each row gives the question (if any), the group, its weight and number of users,
+        the choice's id and label, and the related number of votes
+        Choices, if not provided, are those of the rows, in the same order
+        """
+        rows = list(rows)
+        questions = {}
+        groups = {}
+        row_choices = {}
+        for row in rows:
+            questions.setdefault(row.get("question"), len(questions))
+            groups.setdefault(row["usergroup"], row["usergroup__group_name"])
+            row_choices.setdefault(row["choice"], row["choice__choice_text"])
+        if choices is None:
+            choices = list(row_choices.items())
+
+        event_tally = cls(rule, questions, choices, groups.items())
+        if not rows:
+            return event_tally
+
+        column = {choice_id: i for i, choice_id in enumerate(event_tally.choice_ids)}
+        line = {group_id: i for i, group_id in enumerate(event_tally.group_ids)}
+        index = np.array(
+            [(questions[row.get("question")], line[row["usergroup"]], column[row["choice"]]) for row in rows]
+        ).T
+        question_index, group_index, choice_index = index
+        event_tally.votes[question_index, group_index, choice_index] = [row["votes"] for row in rows]
+        event_tally.weights[question_index, group_index] = [row["group_weight"] for row in rows]
+        event_tally.users[question_index, group_index] = [row["nb_users"] or 0 for row in rows]
+        event_tally.has_group[question_index, group_index] = True
+
+        for i, question_id in enumerate(event_tally.question_ids):
+            event_tally[question_id] = Tally.from_event_tally(event_tally, i)
+        return event_tally
+
+    def get_results(self):
+        """ Calculate global results of all questions, per question id and choice """
+        scores = get_scores(self.rule, self.votes, self.weights)
+        return dict(zip(self.question_ids, get_results(self.rule, self.labels, scores)))
+
+
+class Tally:
+    """
+    Votes of all groups of an event for one question
+    Votes are stored as a groups x choices array of counts, with a vector
+    of groups' weights : rules (MAJ / PROP) are then applied on rows and
+    columns of the array. Columns are identified by the choices' ids,
+    labels are only used to display results
+    """
+
+    def __init__(self, rule, choices=None):
+        """ choices : list of (choice id, label), in display order """
+        self.rule = rule
+        self.choice_ids = [choice_id for choice_id, label in choices or []]
+        self.labels = [label for choice_id, label in choices or []]
+        self.group_ids = []
+        self.group_names = []
+        self.weights = []
+        self.users = []
+        self.votes = np.zeros((0, len(self.choice_ids)), dtype=np.int64)
+
+    @classmethod
+    def from_event_tally(cls, event_tally, index):
+        """ Tally of the question at this index of the event's arrays, restricted to its groups """
+        has_group = event_tally.has_group[index]
+        tally = cls(event_tally.rule, list(zip(event_tally.choice_ids, event_tally.labels)))
+        tally.group_ids = [group_id for group_id, has in zip(event_tally.group_ids, has_group) if has]
+        tally.group_names = [name for name, has in zip(event_tally.group_names, has_group) if has]
+        tally.weights = event_tally.weights[index, has_group].tolist()
+        tally.users = event_tally.users[index, has_group].tolist()
+        tally.votes = event_tally.votes[index, has_group]
+        return tally
+
+    @classmethod
+    def from_rows(cls, rule, rows, choices=None):
+        """ Build the tally of a question from Result rows ordered by group then by choice """
+        event_tally = EventTally.from_rows(rule, rows, choices)
+        if not event_tally:
+            return cls(rule, list(zip(event_tally.choice_ids, event_tally.labels)))
+        return next(iter(event_tally.values()))
+
+    @classmethod
+    def from_event_rows(cls, rule, rows, choices=None):
+        """ Build tallies of several questions from rows ordered by question, group then choice """
+        return EventTally.from_rows(rule, rows, choices)
+
+    @property
+    def matrix(self):
+        """ Groups x choices votes, as lists """
+        return self.votes.tolist()
+
+    @property
+    def groups(self):
+        """ Each group's votes, in the event's group order """
+        return [
+            {
+                "id": group_id,
+                "name": name,
+                "weight": weight,
+                "nb_users": nb_users,
+                "labels": self.labels,
+                "values": values,
+            }
+            for group_id, name, weight, nb_users, values in zip(
+                self.group_ids, self.group_names, self.weights, self.users, self.matrix
+            )
+        ]
+
+    @property
+    def nb_votes(self):
+        return int(self.votes.sum())
+
+    @property
+    def nb_users(self):
+        return sum(self.users)
+
+    def get_scores(self):
+        """ Apply the event's rule : weighted score of each choice, in choices' order """
+        weights = np.array(self.weights, dtype=np.int64).reshape(1, -1)
+        return get_scores(self.rule, self.votes[np.newaxis], weights)[0].tolist()
+
+    def get_results(self):
+        """ Calculate global results, per choice """
+        weights = np.array(self.weights, dtype=np.int64).reshape(1, -1)
+        scores = get_scores(self.rule, self.votes[np.newaxis], weights)
+        return get_results(self.rule, self.labels, scores)[0]
+
+
+def get_scores(rule, votes, weights):
+    """
+    Apply the event's rule to all questions at once
+    votes : questions x groups x choices array, weights : questions x groups array
+    Returns the questions x choices array of weighted scores
+    """
+    nb_questions, nb_groups, nb_choices = votes.shape
+
+    # Use if / elif to ease adding future rules
+    if rule == "MAJ" and nb_choices:
+        # Each group gives its weight to its leading choice (the first one in case of equality)
+        # Règles à définir : cas d'égalité, cas où pas de valeur
+        leaders = votes.argmax(axis=2)
+        is_leader = leaders[..., np.newaxis] == np.arange(nb_choices)
+        return (is_leader * weights[..., np.newaxis]).sum(axis=1)
+    if rule == "PROP":
+        # Votes of each choice times groups' weights
+        return (votes * weights[..., np.newaxis]).sum(axis=1) / 100
+
+    return np.zeros((nb_questions, nb_choices), dtype=np.int64)
+
+
+def get_results(rule, labels, scores):
+    """ Convert a questions x choices array of scores into a list of results per choice """
+    if rule == "PROP":
+        # Percentages, only for questions with at least 1 vote
+        totals = scores.sum(axis=1, keepdims=True)
+        percentages = scores / np.where(totals > 0, totals, 1) * 100
+        return [
+            dict(zip(labels, (round(value, 2) for value in row) if total > 0 else row))
+            for row, total in zip(percentages.tolist(), totals[:, 0].tolist())
+        ]
+
+    return [dict(zip(labels, row)) for row in scores.tolist()]
+
+
+def to_percentages(group_vote):
+    """ Convert weighted votes into percentage for each choice, only if at least 1 vote """
+    total_votes = sum(group_vote.values())
+    if total_votes > 0:
+        for choice, value in group_vote.items():
+            group_vote[choice] = round((value / total_votes) * 100, 2)
+    return group_vote
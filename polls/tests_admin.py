@@ -5,9 +5,16 @@
 # ===================================
 '''
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.shortcuts import reverse
 from django.contrib.auth.models import User
+from django.contrib.messages import get_messages
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from io import BytesIO
+
+import json
+import openpyxl
 
 from .tools_tests import (
     set_default_context,
@@ -21,7 +28,9 @@ from .models import (
     Choice,
     UserGroup,
     UserComp,
+    Job,
 )
+from .jobs import run_pending_jobs
 
 
 class TestOptions(TestCase):
@@ -126,6 +135,71 @@ class TestAdmUsers(TestCase):
             UserComp.objects.get(id=test_usercomp_id)
 
 
+    def users_file(self):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        ws.title = "Feuil1"
+        ws.append(["Nom", "Prénom", "Mail", "Téléphone", "Username"])
+        ws.append(["Dupont", "Jean", "jean@test.com", "01 02 03 04 05", None])
+        ws.append(["Dupont", "Marie", "marie@test.com", "123", None])
+        ws.append(["Dupont", "Jean", "jean@test.com", None, None])
+        ws.append(["Martin", "Paul", "paul@test.com", None, "user11"])
+        users_file = BytesIO()
+        wb.save(users_file)
+        return SimpleUploadedFile("users.xlsx", users_file.getvalue())
+
+    @override_settings(USERS_IMPORT_BATCH=1, USERS_IMPORT_RUNNER="sync")
+    def test_adm_load_users(self):
+        url = reverse("polls:adm_load_users", args=[self.company.comp_slug])
+        response = self.client.post(url, {"file": self.users_file(), "sheet": "Feuil1", "use_groups": True}, follow=True)
+        self.assertEqual(response.status_code, 200)
+        # Import's summary is delivered once, when it is finished
+        self.assertEqual(response.redirect_chain[-1][0], reverse("polls:adm_users", args=[self.company.comp_slug]))
+        msg = [str(message) for message in response.context["messages"]]
+        self.assertEqual(msg[0], "2 utilisateurs sur 4 correctement intégrés, 1 avertissement(s).")
+        self.assertIn("Utilisateur Dupont Jean non créé : il existe déjà", msg)
+        self.assertIn("Utilisateur Martin Paul non créé : il existe déjà", msg)
+
+        # Username is completed with first name's chars when already used
+        usr_comp = UserComp.objects.get(user__username="dupontm")
+        self.assertEqual(usr_comp.phone_num, "")
+        self.assertTrue(usr_comp.user.check_password("dupontm"))
+        self.assertEqual(UserComp.objects.get(user__username="dupont").phone_num, "01 02 03 04 05")
+        self.assertEqual(self.company.get_default_group().users.filter(user__last_name="Dupont").count(), 2)
+
+    @override_settings(USERS_IMPORT_BATCH=1, JOBS_RUNNER="thread")
+    def test_adm_load_users_in_background(self):
+        # Imports are run by the worker, even when other jobs are run by threads of the web process
+        url = reverse("polls:adm_load_users", args=[self.company.comp_slug])
+        response = self.client.post(url, {"file": self.users_file(), "sheet": "Feuil1", "use_groups": True})
+        job = Job.objects.get(kind="import_users")
+        self.assertEqual(job.status, "PENDING")
+        users_url = reverse("polls:adm_users", args=[self.company.comp_slug]) + "?job={}".format(job.id)
+        self.assertRedirects(response, users_url)
+
+        # Import in progress
+        response = self.client.get(users_url)
+        self.assertContains(response, "Chargement du fichier en cours")
+        self.assertEqual(run_pending_jobs(), 1)
+        response = self.client.get(reverse("polls:job_status", args=(job.id,)))
+        status = json.loads(response.content)
+        self.assertEqual(status["status"], "DONE")
+        self.assertEqual(status["result"]["nb_users"], 2)
+        self.assertEqual(status["result"]["nb_errors"], 2)
+
+        # Import's status and result are not disclosed to voters
+        self.client.force_login(create_dummy_user(self.company, "voter").user)
+        response = self.client.get(reverse("polls:job_status", args=(job.id,)))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(USERS_IMPORT_RUNNER="sync")
+    def test_adm_load_users_wrong_sheet(self):
+        url = reverse("polls:adm_load_users", args=[self.company.comp_slug])
+        response = self.client.post(url, {"file": self.users_file(), "sheet": "Feuil2", "use_groups": True}, follow=True)
+        msg = [str(message) for message in response.context["messages"]]
+        self.assertEqual(msg, ["Chargement du fichier impossible : l'onglet Feuil2 n'existe pas"])
+
+
 class TestUserProfile(TestCase):
     def setUp(self):
         self.company = create_dummy_company("Société de test")
@@ -1,19 +1,26 @@
 # -*-coding:Utf-8 -*
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.core.management import call_command
 from django.utils import timezone
 from django.utils.text import slugify
 from django.shortcuts import reverse, get_list_or_404, get_object_or_404
 from django.contrib.auth.models import User
+from django.contrib.auth.hashers import check_password
 from django.core import mail
-from django.core.files import File
-from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 # from django.db.models import Sum
 
 # from unittest import mock
 
 import os
+import shutil
 import datetime
+from io import StringIO
+import json
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 from .tools_tests import (
     create_dummy_user,
@@ -33,10 +40,17 @@ from .models import (
     Result,
     Procuration,
     UserComp,
+    ResultsSnapshot,
+    GroupTally,
+    ChoiceTally,
+    JournalPosition,
+    OutboxMail,
 )
 
-from .tools import set_chart_data, init_event
-from .pollsmail import PollsMail
+from .tools import set_chart_data, get_cached_chart_data, init_event, close_event, hash_passwords
+from .tally import Tally
+from .journal import append_ballot, flush_journal
+from .pollsmail import PollsMail, new_attachment, send_pending_mails
 
 
 # ===================================
@@ -49,8 +63,7 @@ class TestSetChartData(TestCase):
         self.test_data = set_full_context()
 
     def test_chart_first_question_maj(self):
-        evt_group_list = UserGroup.get_group_list(self.test_data["event1"])
-        data = set_chart_data(self.test_data["event1"], evt_group_list, self.test_data["question_list_1"][0])
+        data = set_chart_data(self.test_data["event1"], self.test_data["question_list_1"][0])
 
         # Global variables
         self.assertEqual(data["nb_charts"], 2)
@@ -68,12 +81,41 @@ class TestSetChartData(TestCase):
         self.assertEqual(group_data["nb_votes"], 4)
         self.assertEqual(group_data["total_votes"], 4)
 
+    def test_chart_data_single_query(self):
+        # Adding groups to the event must not add queries
+        question = self.test_data["question_list_1"][0]
+        group3 = UserGroup.create_group(self.test_data["company"], "Groupe 3", weight=0)
+        self.test_data["event1"].groups.add(group3)
+        for choice in self.test_data["choice_list_1"]:
+            Result.objects.create(
+                event=self.test_data["event1"],
+                usergroup=group3,
+                question=question,
+                choice=choice,
+            )
+
+        # Groups' counts : MAJ results are derived from them
+        with self.assertNumQueries(1):
+            data = set_chart_data(self.test_data["event1"], question)
+        self.assertEqual(data["nb_charts"], 3)
+        self.assertEqual(data["chart_data"]["chart3"]["total_votes"], 0)
+
+    def test_chart_global_data_read_tallies(self):
+        event = self.test_data["event1"]
+        question = self.test_data["question_list_1"][0]
+        init_event(event)
+        UserVote.set_vote(event, self.test_data["usr11"], question, choices=[self.test_data["choice_list_1"][1]])
+
+        data = set_chart_data(event, question)
+        self.assertEqual(
+            data["chart_data"]["global"]["values"], list(ChoiceTally.get_results(event, question).values())
+        )
+
     def test_get_results_prop(self):
         self.test_data["event1"].rule = "PROP"
         self.test_data["event1"].save()
 
-        evt_group_list = UserGroup.get_group_list(self.test_data["event1"])
-        data = set_chart_data(self.test_data["event1"], evt_group_list, self.test_data["question_list_1"][0])
+        data = set_chart_data(self.test_data["event1"], self.test_data["question_list_1"][0])
         global_data = data["chart_data"]["global"]
 
         # Global data
@@ -88,8 +130,7 @@ class TestSetChartData(TestCase):
         self.test_data["event1"].rule = "PROP"
         self.test_data["event1"].save()
 
-        evt_group_list = UserGroup.get_group_list(self.test_data["event1"])
-        data = set_chart_data(self.test_data["event1"], evt_group_list, self.test_data["question_list_1"][0])
+        data = set_chart_data(self.test_data["event1"], self.test_data["question_list_1"][0])
         global_data = data["chart_data"]["global"]
 
         # Global data
@@ -100,9 +141,16 @@ class TestSetChartData(TestCase):
         self.assertEqual(group_data["values"], [3, 1])
 
 
+@override_settings(MAIL_RUNNER="sync")
 class TestPollsMail(TestCase):
     def setUp(self):
         self.test_data = set_default_context()
+        # Files are created in a temporary media directory : files of the repository are left unchanged
+        self.media_root = os.path.join(tempfile.mkdtemp(), "")
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
         # self.company = create_dummy_company("Société de test")
         # event_start_date = timezone.now() + datetime.timedelta(days=1)
         # self.event = Event.objects.create(
@@ -150,16 +198,367 @@ class TestPollsMail(TestCase):
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, "Confirmation de pouvoir")
 
-    def test_invite_users_message(self):
-        # Create dummy file
-        with open(os.path.join(settings.MEDIA_ROOT, "pdf/test_file.pdf"), "w") as f:
-            dummy_file = File(f)
-            dummy_file.write("Liste des résolutions")
+    def create_attachment(self):
+        os.mkdir(os.path.join(self.media_root, "pdf"))
+        with open(os.path.join(self.media_root, "pdf/test_file.pdf"), "w") as f:
+            f.write("Liste des résolutions")
 
+    def test_invite_users_message(self):
+        self.create_attachment()
         PollsMail("invite", self.test_data["event1"], attach="pdf/test_file.pdf")
         self.assertEqual(len(mail.outbox), 6)
         self.assertEqual(mail.outbox[0].subject, "Invitation et ordre du jour")
 
+    @override_settings(MAIL_RUNNER="worker", MAIL_WORKERS=2, MAIL_BATCH=4)
+    def test_invite_users_message_batches(self):
+        self.create_attachment()
+
+        # Company and recipients are read once, and invitations saved at once, whatever the number of members
+        with self.assertNumQueries(3):
+            invite = PollsMail("invite", self.test_data["event1"], attach="pdf/test_file.pdf")
+        self.assertEqual(invite.nb_mails, 6)
+        self.assertEqual(OutboxMail.objects.filter(status="PENDING").count(), 6)
+        self.assertEqual(len(mail.outbox), 0)
+
+        out = StringIO()
+        call_command("send_mails", stdout=out)
+        self.assertEqual(out.getvalue(), "6 mail(s) envoyé(s)\n")
+        self.assertEqual(OutboxMail.objects.filter(status="SENT").count(), 6)
+        self.assertEqual(
+            sorted(msg.to[0] for msg in mail.outbox),
+            sorted(
+                usr.user.email
+                for usr in UserComp.objects.filter(usergroup__event=self.test_data["event1"]).distinct()
+            ),
+        )
+        for msg in mail.outbox:
+            self.assertEqual(msg.attachments, [("test_file.pdf", "Liste des résolutions".encode(), "application/pdf")])
+
+    @override_settings(MAIL_RUNNER="worker", EMAIL_BACKEND="polls.tools_tests.FailingEmailBackend")
+    def test_invite_attachment_per_invitation(self):
+        # Invitations of two events are queued before being sent : each mail is sent with its event's file
+        # One member of event 1 only can not receive mails
+        User.objects.filter(id=self.test_data["usr21"].user.id).update(email="fail@toto.com")
+        attach_list = []
+        for event in (self.test_data["event1"], self.test_data["event2"]):
+            attach = new_attachment("resolutions.pdf")
+            with open(self.media_root + attach, "w") as f:
+                f.write(event.event_name)
+            PollsMail("invite", event, attach=attach)
+            attach_list.append(attach)
+        self.assertEqual(len(set(attach_list)), 2)
+
+        # File is kept while one of its mails is waiting to be tried again
+        self.assertEqual(send_pending_mails(), 9)
+        for msg in mail.outbox:
+            event_name = msg.attachments[0][1].decode()
+            self.assertIn(event_name, msg.body)
+            self.assertEqual(msg.attachments[0][0], "resolutions.pdf")
+        self.assertTrue(os.path.exists(self.media_root + attach_list[0]))
+        self.assertFalse(os.path.exists(os.path.dirname(self.media_root + attach_list[1])))
+
+        # Deleted once the last mail failed
+        with override_settings(MAIL_MAX_ATTEMPTS=1):
+            OutboxMail.objects.filter(status="PENDING").update(next_try=timezone.now())
+            self.assertEqual(send_pending_mails(), 0)
+        self.assertFalse(os.path.exists(os.path.dirname(self.media_root + attach_list[0])))
+
+    @override_settings(MAIL_RUNNER="worker")
+    def test_ask_proxy_message_queued(self):
+        PollsMail(
+            "ask_proxy",
+            self.test_data["event1"],
+            sender=[self.test_data["usr11"].user.email],
+            recipient_list=[self.test_data["usr13"].user.email],
+            user=self.test_data["usr11"],
+            proxy=self.test_data["usr13"],
+        )
+        self.assertEqual(len(mail.outbox), 0)
+        outbox_mail = OutboxMail.objects.get()
+        self.assertEqual(outbox_mail.get_to(), [self.test_data["usr13"].user.email])
+        self.assertEqual(outbox_mail.get_cc(), [self.test_data["usr11"].user.email])
+
+        self.assertEqual(send_pending_mails(), 1)
+        self.assertEqual(mail.outbox[0].subject, "Pouvoir")
+        self.assertEqual(mail.outbox[0].cc, [self.test_data["usr11"].user.email])
+
+
+@override_settings(
+    EMAIL_BACKEND="polls.tools_tests.FailingEmailBackend",
+    MAIL_RETRY_DELAY=60,
+    MAIL_MAX_ATTEMPTS=2,
+    MAIL_BATCH=2,
+)
+class TestOutboxMail(TestCase):
+    def setUp(self):
+        self.company = create_dummy_company("Société de test")
+        OutboxMail.queue_mails([
+            OutboxMail.new_mail(self.company, "Mail {}".format(i), "Message", [address])
+            for i, address in enumerate(["user1@toto.com", "fail@toto.com", "user2@toto.com"])
+        ])
+
+    def test_send_pending_mails(self):
+        self.assertEqual(send_pending_mails(), 2)
+        self.assertEqual(sorted(msg.subject for msg in mail.outbox), ["Mail 0", "Mail 2"])
+        self.assertEqual(OutboxMail.objects.filter(status="SENT", sent_date__isnull=False).count(), 2)
+
+        # Failed mail is tried again later
+        failed_mail = OutboxMail.objects.get(subject="Mail 1")
+        self.assertEqual(failed_mail.status, "PENDING")
+        self.assertEqual(failed_mail.attempts, 1)
+        self.assertEqual(failed_mail.error, "Serveur indisponible")
+        self.assertGreater(failed_mail.next_try, timezone.now() + datetime.timedelta(seconds=50))
+
+        # Not due yet
+        self.assertEqual(send_pending_mails(), 0)
+        self.assertEqual(OutboxMail.objects.get(id=failed_mail.id).attempts, 1)
+
+        # Given up after MAIL_MAX_ATTEMPTS
+        OutboxMail.objects.filter(id=failed_mail.id).update(next_try=timezone.now())
+        self.assertEqual(send_pending_mails(), 0)
+        failed_mail.refresh_from_db()
+        self.assertEqual(failed_mail.status, "FAILED")
+        self.assertEqual(failed_mail.attempts, 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_retry_delay_doubled(self):
+        failed_mail = OutboxMail.objects.get(subject="Mail 1")
+        with override_settings(MAIL_MAX_ATTEMPTS=5):
+            for attempts in range(1, 4):
+                before = timezone.now()
+                failed_mail.set_error("Serveur indisponible")
+                delay = (failed_mail.next_try - before).total_seconds()
+                self.assertEqual(failed_mail.attempts, attempts)
+                self.assertAlmostEqual(delay, 60 * 2 ** (attempts - 1), delta=5)
+
+    def test_stale_sending_mails_sent_again(self):
+        # Sender stopped while sending : mails are due again once MAIL_SENDING_TIMEOUT is over
+        mail_list = OutboxMail.claim_mails("stopped", self.company.id, 10)
+        self.assertEqual(len(mail_list), 3)
+        self.assertEqual(send_pending_mails(), 0)
+
+        OutboxMail.objects.update(next_try=timezone.now())
+        self.assertEqual(send_pending_mails(), 2)
+        self.assertEqual(OutboxMail.objects.filter(status="SENT").count(), 2)
+
+    def test_mails_not_claimed_twice(self):
+        self.assertEqual(len(OutboxMail.claim_mails("sender1", self.company.id, 2)), 2)
+        mail_list = OutboxMail.claim_mails("sender2", self.company.id, 10)
+        self.assertEqual([outbox_mail.subject for outbox_mail in mail_list], ["Mail 2"])
+
+
+class TestTally(TestCase):
+    def setUp(self):
+        def row(group, weight, choice, votes):
+            return {
+                "usergroup": group,
+                "usergroup__group_name": "Groupe " + str(group),
+                "group_weight": weight,
+                "nb_users": 5,
+                "choice": choice,
+                "choice__choice_text": "Choix " + str(choice),
+                "votes": votes,
+            }
+        self.row = row
+
+        # Second group has no row for "Choix 3" : it counts as 0 vote
+        self.rows = [
+            row(1, 30, 1, 3), row(1, 30, 2, 1), row(1, 30, 3, 0),
+            row(2, 70, 1, 0), row(2, 70, 2, 2),
+        ]
+
+    def test_matrix(self):
+        tally = Tally.from_rows("MAJ", self.rows)
+        self.assertEqual(tally.labels, ["Choix 1", "Choix 2", "Choix 3"])
+        self.assertEqual(tally.matrix, [[3, 1, 0], [0, 2, 0]])
+        self.assertEqual(tally.weights, [30, 70])
+        self.assertEqual(tally.nb_votes, 6)
+        self.assertEqual(tally.nb_users, 10)
+
+    def test_rules(self):
+        self.assertEqual(Tally.from_rows("MAJ", self.rows).get_scores(), [30, 70, 0])
+        self.assertEqual(
+            Tally.from_rows("PROP", self.rows).get_results(),
+            {"Choix 1": 34.62, "Choix 2": 65.38, "Choix 3": 0}
+        )
+
+    def test_no_vote(self):
+        tally = Tally("PROP", [(1, "Choix 1"), (2, "Choix 2")])
+        self.assertEqual(tally.get_results(), {"Choix 1": 0, "Choix 2": 0})
+
+    def test_choices_with_same_label(self):
+        # Columns are the choices' ids : choices with the same label are not merged
+        rows = [dict(row, choice__choice_text="Pour") for row in self.rows]
+        tally = Tally.from_rows("MAJ", rows)
+        self.assertEqual(tally.choice_ids, [1, 2, 3])
+        self.assertEqual(tally.matrix, [[3, 1, 0], [0, 2, 0]])
+
+    def test_choices_order(self):
+        # Choices given by the event : a choice with no row is still a column
+        tally = Tally.from_rows("MAJ", self.rows, [(3, "Choix 3"), (2, "Choix 2"), (1, "Choix 1"), (4, "Choix 4")])
+        self.assertEqual(tally.labels, ["Choix 3", "Choix 2", "Choix 1", "Choix 4"])
+        self.assertEqual(tally.matrix, [[0, 1, 3, 0], [0, 2, 0, 0]])
+
+    def test_event_tallies(self):
+        # All questions of an event are tallied from one list of rows
+        rows = [dict(row, question=10) for row in self.rows] + [
+            dict(self.row(1, 30, 1, 0), question=11), dict(self.row(1, 30, 2, 4), question=11),
+            dict(self.row(2, 70, 1, 5), question=11), dict(self.row(2, 70, 2, 0), question=11),
+        ]
+        tallies = Tally.from_event_rows("MAJ", rows)
+        self.assertEqual(sorted(tallies), [10, 11])
+        # Questions share the event's choices : a choice with no row is still a column
+        self.assertEqual(tallies.votes.shape, (2, 2, 3))
+        self.assertEqual(tallies[10].matrix, [[3, 1, 0], [0, 2, 0]])
+        self.assertEqual(tallies[11].matrix, [[0, 4, 0], [5, 0, 0]])
+        self.assertEqual(tallies[11].get_scores(), [70, 30, 0])
+
+    def test_event_results(self):
+        # Rules are applied to all questions at once, with the same results as question by question
+        rows = [dict(row, question=10) for row in self.rows] + [
+            dict(self.row(1, 30, 1, 0), question=11), dict(self.row(1, 30, 2, 4), question=11),
+            dict(self.row(2, 70, 1, 5), question=11), dict(self.row(2, 70, 2, 0), question=11),
+            dict(self.row(1, 30, 1, 0), question=12), dict(self.row(2, 70, 1, 0), question=12),
+        ]
+        for rule in ("MAJ", "PROP"):
+            tallies = Tally.from_event_rows(rule, rows)
+            results = tallies.get_results()
+            self.assertEqual(sorted(results), [10, 11, 12])
+            for question_id, tally in tallies.items():
+                self.assertEqual(results[question_id], tally.get_results())
+        self.assertEqual(results[10], {"Choix 1": 34.62, "Choix 2": 65.38, "Choix 3": 0})
+        self.assertEqual(results[12], {"Choix 1": 0, "Choix 2": 0, "Choix 3": 0})
+        self.assertEqual(Tally.from_event_rows("MAJ", rows).get_results()[11], {"Choix 1": 70, "Choix 2": 30, "Choix 3": 0})
+
+
+class TestCachedChartData(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.test_data = set_full_context()
+        self.comp_slug = self.test_data["company"].comp_slug
+        self.event = self.test_data["event1"]
+        self.question = self.test_data["question_list_1"][0]
+
+    def test_chart_data_computed_once(self):
+        data = get_cached_chart_data(self.comp_slug, self.event, self.question)
+        # Next screens only read the results version
+        with self.assertNumQueries(1):
+            cached_data = get_cached_chart_data(self.comp_slug, self.event, self.question)
+        self.assertEqual(cached_data, data)
+
+    def test_chart_data_refreshed_after_vote(self):
+        get_cached_chart_data(self.comp_slug, self.event, self.question)
+        Result.add_vote(self.test_data["usr11"], self.event, self.question, [self.test_data["choice_list_1"][1]])
+        data = get_cached_chart_data(self.comp_slug, self.event, self.question)
+        self.assertEqual(data["chart_data"]["chart1"]["values"], [3, 2])
+
+    def test_chart_data_deleted_question(self):
+        self.question.delete()
+        self.assertIsNone(get_cached_chart_data(self.comp_slug, self.event, self.question))
+
+
+class TestCloseEvent(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.test_data = set_full_context()
+        self.event = self.test_data["event1"]
+        self.event.current = True
+        self.event.save()
+        close_event(self.event)
+
+    def test_close_event(self):
+        self.assertTrue(self.event.closed)
+        self.assertFalse(self.event.current)
+        event_results = ResultsSnapshot.get_results(self.event)
+        self.assertEqual(len(event_results), 2)
+        question_results = event_results[0]
+        self.assertEqual(question_results["question"]["question_no"], 1)
+        self.assertEqual(question_results["results"], {"Choix 1": 30, "Choix 2": 70})
+        self.assertEqual(question_results["chart_data"]["chart_data"]["chart1"]["values"], [3, 1])
+        self.assertEqual(question_results["nb_votes"], 6)
+        self.assertEqual(question_results["total_votes"], 6)
+        self.assertTrue(question_results["quorum_reached"])
+
+    def test_results_frozen(self):
+        # Neither new votes nor groups' changes alter the results of a closed event
+        question = self.test_data["question_list_1"][0]
+        Result.add_vote(self.test_data["usr11"], self.event, question, [self.test_data["choice_list_1"][1]])
+        self.test_data["group1"].users.remove(self.test_data["usr13"])
+
+        with self.assertNumQueries(1):
+            event_results = self.event.get_results()
+        self.assertEqual(event_results[0]["results"], {"Choix 1": 30, "Choix 2": 70})
+
+        data = get_cached_chart_data(self.test_data["company"].comp_slug, self.event, question)
+        self.assertEqual(data["chart_data"]["chart1"]["values"], [3, 1])
+        self.assertEqual(data["chart_data"]["chart1"]["total_votes"], 4)
+
+
+class TestVotesJournal(TestCase):
+    def setUp(self):
+        self.test_data = set_default_context()
+        self.event = self.test_data["event1"]
+        init_event(self.event)
+        self.journal = os.path.join(tempfile.mkdtemp(), "votes.log")
+        self.ballots = [
+            UserVote.get_ballot(
+                user, self.test_data["company"].comp_slug, self.event.slug, 1, self.test_data["choice_list_1"][0].id
+            )
+            for user in (self.test_data["usr11"], self.test_data["usr12"], self.test_data["usr21"])
+        ]
+
+    def test_flush_journal(self):
+        for ballot in self.ballots:
+            append_ballot(ballot, self.journal)
+        # A ballot sent twice is counted once
+        append_ballot(self.ballots[0], self.journal)
+
+        self.assertEqual(flush_journal(self.journal, batch_size=2), 4)
+        tally = Result.get_tally(self.event, self.test_data["question_list_1"][0])
+        self.assertEqual(tally.matrix, [[2, 0], [1, 0]])
+        self.assertEqual(GroupTally.objects.get(question=self.test_data["question_list_1"][0], usergroup=self.test_data["group1"]).nb_votes, 2)
+        self.assertFalse(JournalPosition.objects.exists())
+
+    def test_replay_interrupted_flush(self):
+        # Flush stopped after the first batch : the journal is replayed from there only
+        interrupted = self.journal + ".1"
+        for ballot in self.ballots:
+            append_ballot(ballot, interrupted)
+        with transaction.atomic():
+            UserVote.apply_ballots(self.ballots[:1])
+        JournalPosition.objects.create(journal=interrupted, position=len(json.dumps(self.ballots[0])) + 1)
+        # Ballot partly written before a crash is ignored
+        with open(interrupted, "a") as journal_file:
+            journal_file.write('{"uservote": ')
+
+        self.assertEqual(flush_journal(self.journal), 2)
+        tally = Result.get_tally(self.event, self.test_data["question_list_1"][0])
+        self.assertEqual(tally.matrix, [[2, 0], [1, 0]])
+        self.assertFalse(os.path.exists(interrupted))
+
+
+class TestHashPasswords(TestCase):
+    def test_hash_passwords_in_pool(self):
+        passwords = ["password{}".format(i) for i in range(16)]
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            hashed_passwords = hash_passwords(passwords, pool)
+        # Hashes are returned in the passwords' order
+        self.assertEqual(len(hashed_passwords), 16)
+        for password, hashed_password in zip(passwords, hashed_passwords):
+            self.assertTrue(check_password(password, hashed_password))
+
+
+class TestLoadTestCommand(TransactionTestCase):
+    def test_loadtest(self):
+        out = StringIO()
+        call_command("loadtest", voters=3, concurrency=1, stdout=out)
+        report = out.getvalue()
+        self.assertIn("Votants : 3", report)
+        for step in ("login", "question", "vote", "chart_data"):
+            self.assertRegex(report, r"{}\s+3\s+0\s".format(step))
+        # Synthetic event and users are deleted
+        self.assertFalse(Event.objects.exists())
+        self.assertFalse(User.objects.exists())
 
 
 # ===================================
@@ -167,6 +566,7 @@ class TestPollsMail(TestCase):
 # ===================================
 
 
+@override_settings(MAIL_RUNNER="sync")
 class TestAdminActions(TestCase):
     def setUp(self):
         self.test_data = set_default_context()
@@ -1,12 +1,16 @@
 # -*-coding:Utf-8 -*
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import connection, OperationalError
 from django.utils import timezone
 from django.utils.text import slugify
 from django.shortcuts import reverse, get_list_or_404, get_object_or_404
 from django.contrib.auth.models import User
 
 import datetime
+import random
+import threading
+import time
 
 from .tools_tests import (
     create_dummy_user,
@@ -26,7 +30,14 @@ from .models import (
     Result,
     Procuration,
     UserComp,
+    GroupTally,
+    ChoiceTally,
+    Ballot,
+    Job,
 )
+from .jobs import register_job, run_job, submit_job
+from .tools import init_event
+from .signals import bulk_memberships
 
 # ===================================
 #        Test models' methods
@@ -47,6 +58,35 @@ class TestModelCompany(TestCase):
         self.assertEqual(comp.id, company.id)
 
 
+class TestModelUserComp(TestCase):
+    def setUp(self):
+        self.company = create_dummy_company("Société de test")
+
+    def test_bulk_create_usercomps(self):
+        user_list = [User.objects.create_user(username="user{}".format(i)) for i in range(10)]
+        # Queries do not depend on the number of users
+        with self.assertNumQueries(6):
+            usercomp_list = UserComp.bulk_create_usercomps(
+                self.company, [UserComp(user=user) for user in user_list]
+            )
+        self.assertEqual(len(usercomp_list), 10)
+        self.assertEqual(self.company.get_default_group().users.count(), 10)
+
+    def test_bulk_memberships(self):
+        with bulk_memberships():
+            company = create_dummy_company("Autre société")
+            for i in range(3):
+                create_dummy_user(company, "user{}".format(i))
+                create_dummy_user(self.company, "other{}".format(i))
+            # Default group and memberships are inserted at the end
+            self.assertFalse(UserGroup.objects.filter(company=company).exists())
+            self.assertEqual(self.company.get_default_group().users.count(), 0)
+
+        self.assertEqual(company.get_default_group().users.count(), 3)
+        self.assertEqual(self.company.get_default_group().users.count(), 3)
+        self.assertTrue(company.get_default_group().hidden)
+
+
 class TestModelEvent(TestCase):
     def test_get_event(self):
         self.company = create_dummy_company("Société de test")
@@ -80,8 +120,22 @@ class TestModelEvent(TestCase):
         )
 
         self.assertEqual(self.event.current, False)
-        self.event.set_current()
+        # Event must be launched first
+        self.assertFalse(self.event.set_current())
+        self.assertTrue(self.event.set_starting())
+        self.assertTrue(self.event.set_current())
         self.assertEqual(self.event.current, True)
+        self.assertEqual(Event.objects.get(id=self.event.id).current, True)
+
+    def test_set_current_closed_during_launch(self):
+        # Event closed while it was being launched : it is not opened again
+        event = create_dummy_event(create_dummy_company("Société de test"))
+        event.set_starting()
+        Event.objects.filter(id=event.id).update(closed=True)
+        self.assertFalse(event.set_current())
+        event.refresh_from_db()
+        self.assertFalse(event.current)
+        self.assertTrue(event.closed)
 
 
 class TestModelQuestion(TestCase):
@@ -126,6 +180,27 @@ class TestModelQuestion(TestCase):
         self.assertEqual(data["chart_data"]["labels"], ["Choix 1", "Choix 2"])
         self.assertEqual(data["chart_data"]["values"], [30, 70])
 
+    def test_get_event_results(self):
+        # Questions and results are read once for the whole event
+        with self.assertNumQueries(2):
+            event_results = self.test_data["event1"].get_results()
+        self.assertEqual(len(event_results), 2)
+        self.assertEqual(event_results[0]["question"].question_no, 1)
+        self.assertEqual(event_results[0]["results"], {"Choix 1": 30, "Choix 2": 70})
+        self.assertEqual(event_results[1]["results"], {"Choix 1": 0, "Choix 2": 100})
+        self.assertEqual(event_results[1]["chart_results"]["chart_data"]["values"], [0, 100])
+
+    def test_get_event_tallies(self):
+        # Groups x choices matrices of all the event's questions are read with one query
+        event = self.test_data["event1"]
+        with self.assertNumQueries(1):
+            tallies = Result.get_event_tallies(event)
+        self.assertEqual(len(tallies), 2)
+        self.assertEqual(tallies[self.test_data["question_list_1"][0].id].matrix[0], [3, 1])
+        for question in self.test_data["question_list_1"]:
+            self.assertEqual(tallies[question.id].matrix, Result.get_tally(event, question).matrix)
+            self.assertEqual(tallies[question.id].choice_ids, [choice.id for choice in self.test_data["choice_list_1"]])
+
 
 class TestModelUserGroup(TestCase):
     def setUp(self):
@@ -194,10 +269,10 @@ class TestModelUserVote(TestCase):
         self.user_lambda = create_dummy_user(self.company, "lambda", group=self.group)
         self.user_alpha = create_dummy_user(self.company, "alpha")
 
+        # Event is launched by tests which need it : procurations are set before
         self.event = create_dummy_event(
             self.company,
             name="Evénement de test",
-            current=True,
             groups=[self.group],
         )
 
@@ -226,11 +301,86 @@ class TestModelUserVote(TestCase):
 
     def test_init_uservotes(self):
         UserVote.init_uservotes(self.event)
-        new_user_list = UserVote.objects.filter(question__event=self.event)
-        self.assertEqual(len(new_user_list), 2)
-        self.assertEqual(new_user_list[0].user.user.username, "lambda")
-        self.assertEqual(new_user_list[0].question.question_text, "Question 1")
-        self.assertEqual(new_user_list[1].question.question_text, "Question 2")
+        # Users' votes are stored when they vote only
+        self.assertFalse(UserVote.objects.filter(question__event=self.event).exists())
+        # 3 groups x 2 choices x 2 questions
+        self.assertEqual(Result.objects.filter(event=self.event).count(), 12)
+
+    def test_init_uservotes_rights(self):
+        user_beta = create_dummy_user(self.company, "beta", group=self.group)
+        user_gamma = create_dummy_user(self.company, "gamma", group=self.group)
+        Procuration.set_user_proxy(self.event, user_beta, self.user_lambda)
+        Procuration.set_user_proxy(self.event, user_gamma, self.user_lambda)
+        # Procurations count once confirmed only
+        Procuration.confirm_proxy(self.event, self.user_lambda, user_beta.id)
+        self.assertEqual(
+            UserVote.get_rights_map(self.event),
+            {self.user_lambda.id: 2, user_beta.id: 0, user_gamma.id: 1},
+        )
+        Procuration.confirm_proxy(self.event, self.user_lambda, user_gamma.id)
+        self.assertEqual(
+            UserVote.get_rights_map(self.event),
+            {self.user_lambda.id: 3, user_beta.id: 0, user_gamma.id: 0},
+        )
+
+        # Number of queries depends neither on users nor on questions
+        with self.assertNumQueries(9):
+            UserVote.init_uservotes(self.event)
+        self.assertEqual(GroupTally.objects.get(question=self.question_list[0], usergroup=self.group).nb_users, 3)
+
+        # Rights are derived until the user votes
+        user_vote = UserVote.get_voter_status(self.event, self.user_lambda, self.question_list[1])
+        self.assertIsNone(user_vote.id)
+        self.assertEqual(user_vote.nb_user_votes, 3)
+        self.assertEqual(UserVote.get_voter_status(self.event, user_beta, self.question_list[1]).nb_user_votes, 0)
+
+    def test_cast_vote_stores_user_vote(self):
+        user_beta = create_dummy_user(self.company, "beta", group=self.group)
+        Procuration.set_user_proxy(self.event, user_beta, self.user_lambda)
+        Procuration.confirm_proxy(self.event, self.user_lambda, user_beta.id)
+        self.event.set_starting()
+        self.event.set_current()
+        UserVote.init_uservotes(self.event)
+
+        args = (self.company.comp_slug, self.event.slug, 1, self.choice_list[0].id)
+        self.assertIsNone(UserVote.cast_vote(user_beta, *args))
+        self.assertEqual(UserVote.cast_vote(self.user_lambda, *args), 1)
+        self.assertEqual(UserVote.objects.count(), 1)
+        self.assertEqual(UserVote.cast_vote(self.user_lambda, *args), 0)
+        self.assertIsNone(UserVote.cast_vote(self.user_lambda, *args))
+        user_vote = UserVote.get_user_vote(self.event, self.user_lambda, self.question_list[0])
+        self.assertEqual(user_vote.nb_user_votes, 0)
+        self.assertTrue(user_vote.has_voted)
+
+
+    def test_proxy_given_after_vote(self):
+        # Procurations can not change once the event is launched : rights are derived from them
+        user_beta = create_dummy_user(self.company, "beta", group=self.group)
+        init_event(self.event)
+        args = (self.company.comp_slug, self.event.slug, 1, self.choice_list[0].id)
+        self.assertEqual(UserVote.cast_vote(user_beta, *args), 0)
+
+        self.assertFalse(Procuration.set_user_proxy(self.event, user_beta, self.user_lambda))
+        self.assertFalse(Procuration.objects.exists())
+        self.assertEqual(UserVote.cast_vote(self.user_lambda, *args), 0)
+        self.assertIsNone(UserVote.cast_vote(self.user_lambda, *args))
+        self.assertEqual(sum(row[0] for row in Result.get_tally(self.event, self.question_list[0]).matrix), 2)
+
+    def test_proxy_cancelled_after_vote(self):
+        user_beta = create_dummy_user(self.company, "beta", group=self.group)
+        Procuration.set_user_proxy(self.event, user_beta, self.user_lambda)
+        Procuration.confirm_proxy(self.event, self.user_lambda, user_beta.id)
+        init_event(self.event)
+        args = (self.company.comp_slug, self.event.slug, 1, self.choice_list[0].id)
+        self.assertEqual(UserVote.cast_vote(self.user_lambda, *args), 1)
+        self.assertEqual(UserVote.cast_vote(self.user_lambda, *args), 0)
+
+        # The proxy used by the proxyholder is not given back to the user
+        self.assertFalse(Procuration.cancel_proxy(self.event, user_beta))
+        self.assertFalse(Procuration.confirm_proxy(self.event, self.user_lambda, user_beta.id))
+        self.assertTrue(Procuration.objects.filter(user=user_beta).exists())
+        self.assertIsNone(UserVote.cast_vote(user_beta, *args))
+        self.assertEqual(sum(row[0] for row in Result.get_tally(self.event, self.question_list[0]).matrix), 2)
 
 
 class TestModelResult(TestCase):
@@ -275,6 +425,16 @@ class TestModelResult(TestCase):
         self.assertEqual(self.r2.votes, 0)
         self.assertEqual(self.r3.votes, 0)
 
+    def test_add_proxy_votes(self):
+        # A proxyholder's votes for the same choice are all counted
+        choice = self.test_data["choice_list_1"][1]
+        Result.add_vote(self.test_data["usr11"],
+            self.test_data["event1"],
+            self.test_data["question_list_1"][0],
+            [choice, choice, choice])
+        self.r2.refresh_from_db()
+        self.assertEqual(self.r2.votes, 3)
+
     def test_get_vote_list(self):
         vote_list = Result.get_vote_list(
             self.test_data["event1"],
@@ -289,6 +449,204 @@ class TestModelResult(TestCase):
         )
 
 
+class TestModelTally(TestCase):
+    def setUp(self):
+        self.test_data = set_default_context()
+        self.event = self.test_data["event1"]
+        self.question = self.test_data["question_list_1"][0]
+        self.choice_list = self.test_data["choice_list_1"]
+        UserVote.init_uservotes(self.event)
+
+    def vote(self, user, choice_no):
+        UserVote.set_vote(self.event, user, self.question, choices=[self.choice_list[choice_no - 1]])
+
+    def test_init_tally(self):
+        group_tally = GroupTally.objects.get(question=self.question, usergroup=self.test_data["group1"])
+        self.assertEqual(group_tally.nb_users, 4)
+        self.assertEqual(group_tally.nb_votes, 0)
+        self.assertEqual(ChoiceTally.objects.filter(question=self.question).count(), 2)
+        self.assertEqual(self.question.get_results(), {"Choix 1": 100, "Choix 2": 0})
+
+    def test_add_vote(self):
+        self.vote(self.test_data["usr11"], 2)
+        self.vote(self.test_data["usr12"], 2)
+        self.vote(self.test_data["usr13"], 1)
+        self.vote(self.test_data["usr21"], 1)
+
+        group_tally = GroupTally.objects.get(question=self.question, usergroup=self.test_data["group1"])
+        self.assertEqual(group_tally.nb_votes, 3)
+        self.assertEqual(Result.get_tally(self.event, self.question).get_scores(), [60, 40])
+
+        # Tallies give the same results as votes counted from Result rows
+        self.assertEqual(self.question.get_results(), {"Choix 1": 60, "Choix 2": 40})
+        self.assertEqual(
+            self.question.get_results(),
+            Result.get_tally(self.event, self.question).get_results()
+        )
+
+        self.event.rule = "PROP"
+        self.event.save()
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.get_results(), {"Choix 1": 55.56, "Choix 2": 44.44})
+        self.assertEqual(
+            self.question.get_results(),
+            Result.get_tally(self.event, self.question).get_results()
+        )
+
+    def test_prop_score_exact(self):
+        # Groups' weights are summed as integers : no rounding drift, whatever the number of votes
+        self.vote(self.test_data["usr11"], 2)
+        self.vote(self.test_data["usr12"], 2)
+        self.vote(self.test_data["usr21"], 2)
+        choice_tally = ChoiceTally.objects.get(question=self.question, choice=self.choice_list[1])
+        self.assertEqual(
+            choice_tally.prop_score,
+            2 * self.test_data["group1"].weight + self.test_data["group2"].weight,
+        )
+
+    def test_get_results_read_tallies(self):
+        self.vote(self.test_data["usr11"], 2)
+        self.question.event = self.event
+        with self.assertNumQueries(1):
+            self.question.get_results()
+
+
+class TestModelBallot(TestCase):
+    def setUp(self):
+        self.test_data = set_default_context()
+        self.event = self.test_data["event1"]
+        self.question = self.test_data["question_list_1"][0]
+        self.choice_list = self.test_data["choice_list_1"]
+        self.event.set_starting()
+        self.event.set_current()
+        UserVote.init_uservotes(self.event)
+
+    def vote(self, user, choice_no):
+        return UserVote.cast_vote(
+            user, self.test_data["company"].comp_slug, self.event.slug, 1, self.choice_list[choice_no - 1].id
+        )
+
+    def test_ballot_recorded(self):
+        self.vote(self.test_data["usr11"], 2)
+        ballot = Ballot.objects.get()
+        self.assertEqual(ballot.usergroup, self.test_data["group1"])
+        self.assertEqual(ballot.choice, self.choice_list[1])
+        self.assertTrue(ballot.compacted)
+
+    @override_settings(VOTES_COMPACTION=True)
+    def test_compact(self):
+        self.vote(self.test_data["usr11"], 2)
+        self.vote(self.test_data["usr21"], 2)
+        # Ballots are not counted until compaction
+        self.assertEqual(Result.get_tally(self.event, self.question).matrix, [[0, 0], [0, 0]])
+        self.assertEqual(UserVote.get_user_vote(self.event, self.test_data["usr11"], self.question).nb_user_votes, 0)
+
+        self.assertEqual(Ballot.compact(batch_size=1), 1)
+        self.assertEqual(Ballot.compact(), 1)
+        self.assertEqual(Ballot.compact(), 0)
+        self.assertEqual(Result.get_tally(self.event, self.question).matrix, [[0, 1], [0, 1]])
+        self.assertEqual(self.question.get_results(), {"Choix 1": 0, "Choix 2": 100})
+
+    def test_rebuild(self):
+        self.vote(self.test_data["usr11"], 2)
+        self.vote(self.test_data["usr12"], 1)
+        self.vote(self.test_data["usr21"], 2)
+        results = self.question.get_results()
+
+        # Incident : counters and users' votes are lost
+        Result.objects.filter(event=self.event).update(votes=7)
+        ChoiceTally.objects.filter(event=self.event).delete()
+        UserVote.objects.filter(event=self.event).update(nb_user_votes=1, has_voted=False)
+
+        self.assertEqual(Ballot.rebuild(self.event), 3)
+        self.assertEqual(Result.get_tally(self.event, self.question).matrix, [[1, 1], [0, 1]])
+        self.assertEqual(self.question.get_results(), results)
+        user_vote = UserVote.get_user_vote(self.event, self.test_data["usr11"], self.question)
+        self.assertEqual(user_vote.nb_user_votes, 0)
+        self.assertTrue(user_vote.has_voted)
+        self.assertIsNone(UserVote.get_user_vote(self.event, self.test_data["usr13"], self.question))
+
+
+class TestConcurrentVotes(TransactionTestCase):
+    nb_users = 20
+
+    def setUp(self):
+        company = create_dummy_company("Société de test")
+        users = [create_dummy_user(company, "user" + str(i)) for i in range(self.nb_users)]
+        group = UserGroup.create_group(company, "Groupe 1", weight=100, user_list=users)
+        self.event = create_dummy_event(company, groups=[group], new_groups=False)
+        self.question = Question.get_question(self.event, 1)
+        self.choice_list = list(Choice.get_choice_list(self.event))
+        UserVote.init_uservotes(self.event)
+        self.event.set_starting()
+        self.event.set_current()
+        self.users = users
+
+    def vote_at_once(self, vote):
+        """
+        All members vote at once : each vote runs in its own thread and connection
+        SQLite lets one writer at a time and refuses the others : their vote is sent again,
+        as the voter's browser would do
+        """
+        start = threading.Barrier(self.nb_users)
+        errors = []
+
+        def run(user, choice):
+            try:
+                start.wait()
+                for attempt in range(200):
+                    try:
+                        return vote(user, choice)
+                    except OperationalError as error:
+                        if "locked" not in str(error):
+                            raise
+                        time.sleep(random.uniform(0.001, 0.01))
+                raise AssertionError("Vote not saved")
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=run, args=(user, self.choice_list[i % 2]))
+            for i, user in enumerate(self.users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+    def check_no_vote_lost(self):
+        tally = Result.get_tally(self.event, self.question)
+        self.assertEqual(tally.matrix, [[self.nb_users // 2, self.nb_users // 2]])
+        self.assertEqual(GroupTally.objects.get(question=self.question).nb_votes, self.nb_users)
+        self.assertEqual(
+            list(ChoiceTally.objects.filter(question=self.question).order_by("choice__choice_no").values_list("votes", flat=True)),
+            [self.nb_users // 2, self.nb_users // 2],
+        )
+        self.assertEqual(
+            UserVote.objects.filter(question=self.question, has_voted=True, nb_user_votes=0).count(),
+            self.nb_users,
+        )
+
+    def test_no_vote_lost(self):
+        self.vote_at_once(
+            lambda user, choice: UserVote.set_vote(self.event, user, self.question, choices=[choice])
+        )
+        self.check_no_vote_lost()
+
+    def test_no_vote_lost_cast_vote(self):
+        comp_slug = self.event.company.comp_slug
+        self.vote_at_once(
+            lambda user, choice: self.assertEqual(
+                UserVote.cast_vote(user, comp_slug, self.event.slug, 1, choice.id), 0
+            )
+        )
+        self.check_no_vote_lost()
+
+
 class TestModelProcuration(TestCase):
     def setUp(self):
         self.test_data = set_default_context()
@@ -302,6 +660,34 @@ class TestModelProcuration(TestCase):
         self.assertEqual(user_proxy, None)
         self.assertEqual(len(user_proxy_list), 0)
 
+    def test_proxy_graph(self):
+        event = self.test_data["event1"]
+        Procuration.set_user_proxy(event, self.test_data["usr11"], self.test_data["usr13"])
+        Procuration.set_user_proxy(event, self.test_data["usr14"], self.test_data["usr13"])
+        Procuration.confirm_proxy(event, self.test_data["usr13"], self.test_data["usr14"].id)
+        # Procurations of other events are not taken into account
+        Procuration.set_user_proxy(self.test_data["event2"], self.test_data["usr12"], self.test_data["usr13"])
+
+        # Status of all members is read with one query
+        with self.assertNumQueries(1):
+            proxy_graph = Procuration.get_proxy_graph(event)
+            self.assertEqual(proxy_graph.get_proxy(self.test_data["usr11"]), self.test_data["usr13"])
+            self.assertEqual(
+                [(member.id, confirmed) for member, confirmed in proxy_graph.get_held_list(self.test_data["usr13"])],
+                [(self.test_data["usr11"].id, False), (self.test_data["usr14"].id, True)],
+            )
+            self.assertEqual(proxy_graph.get_eligible_proxies(self.test_data["usr12"]), [self.test_data["usr13"]])
+            self.assertEqual(proxy_graph.get_eligible_proxies(self.test_data["usr21"]), [self.test_data["usr22"]])
+            self.assertFalse(proxy_graph.is_member(self.test_data["user_staff"]))
+
+        self.assertEqual(
+            UserVote.get_rights_map(event)[self.test_data["usr13"].id], 2
+        )
+        proxy_list, user_proxy, user_proxy_list = Procuration.get_proxy_status(event, self.test_data["usr13"])
+        self.assertEqual(proxy_list, [])
+        self.assertEqual([proxy.user for proxy in user_proxy_list], [self.test_data["usr11"], self.test_data["usr14"]])
+        self.assertTrue(user_proxy_list[1].proxy_confirmed)
+
     def test_set_user_proxy(self):
         Procuration.set_user_proxy(self.test_data["event1"], self.test_data["usr11"], self.test_data["usr13"])
         proc = Procuration.objects.get(event=self.test_data["event1"], user=self.test_data["usr11"])
@@ -323,3 +709,39 @@ class TestModelProcuration(TestCase):
         Procuration.cancel_proxy(self.test_data["event1"], self.test_data["usr11"])
         proxy_list = Procuration.objects.filter(event=self.test_data["event1"])
         self.assertEqual(len(proxy_list), 0)
+
+
+@register_job("test_job")
+def job_for_tests(job, fail=False):
+    job.set_progress(50)
+    if fail:
+        raise ValueError("Echec de test")
+
+
+class TestModelJob(TestCase):
+    def setUp(self):
+        self.test_data = set_default_context()
+
+    @override_settings(JOBS_RUNNER="worker")
+    def test_run_job_once(self):
+        job = submit_job("test_job", event=self.test_data["event1"])
+        self.assertEqual(job.company, self.test_data["company"])
+        self.assertEqual(job.status, "PENDING")
+        self.assertTrue(run_job(job.id))
+        self.assertFalse(run_job(job.id))
+        job.refresh_from_db()
+        self.assertEqual(job.status, "DONE")
+        self.assertEqual(job.progress, 100)
+
+    @override_settings(JOBS_RUNNER="sync")
+    def test_failed_job(self):
+        job = submit_job("test_job", company=self.test_data["company"], fail=True)
+        self.assertEqual(job.status, "FAILED")
+        self.assertEqual(job.progress, 50)
+        self.assertEqual(job.message, "Echec de test")
+
+    @override_settings(JOBS_RUNNER="sync")
+    def test_job_runner(self):
+        # Some jobs are always run by the worker, whatever the default runner
+        job = submit_job("test_job", company=self.test_data["company"], runner="worker")
+        self.assertEqual(job.status, "PENDING")
@@ -1,10 +1,11 @@
 # -*-coding:Utf-8 -*
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 from django.utils.text import slugify
 from django.shortcuts import reverse, get_list_or_404, get_object_or_404
 from django.contrib.auth.models import User
+from django.core.cache import cache
 # from django.core import mail
 # from django.core.files import File
 # from django.conf import settings
@@ -12,14 +13,19 @@ from django.contrib.auth.models import User
 
 # from unittest import mock
 
-# import os
+import os
+import tempfile
 import datetime
+import json
+import openpyxl
+from io import BytesIO
 
 from .tools_tests import (
     create_dummy_user,
     create_dummy_company,
     create_dummy_event,
-    set_default_context
+    set_default_context,
+    set_full_context,
 )
 
 from .models import (
@@ -30,8 +36,12 @@ from .models import (
     UserVote,
     UserGroup,
     Result,
+    GroupTally,
+    ChoiceTally,
     Procuration,
     UserComp,
+    Job,
+    JobAbandoned,
 )
 
 from .forms import (
@@ -44,6 +54,9 @@ from .forms import (
     CompanyForm
 )
 
+from .tools import init_event, close_event, chart_data_stream
+from .journal import flush_journal
+from .jobs import run_pending_jobs, launch_event
 # from .tools import set_chart_data, init_event
 # from .pollsmail import PollsMail
 
@@ -191,6 +204,7 @@ class TestEvent(TestCase):
         self.assertNotContains(response, "Accéder à l'événement")
 
 
+@override_settings(JOBS_RUNNER="sync")
 class TestQuestion(TestCase):
     def setUp(self):
         self.test_data = set_default_context()
@@ -215,13 +229,113 @@ class TestQuestion(TestCase):
         self.assertEqual(response.status_code, 200)
         my_event = get_object_or_404(Event, id=self.test_data["event1"].id)
         self.assertEqual(my_event.current, True)
-        user_list = get_list_or_404(UserVote)
-        self.assertEqual(len(user_list), 12)
+        # Users' votes are stored when they vote only
+        self.assertFalse(UserVote.objects.exists())
         self.assertEqual(response.context["question_no"], 1)
         self.assertEqual(response.context["event"].current, True)
         self.assertContains(response, "Question 1")
         self.assertContains(response, "Résolution suivante")
 
+    @override_settings(JOBS_RUNNER="worker")
+    def test_launch_event_in_background(self):
+        self.client.force_login(self.test_data["user_staff"].user)
+        url = reverse("polls:question", args=(self.test_data["company"].comp_slug, self.test_data["event1"].slug, 1))
+        response = self.client.get(url)
+        self.assertTemplateUsed(response, "polls/starting.html")
+        job = response.context["job"]
+        self.assertEqual(job.status, "PENDING")
+        # Launch is not started twice
+        self.client.get(url)
+        self.assertEqual(Job.objects.count(), 1)
+
+        # Voters see the event starting
+        self.client.force_login(self.test_data["usr11"].user)
+        response = self.client.get(url)
+        self.assertContains(response, "Lancement de l'événement en cours")
+        response = self.client.get(reverse("polls:job_status", args=(job.id,)))
+        self.assertEqual(json.loads(response.content)["status"], "PENDING")
+
+        self.assertEqual(run_pending_jobs(), 1)
+        response = self.client.get(reverse("polls:job_status", args=(job.id,)))
+        self.assertEqual(json.loads(response.content)["progress"], 100)
+        response = self.client.get(url)
+        self.assertTemplateUsed(response, "polls/question.html")
+        self.assertEqual(response.context["event"].current, True)
+
+    @override_settings(JOBS_RUNNER="worker", JOBS_STALE_TIMEOUT=600)
+    def test_launch_event_dead_job(self):
+        # Launch job stopped with its process : it is started again by the next admin's visit
+        self.client.force_login(self.test_data["user_staff"].user)
+        url = reverse("polls:question", args=(self.test_data["company"].comp_slug, self.test_data["event1"].slug, 1))
+        self.client.get(url)
+        dead_job = Job.claim(Job.objects.get().id)
+        dead_job.set_progress(50)
+
+        # Job still alive : the launch is not started again
+        response = self.client.get(url)
+        self.assertTemplateUsed(response, "polls/starting.html")
+        self.assertEqual(Job.objects.count(), 1)
+
+        Job.objects.filter(id=dead_job.id).update(last_update=timezone.now() - datetime.timedelta(minutes=11))
+        response = self.client.get(url)
+        self.assertTemplateUsed(response, "polls/starting.html")
+        self.assertEqual(Job.objects.get(id=dead_job.id).status, "FAILED")
+        new_job = response.context["job"]
+        self.assertNotEqual(new_job.id, dead_job.id)
+        self.assertEqual(new_job.status, "PENDING")
+
+        # The dead job stops if it was not that dead
+        with self.assertRaises(JobAbandoned):
+            dead_job.set_progress(100)
+
+        self.assertEqual(run_pending_jobs(), 1)
+        response = self.client.get(url)
+        self.assertTemplateUsed(response, "polls/question.html")
+        self.assertEqual(Result.objects.filter(event=self.test_data["event1"]).count(), 2 * 2 * 2)
+
+    def test_launch_event_interrupted(self):
+        # Questions are initialized one transaction each : an interrupted launch leaves
+        # some of them initialized, but the event is not current and votes are refused
+        event = self.test_data["event1"]
+        job = Job.create_job("launch_event", event=event)
+
+        def interrupt(progress):
+            raise RuntimeError("Lancement interrompu")
+
+        job.set_progress = interrupt
+        event.set_starting()
+        with self.assertRaises(RuntimeError):
+            launch_event(job)
+        event.refresh_from_db()
+        self.assertFalse(event.current)
+        self.assertFalse(event.starting)
+        self.assertTrue(Result.objects.filter(event=event).exists())
+
+        self.client.force_login(self.test_data["usr11"].user)
+        vote_url = reverse("polls:vote", args=(self.test_data["company"].comp_slug, event.slug, 1))
+        choice = self.test_data["choice_list_1"][1]
+        response = self.client.post(vote_url, {"choice": choice.id})
+        self.assertEqual(response.status_code, 403)
+
+        # Launched again : leftovers are replaced, results are those of a complete launch
+        self.client.force_login(self.test_data["user_staff"].user)
+        self.client.get(reverse("polls:question", args=(self.test_data["company"].comp_slug, event.slug, 1)))
+        event.refresh_from_db()
+        self.assertTrue(event.current)
+        nb_questions = Question.get_question_list(event).count()
+        nb_groups = UserGroup.get_group_list(event).count()
+        nb_choices = Choice.get_choice_list(event).count()
+        self.assertEqual(Result.objects.filter(event=event).count(), nb_questions * nb_groups * nb_choices)
+        self.assertEqual(GroupTally.objects.filter(event=event).count(), nb_questions * nb_groups)
+        self.assertEqual(ChoiceTally.objects.filter(event=event).count(), nb_questions * nb_choices)
+
+        self.client.force_login(self.test_data["usr11"].user)
+        response = self.client.post(vote_url, {"choice": choice.id})
+        self.assertEqual(response.status_code, 200)
+        question = self.test_data["question_list_1"][0]
+        self.assertEqual(Result.get_tally(event, question).matrix[0], [0, 1])
+        self.assertEqual(sum(GroupTally.objects.filter(question=question).values_list("nb_votes", flat=True)), 1)
+
     def test_user_display_first_question(self):
         UserVote.set_vote(
             self.test_data["event1"],
@@ -277,3 +391,353 @@ class TestQuestion(TestCase):
         self.assertContains(response, "Question 2")
         self.assertContains(response, "Voter")
         self.assertNotContains(response, "Résolution suivante")
+
+
+class TestResults(TestCase):
+    def setUp(self):
+        self.test_data = set_full_context()
+
+    def test_display_results(self):
+        self.client.force_login(self.test_data["usr11"].user)
+        url = reverse("polls:results", args=(self.test_data["company"].comp_slug, self.test_data["event1"].slug))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["nb_questions"], 2)
+        self.assertContains(response, "Question 2")
+        self.assertContains(response, "Choix 2 : 70")
+
+    def test_close_event(self):
+        self.test_data["event1"].set_starting()
+        self.test_data["event1"].set_current()
+        self.client.force_login(self.test_data["user_staff"].user)
+        args = (self.test_data["company"].comp_slug, self.test_data["event1"].slug)
+        response = self.client.post(reverse("polls:close_event", args=args))
+        self.assertRedirects(response, reverse("polls:results", args=args))
+        self.assertTrue(Event.objects.get(id=self.test_data["event1"].id).closed)
+
+        # Results are read from the snapshot, even after groups are changed
+        self.test_data["group1"].users.clear()
+        response = self.client.get(reverse("polls:results", args=args))
+        self.assertContains(response, "Question 2")
+        self.assertContains(response, "Choix 2 : 70")
+        self.assertNotContains(response, "Clôturer l'événement")
+
+    def test_close_event_other_company(self):
+        # Admins can close their company's events only
+        self.test_data["event1"].set_starting()
+        self.test_data["event1"].set_current()
+        other_company = create_dummy_company("Autre société")
+        other_admin = create_dummy_user(other_company, "other_admin", admin=True)
+        self.client.force_login(other_admin.user)
+        args = (self.test_data["company"].comp_slug, self.test_data["event1"].slug)
+        response = self.client.post(reverse("polls:close_event", args=args))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Event.objects.get(id=self.test_data["event1"].id).closed)
+
+    def test_close_starting_event(self):
+        # Event can not be closed until its launch is over
+        self.assertTrue(self.test_data["event1"].set_starting())
+        self.client.force_login(self.test_data["user_staff"].user)
+        args = (self.test_data["company"].comp_slug, self.test_data["event1"].slug)
+        response = self.client.post(reverse("polls:close_event", args=args), follow=True)
+        self.assertContains(response, "ne peut pas encore être clôturé")
+        event = Event.objects.get(id=self.test_data["event1"].id)
+        self.assertFalse(event.closed)
+        self.assertTrue(event.starting)
+        self.assertFalse(close_event(event))
+
+    def test_closed_event_not_launched_again(self):
+        close_event(self.test_data["event1"])
+        self.client.force_login(self.test_data["user_staff"].user)
+        url = reverse("polls:question", args=(self.test_data["company"].comp_slug, self.test_data["event1"].slug, 1))
+        self.client.get(url)
+        self.assertFalse(Event.objects.get(id=self.test_data["event1"].id).current)
+        self.assertFalse(UserVote.objects.exists())
+
+
+class TestChartData(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.test_data = set_full_context()
+        self.url = reverse("polls:chart_data")
+        self.data = {
+            "comp_slug": self.test_data["company"].comp_slug,
+            "event_slug": self.test_data["event1"].slug,
+            "question_no": 1,
+        }
+
+    def test_get_chart_data(self):
+        response = self.client.get(self.url, self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["chart_data"]["global"]["values"], [30, 70])
+        self.assertTrue(response.has_header("ETag"))
+
+    def test_chart_data_not_modified(self):
+        etag = self.client.get(self.url, self.data)["ETag"]
+        # Only the results version is read : charts data are not computed
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, self.data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_chart_data_modified_after_vote(self):
+        etag = self.client.get(self.url, self.data)["ETag"]
+        Result.add_vote(
+            self.test_data["usr11"],
+            self.test_data["event1"],
+            self.test_data["question_list_1"][0],
+            [self.test_data["choice_list_1"][1]],
+        )
+        response = self.client.get(self.url, self.data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["chart_data"]["chart1"]["values"], [3, 2])
+
+    def test_chart_data_version_read_once(self):
+        self.client.get(self.url, self.data)
+        # Cached data for another screen : version, event and question are read once each
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url, self.data)
+        self.assertEqual(response.status_code, 200)
+
+    def test_chart_data_bad_request(self):
+        self.assertEqual(self.client.get(self.url, {"comp_slug": self.data["comp_slug"]}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, dict(self.data, question_no="un")).status_code, 400)
+
+    def test_chart_data_not_found(self):
+        self.assertEqual(self.client.get(self.url, dict(self.data, question_no=99)).status_code, 404)
+        self.assertEqual(self.client.get(self.url, dict(self.data, event_slug="inconnu")).status_code, 404)
+
+
+@override_settings(CHART_STREAM=True, CHART_STREAM_DURATION=0)
+class TestChartStream(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.test_data = set_full_context()
+        self.url = reverse("polls:chart_stream")
+        self.data = {
+            "comp_slug": self.test_data["company"].comp_slug,
+            "event_slug": self.test_data["event1"].slug,
+            "question_no": 1,
+        }
+        self.client.force_login(self.test_data["usr11"].user)
+
+    def test_stream_login_required(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url, self.data).status_code, 302)
+
+    @override_settings(CHART_STREAM=False)
+    def test_stream_disabled(self):
+        self.assertEqual(self.client.get(self.url, self.data).status_code, 404)
+
+    def test_stream_bad_request(self):
+        self.assertEqual(self.client.get(self.url, dict(self.data, question_no="un")).status_code, 400)
+
+    @override_settings(CHART_STREAM_DURATION=60)
+    def test_stream_ends_when_question_deleted(self):
+        response = self.client.get(self.url, self.data)
+        self.test_data["question_list_1"][0].delete()
+        content = b"".join(response.streaming_content).decode()
+        self.assertNotIn("event: chart", content)
+
+    @override_settings(CHART_STREAM_DURATION=0.3, CHART_STREAM_INTERVAL=0.1, CHART_STREAM_CHECK_INTERVAL=60)
+    def test_stream_reads_version_on_signal_only(self):
+        event = self.test_data["event1"]
+        question = self.test_data["question_list_1"][0]
+        etag = Question.get_results_etag(self.data["comp_slug"], event.slug, 1)
+        # With no new vote signaled, the results version is read once
+        with self.assertNumQueries(1):
+            content = "".join(chart_data_stream(self.data["comp_slug"], event, question, etag))
+        self.assertNotIn("event: chart", content)
+
+    def test_stream_chart_data(self):
+        response = self.client.get(self.url, self.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        content = b"".join(response.streaming_content).decode()
+        self.assertIn("event: chart", content)
+        data = json.loads(content.split("data: ")[1].split("\n")[0])
+        self.assertEqual(data["chart_data"]["global"]["values"], [30, 70])
+
+    def test_stream_unchanged_data_not_sent(self):
+        etag = self.client.get(reverse("polls:chart_data"), self.data)["ETag"]
+        response = self.client.get(self.url, self.data, HTTP_LAST_EVENT_ID=etag.strip('"'))
+        content = b"".join(response.streaming_content).decode()
+        self.assertNotIn("event: chart", content)
+
+
+class TestVote(TestCase):
+    def setUp(self):
+        self.test_data = set_default_context()
+        self.event = self.test_data["event1"]
+        init_event(self.event)
+        self.question = self.test_data["question_list_1"][0]
+        self.choice = self.test_data["choice_list_1"][1]
+        self.url = reverse("polls:vote", args=(self.test_data["company"].comp_slug, self.event.slug, 1))
+        self.client.force_login(self.test_data["usr11"].user)
+
+    def test_vote(self):
+        response = self.client.post(self.url, {"choice": self.choice.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"success": "OK", "nb_votes": 0})
+        user_vote = UserVote.get_user_vote(self.event, self.test_data["usr11"], self.question)
+        self.assertTrue(user_vote.has_voted)
+        self.assertEqual(Result.get_tally(self.event, self.question).matrix[0], [0, 1])
+        self.assertEqual(self.question.get_results(), {"Choix 1": 60, "Choix 2": 40})
+
+    def test_vote_query_budget(self):
+        # Session, user and usercomp, then the transaction : one read, the user's vote stored
+        # within a savepoint, the ballot and the vote's updates (no lock, no leading choice to check)
+        with self.assertNumQueries(15):
+            self.client.post(self.url, {"choice": self.choice.id})
+
+        # The budget does not depend on the number of groups and choices
+        Choice.create_choice(self.event, 3, "Choix 3")
+        group3 = UserGroup.create_group(self.test_data["company"], "Groupe 3", weight=0)
+        self.event.groups.add(group3)
+        self.client.force_login(self.test_data["usr21"].user)
+        with self.assertNumQueries(15):
+            self.client.post(self.url, {"choice": self.choice.id})
+
+    def test_vote_no_vote_left(self):
+        self.client.post(self.url, {"choice": self.choice.id})
+        response = self.client.post(self.url, {"choice": self.choice.id})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Result.get_tally(self.event, self.question).matrix[0], [0, 1])
+
+    def test_vote_unknown_choice(self):
+        other_choice = Choice.create_choice(self.test_data["event2"], 3, "Choix 3")
+        response = self.client.post(self.url, {"choice": other_choice.id})
+        self.assertEqual(response.status_code, 403)
+        user_vote = UserVote.get_voter_status(self.event, self.test_data["usr11"], self.question)
+        self.assertIsNone(user_vote.id)
+        self.assertEqual(user_vote.nb_user_votes, 1)
+
+    def test_vote_closed_event(self):
+        close_event(self.event)
+        response = self.client.post(self.url, {"choice": self.choice.id})
+        self.assertEqual(response.status_code, 403)
+
+    def test_vote_sent_again(self):
+        response = self.client.post(self.url, {"choice": self.choice.id}, HTTP_IDEMPOTENCY_KEY="vote-1")
+        # Same key : first response is sent again from the shared cache, the vote is not processed
+        # (session and user, then the shared cache table only)
+        with self.assertNumQueries(9):
+            response_again = self.client.post(self.url, {"choice": self.choice.id}, HTTP_IDEMPOTENCY_KEY="vote-1")
+        self.assertEqual(response_again.status_code, 200)
+        self.assertEqual(response_again.json(), response.json())
+        self.assertEqual(Result.get_tally(self.event, self.question).matrix[0], [0, 1])
+
+        # Another key is another vote : refused, no vote left
+        response = self.client.post(self.url, {"choice": self.choice.id}, HTTP_IDEMPOTENCY_KEY="vote-2")
+        self.assertEqual(response.status_code, 403)
+
+    def test_vote_sent_again_other_question(self):
+        # Same key for another question : the key is scoped to the event and question
+        self.client.post(self.url, {"choice": self.choice.id}, HTTP_IDEMPOTENCY_KEY="vote-1")
+        url = reverse("polls:vote", args=(self.test_data["company"].comp_slug, self.event.slug, 2))
+        response = self.client.post(url, {"choice": self.choice.id}, HTTP_IDEMPOTENCY_KEY="vote-1")
+        self.assertEqual(response.status_code, 200)
+        question2 = self.test_data["question_list_1"][1]
+        self.assertEqual(Result.get_tally(self.event, question2).matrix[0], [0, 1])
+
+    def test_vote_journal(self):
+        # Ballot is only written in the journal, and counted when the journal is flushed
+        journal = os.path.join(tempfile.mkdtemp(), "votes.log")
+        with override_settings(VOTES_JOURNAL=journal):
+            response = self.client.post(self.url, {"choice": self.choice.id})
+            # The vote is accepted, but not counted yet
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.json(), {"success": "OK", "nb_votes": 0, "pending": True})
+            self.assertEqual(Result.get_tally(self.event, self.question).matrix[0], [0, 0])
+
+            self.assertEqual(flush_journal(), 1)
+        self.assertEqual(Result.get_tally(self.event, self.question).matrix[0], [0, 1])
+        self.assertFalse(os.listdir(os.path.dirname(journal)))
+
+    def test_vote_journal_no_vote_left(self):
+        # The user's only vote is reserved before his ballot is journaled :
+        # a second vote is refused before being counted
+        journal = os.path.join(tempfile.mkdtemp(), "votes.log")
+        with override_settings(VOTES_JOURNAL=journal):
+            self.client.post(self.url, {"choice": self.choice.id})
+            response = self.client.post(self.url, {"choice": self.choice.id})
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(flush_journal(), 1)
+
+            # Once counted, the vote is refused by the database
+            response = self.client.post(self.url, {"choice": self.choice.id})
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(flush_journal(), 0)
+        self.assertEqual(Result.get_tally(self.event, self.question).matrix[0], [0, 1])
+
+    def test_vote_journal_proxy(self):
+        # Votes are reserved one by one : a user with several votes can use all of them
+        journal = os.path.join(tempfile.mkdtemp(), "votes.log")
+        # Procurations are set before the event is launched
+        Event.objects.filter(id=self.event.id).update(current=False)
+        Procuration.set_user_proxy(self.event, self.test_data["usr12"], self.test_data["usr11"])
+        Procuration.confirm_proxy(self.event, self.test_data["usr11"], self.test_data["usr12"].id)
+        init_event(self.event)
+        with override_settings(VOTES_JOURNAL=journal):
+            response = self.client.post(self.url, {"choice": self.choice.id})
+            self.assertEqual(response.json()["nb_votes"], 1)
+            self.assertEqual(flush_journal(), 1)
+            response = self.client.post(self.url, {"choice": self.choice.id})
+            self.assertEqual(response.json()["nb_votes"], 0)
+            response = self.client.post(self.url, {"choice": self.choice.id})
+            self.assertEqual(response.status_code, 403)
+            self.assertEqual(flush_journal(), 1)
+        self.assertEqual(Result.get_tally(self.event, self.question).matrix[0], [0, 2])
+
+
+class TestExports(TestCase):
+    def setUp(self):
+        self.test_data = set_default_context()
+        self.company = self.test_data["company"]
+        self.event = self.test_data["event1"]
+        init_event(self.event)
+        UserVote.cast_vote(
+            self.test_data["usr11"], self.company.comp_slug, self.event.slug, 1,
+            self.test_data["choice_list_1"][0].id,
+        )
+        self.client.force_login(self.test_data["user_staff"].user)
+
+    def get_csv_rows(self, response):
+        content = b"".join(response.streaming_content).decode("utf-8-sig")
+        return [line.split(";") for line in content.splitlines()]
+
+    def test_export_members_csv(self):
+        response = self.client.get(reverse("polls:export_members", args=(self.company.comp_slug, "csv")))
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        rows = self.get_csv_rows(response)
+        self.assertEqual(rows[0][:3], ["Groupe", "Nom", "Prénom"])
+        # Members of the default group, then of each group
+        self.assertIn(["Groupe 1", "nom_user11", "", "user11", "user11@toto.com", "", "Non"], rows)
+        self.assertEqual(len([row for row in rows if row[0] == "Default Group"]), 7)
+
+    def test_export_participation_xlsx(self):
+        url = reverse("polls:export_event", args=(self.company.comp_slug, self.event.slug, "participation", "xlsx"))
+        response = self.client.get(url)
+        ws = openpyxl.load_workbook(BytesIO(b"".join(response.streaming_content))).active
+        rows = list(ws.iter_rows(values_only=True))
+        # 6 members, 2 questions
+        self.assertEqual(len(rows), 13)
+        voter_rows = [row for row in rows[1:] if row[5] == "Oui"]
+        self.assertEqual(len(voter_rows), 1)
+        self.assertEqual(voter_rows[0][:5], (1, "Groupe 1", "nom_user11", None, "user11"))
+        self.assertIsNotNone(voter_rows[0][6])
+
+    def test_export_results_csv(self):
+        url = reverse("polls:export_event", args=(self.company.comp_slug, self.event.slug, "results", "csv"))
+        rows = self.get_csv_rows(self.client.get(url))
+        self.assertEqual(rows[1], ["1", "Question 1", "Groupe 1", "40", "Choix 1", "1"])
+        # 2 questions x 2 groups x 2 choices
+        self.assertEqual(len(rows), 9)
+
+    def test_export_not_admin(self):
+        self.client.force_login(self.test_data["usr11"].user)
+        response = self.client.get(reverse("polls:export_members", args=(self.company.comp_slug, "csv")))
+        self.assertEqual(response.status_code, 404)
+        self.client.force_login(self.test_data["user_staff"].user)
+        url = reverse("polls:export_event", args=(self.company.comp_slug, self.event.slug, "results", "pdf"))
+        self.assertEqual(self.client.get(url).status_code, 404)
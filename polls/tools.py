@@ -2,16 +2,27 @@
 
 ''' Tools for Votes app '''
 import random
+import json
+import time
+import functools
+import hashlib
+import os
+import re
 # from django.conf import settings
 
 from django.conf import settings
+from django.core.cache import cache, caches
+from django.http import JsonResponse
+from django.db import connection, transaction
 from django.utils import timezone
 import datetime
-from django.db.models import Count
 
 from django.contrib.auth.models import User
+from django.contrib.auth.hashers import make_password
 from django.core.files.uploadedfile import SimpleUploadedFile
 
+import openpyxl
+
 from .models import (
     Company,
     Event,
@@ -20,8 +31,11 @@ from .models import (
     UserVote,
     UserGroup,
     Result,
+    GroupTally,
+    ChoiceTally,
     Procuration,
     UserComp,
+    ResultsSnapshot,
 )
 
 
@@ -85,6 +99,193 @@ def create_new_user(comp_slug, user_data):
     return new_user, usr_comp
 
 
+USERS_FILE_COLUMNS = ['Nom', 'Prénom', 'Mail', 'Téléphone', 'Username']
+
+
+def import_users_file(company, users_file, sheet, progress=None, pool=None):
+    """
+    Import users of a company from a workbook's sheet
+    Rows are streamed from the file, which is never loaded as a whole
+    Raises ValueError if the sheet does not have the expected columns
+    """
+    wb = openpyxl.load_workbook(users_file, read_only=True)
+    try:
+        try:
+            ws = wb[sheet]
+        except KeyError:
+            raise ValueError("Chargement du fichier impossible : l'onglet {} n'existe pas".format(sheet))
+        rows = ws.iter_rows(values_only=True)
+
+        # Gather values in file's first row - supposed to be headers to retreive data
+        titles = list(next(rows, []))
+        try:
+            index_list = [titles.index(elt) for elt in USERS_FILE_COLUMNS]
+        except ValueError:
+            raise ValueError("Chargement du fichier impossible : la structure ne correspond pas à ce qui est attendu")
+
+        return import_users(
+            company,
+            ([row[index] if index < len(row) else None for index in index_list] for row in rows),
+            progress=progress,
+            nb_rows=(ws.max_row or 1) - 1,
+            pool=pool,
+        )
+    finally:
+        wb.close()
+
+
+def import_users(company, rows, batch_size=None, progress=None, nb_rows=None, pool=None):
+    """
+    Import users of a company from rows : last name, first name, email, phone number, username
+    Usernames are checked in memory against existing ones, then users, their profiles and
+    their membership to the company's default group are inserted in batches
+    Initial passwords of each batch are hashed in parallel by the pool of processes, if provided
+    After each batch, progress (if provided) is called with the percentage of rows done
+    (if their number nb_rows is known) and the counts of lines, users created, warnings and errors
+    Returns the number of lines, the number of users created, error and warning messages
+    """
+    batch_size = batch_size or settings.USERS_IMPORT_BATCH
+
+    # Existing users, by username : identity is checked when a username is already used
+    user_list = {
+        username: (last_name, first_name, email)
+        for username, last_name, first_name, email in User.objects.values_list(
+            "username", "last_name", "first_name", "email"
+        ).iterator()
+    }
+    nb_lines = 0
+    nb_users = 0
+    err_messages = []
+    warn_messages = []
+    batch = []
+
+    for last_name, first_name, email, phone_num, username in rows:
+        if not any((last_name, first_name, email, phone_num, username)):
+            # Empty row
+            continue
+        nb_lines += 1
+
+        # Data controls :
+        # - user unicity : if username alreay exists;
+        #       * for provided usernames, raise an error and reject line
+        #       * else (username == last_name) : check first name and email
+        #           if both are equal, reject row
+        #           else : define new id with first-name chars
+        # - phone numer format (warning only)
+        username, error = get_unique_username(user_list, username, last_name, first_name, email)
+        if error is not None:
+            err_messages.insert(0, error)
+            continue
+
+        if phone_num is not None and not re.match(r'^0[0-9]([ .-]?[0-9]{2}){4}$', str(phone_num)):
+            phone_num = ''    # integrate no phone number rather than invalid one
+            warn_messages.insert(0, "Utilisateur {0} {1} : numéro de téléphone invalide".format(last_name, first_name))
+
+        user_list[username] = (last_name, first_name, email)
+        batch.append((
+            User(
+                username=username,
+                last_name=last_name or "",
+                first_name=first_name or "",
+                email=email or "",
+            ),
+            phone_num,
+        ))
+        if len(batch) >= batch_size:
+            nb_users += create_users_batch(company, batch, pool)
+            batch = []
+            if progress is not None:
+                progress(
+                    min(99, nb_lines * 100 // nb_rows) if nb_rows else 0,
+                    result=get_import_counts(nb_lines, nb_users, err_messages, warn_messages),
+                )
+
+    if batch:
+        nb_users += create_users_batch(company, batch, pool)
+
+    return nb_lines, nb_users, err_messages, warn_messages
+
+
+def get_import_counts(nb_lines, nb_users, err_messages, warn_messages):
+    """ Counts of a users' import, as sent to its progress page """
+    return {
+        "nb_lines": nb_lines,
+        "nb_users": nb_users,
+        "nb_warnings": len(warn_messages),
+        "nb_errors": len(err_messages),
+    }
+
+
+def get_unique_username(user_list, username, last_name, first_name, email):
+    """
+    Username of a new user, checked against existing ones (dict username -> identity)
+    A username given in the file must not be used yet ; the default one (last name)
+    is completed with first name's chars until it is unique
+    Returns the username, and an error message if no username can be used
+    """
+    identity = (last_name, first_name, email)
+    already_exists = "Utilisateur {0} {1} non créé : il existe déjà".format(last_name, first_name)
+    if username is not None:
+        username = str(username)
+        if username in user_list:
+            return username, already_exists
+        return username, None
+
+    username = (last_name or "").lower()
+    first_name_chars = (first_name or "").lower()
+    i = 0
+    while username in user_list:
+        if user_list[username] == identity:
+            return username, already_exists
+        if i >= len(first_name_chars):
+            # Not able to automatically define a unique username
+            return username, "Utilisateur {0} {1} non créé : impossible de définir un nom d'utilisateur unique".format(
+                last_name, first_name
+            )
+        username += first_name_chars[i:i+1]
+        i += 1
+    return username, None
+
+
+def create_users_batch(company, batch, pool=None):
+    """
+    Insert a batch of users, with their profiles and their membership to the default group
+    Initial password of each user is his username
+    """
+    # Passwords are hashed before the transaction : hashing is most of the import's time
+    passwords = hash_passwords([user.username for user, phone_num in batch], pool)
+    for (user, phone_num), password in zip(batch, passwords):
+        user.password = password
+
+    with transaction.atomic():
+        User.objects.bulk_create([user for user, phone_num in batch])
+        # Primary keys are not set by bulk_create on every database : they are read again
+        user_ids = dict(
+            User.objects.filter(username__in=[user.username for user, phone_num in batch]).values_list("username", "id")
+        )
+        UserComp.bulk_create_usercomps(company, [
+            UserComp(user_id=user_ids[user.username], phone_num=phone_num)
+            for user, phone_num in batch
+        ])
+    return len(batch)
+
+
+# Under this number of passwords, hashing them in the pool costs more than it saves
+HASH_POOL_MIN_PASSWORDS = 16
+
+
+def hash_passwords(passwords, pool=None):
+    """
+    Hash a list of passwords, in the same order
+    Each hash takes hundreds of milliseconds : many passwords are split between the pool's processes
+    """
+    if pool is None or len(passwords) < HASH_POOL_MIN_PASSWORDS:
+        return [make_password(password) for password in passwords]
+
+    nb_workers = settings.PASSWORD_HASH_WORKERS or os.cpu_count() or 1
+    return list(pool.map(make_password, passwords, chunksize=max(1, len(passwords) // (nb_workers * 4))))
+
+
 def user_is_admin(comp_slug, current_user):
     """
     Check whether current user has admin access or not (for his company)
@@ -99,96 +300,111 @@ def user_is_admin(comp_slug, current_user):
     return access_admin
 
 
-def init_event(event):
+def init_event(event, progress=None):
     """
     Initialize an event and set it as current
+    Questions are initialized one by one, one transaction each : progress, if provided,
+    is called with the percentage done after each question, and is seen by other requests
+    A launch is still all or nothing for voters : the event is set as current at the end only,
+    and votes are refused until then. If the launch is interrupted, it is started again
+    from scratch
+    Returns False if the event is already launched or closed, or if it was closed during the launch
     """
-    UserVote.init_uservotes(event)
-    event.set_current()
+    if not event.starting and not event.set_starting():
+        return False
+
+    # Leftovers of an interrupted launch are removed first
+    Result.objects.filter(event=event).delete()
+    GroupTally.objects.filter(event=event).delete()
+    ChoiceTally.objects.filter(event=event).delete()
 
+    question_list = list(Question.get_question_list(event))
+    for question_index, question in enumerate(question_list, 1):
+        UserVote.init_uservotes(event, [question])
+        if progress is not None:
+            progress(question_index * 100 // len(question_list))
+    return event.set_current()
 
-def set_chart_data(event, evt_group_list, question):
+
+def close_event(event):
+    """
+    Close an event : results can not change anymore
+    They are calculated one last time and frozen in a snapshot,
+    with groups' results, turnout and quorum status of each question
+    Returns False if the event is being launched (or already closed) : it is left unchanged
+    """
+    with transaction.atomic():
+        # The event's row is locked : it is not launched meanwhile
+        if not Event.objects.select_for_update().filter(id=event.id, starting=False, closed=False).exists():
+            return False
+
+        tallies = Result.get_event_tallies(event)
+        event_results = []
+        for question_results in event.get_results():
+            question = question_results["question"]
+            chart_data = set_chart_data(event, question, tallies.get(question.id), question_results["results"])
+            nb_votes = chart_data["chart_data"]["global"]["nb_votes"]
+            total_votes = chart_data["chart_data"]["global"]["total_votes"]
+
+            event_results.append({
+                "question": {
+                    "question_no": question.question_no,
+                    "question_text": question.question_text,
+                },
+                "results": question_results["results"],
+                "chart_results": question_results["chart_results"],
+                "chart_data": chart_data,
+                "nb_votes": nb_votes,
+                "total_votes": total_votes,
+                # Same rule as charts display : results are valid if nb votes > quorum
+                "quorum_reached": total_votes > 0 and nb_votes / total_votes > event.quorum / 100,
+            })
+
+        ResultsSnapshot.save_results(event, event_results)
+        event.set_closed()
+    return True
+
+
+def set_chart_data(event, question, tally=None, group_vote=None):
     """
     Define data to display related charts
+    Groups' charts read the groups x choices counts kept up to date with each vote,
+    gathered at once in the question's tally ; the global chart reads choices' tallies
     """
-
-    # Initialize charts variables
+    if tally is None:
+        tally = Result.get_tally(event, question)
+    if group_vote is None:
+        group_vote = ChoiceTally.get_results(event, question, tally)
+    if group_vote is None:
+        # Event not launched, or launched before choices' tallies were kept
+        group_vote = tally.get_results()
+
+    # Group results : one chart per group
     group_data = {}
     nb_groups = 0
-
-    # Initialize global results data
-    global_choice_list = Choice.get_choice_list(event).values("choice_text")
-    group_vote = {}
-    global_total_votes = 0
-    global_nb_votes = 0
-    for choice in global_choice_list:
-        group_vote[choice["choice_text"]] = 0
-
-    # Gather votes info for each group
-    for evt_group in evt_group_list:
+    nb_votes = 0
+    for group in tally.groups:
         nb_groups += 1
-        total_votes = UserGroup.objects.filter(id=evt_group.id).aggregate(
-            Count("users")
-        )["users__count"]
-
-        result_list = Result.get_vote_list(event, evt_group, question).values(
-            "choice__choice_text", "votes", "group_weight"
-        )
-
-        labels = [choice["choice__choice_text"] for choice in result_list]
-        values = [choice["votes"] for choice in result_list]
-        nb_votes = sum(values)
+        nb_votes = sum(group["values"])
 
         chart_nb = "chart" + str(nb_groups)
         group_data[chart_nb] = {
             "nb_votes": nb_votes,
-            "total_votes": total_votes,
-            "labels": labels,
-            "values": values,
+            "total_votes": group["nb_users"],
+            "labels": group["labels"],
+            "values": group["values"],
         }
 
-        # Calculate aggregate results
-        # Use if / elif to ease adding future rules
-        global_total_votes += total_votes
-        global_nb_votes += nb_votes
-        weight = result_list[0]["group_weight"]
-        if event.rule == "MAJ":
-            # A MODIFIER : cas d'égalité, pas de valeur... (règles à définir)
-            max_val = values.index(max(values))
-            group_vote[labels[max_val]] += weight
-        elif event.rule == "PROP":
-            # Calculate totals per choice, including group's weight
-            # Addition of each group's result
-            for i, choice in enumerate(labels):
-                if choice in group_vote:
-                    group_vote[choice] += values[i] * weight / 100
-
-    if event.rule == "PROP":
-        # Calculate percentage for each choice
-        total_votes = 0
-        for val in group_vote.values():
-            total_votes += val
-        # Calculate global results only if at least 1 vote
-        if total_votes > 0:
-            for choice, value in group_vote.items():
-                group_vote[choice] = round((value / total_votes) * 100, 2)
-
     # Setup global info for charts
-    global_labels = []
-    global_values = []
-    for label, value in group_vote.items():
-        global_labels.append(label)
-        global_values.append(value)
-
     group_data["global"] = {
-        "nb_votes": global_nb_votes,
-        "total_votes": global_total_votes,
-        "labels": global_labels,
-        "values": global_values,
+        "nb_votes": tally.nb_votes,
+        "total_votes": tally.nb_users,
+        "labels": list(group_vote.keys()),
+        "values": list(group_vote.values()),
     }
 
-    chart_background_colors = background_colors
-    chart_border_colors = border_colors
+    chart_background_colors = list(background_colors)
+    chart_border_colors = list(border_colors)
 
     # Extends color lists to fit with nb values to display
     while len(chart_background_colors) < nb_votes:
@@ -203,3 +419,124 @@ def set_chart_data(event, evt_group_list, question):
     }
 
     return data
+
+
+def get_cached_chart_data(comp_slug, event, question, etag=None):
+    """
+    Charts data are computed once for each version of the question's results,
+    then shared by all screens through the cache
+    A new vote changes the version, hence the cache key : no invalidation needed
+    Charts data of a closed event are read from its snapshot
+    Returns None if the question does not exist anymore
+    """
+    if event.closed:
+        data = ResultsSnapshot.get_chart_data(event, question.question_no)
+        if data is not None:
+            return data
+
+    if etag is None:
+        etag = Question.get_results_etag(comp_slug, event.slug, question.question_no)
+        if etag is None:
+            return None
+    data_key = "polls:chart_data:" + etag
+    lock_key = "polls:chart_data_lock:" + etag
+
+    data = cache.get(data_key)
+    if data is None:
+        # Only one screen computes the data, others wait for the result
+        if not cache.add(lock_key, True, timeout=5):
+            for i in range(20):
+                time.sleep(0.05)
+                data = cache.get(data_key)
+                if data is not None:
+                    return data
+
+        data = set_chart_data(event, question)
+        cache.set(data_key, data, settings.CHART_DATA_CACHE_TIMEOUT)
+        cache.delete(lock_key)
+
+    return data
+
+
+def idempotent_vote(view):
+    """
+    Decorator for views receiving votes : a request sent again with the same
+    Idempotency-Key header, for the same event and question, is answered with
+    the first response, without being processed again
+    Requests with no key are processed as usual
+    Responses are kept in the shared cache : a request sent again may reach another process
+    """
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.META.get("HTTP_IDEMPOTENCY_KEY")
+        if not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+
+        shared_cache = caches["shared"]
+        response_key = "polls:vote_response:{}:{}:{}:{}".format(
+            request.user.id,
+            kwargs.get("event_slug"),
+            kwargs.get("question_no"),
+            hashlib.sha1(key.encode()).hexdigest(),
+        )
+        if not shared_cache.add(response_key, None, settings.VOTE_IDEMPOTENCY_TIMEOUT):
+            sent_response = shared_cache.get(response_key)
+            if sent_response is None:
+                # First request still in progress
+                return JsonResponse({"success": "KO"}, status=409)
+            return JsonResponse(sent_response["data"], status=sent_response["status"])
+
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            shared_cache.delete(response_key)
+            raise
+        shared_cache.set(
+            response_key,
+            {"data": json.loads(response.content), "status": response.status_code},
+            settings.VOTE_IDEMPOTENCY_TIMEOUT,
+        )
+        return response
+
+    return wrapper
+
+
+def chart_data_stream(comp_slug, event, question, last_etag=None):
+    """
+    Generator of Server-Sent Events with charts data
+    New data are sent only when the question's results version changes,
+    until the stream duration is over or the question is deleted
+    The version is read only when the cache signals new votes, or every
+    CHART_STREAM_CHECK_INTERVAL in case the vote was counted by a process
+    which does not share the cache
+    """
+    end_time = time.monotonic() + settings.CHART_STREAM_DURATION
+    signal_key = Question.get_results_signal_key(question.id)
+    last_signal = None
+    next_check = 0
+
+    # Browsers wait 1s before reconnecting once the stream is closed
+    yield "retry: 1000\n\n"
+    while True:
+        signal = cache.get(signal_key)
+        if signal != last_signal or time.monotonic() >= next_check:
+            last_signal = signal
+            next_check = time.monotonic() + settings.CHART_STREAM_CHECK_INTERVAL
+
+            etag = Question.get_results_etag(comp_slug, event.slug, question.question_no)
+            if etag is None:
+                # Question deleted meanwhile
+                break
+            if etag != last_etag:
+                event.refresh_from_db(fields=["rule"])
+                data = get_cached_chart_data(comp_slug, event, question, etag)
+                yield "id: {}\nevent: chart\ndata: {}\n\n".format(etag, json.dumps(data))
+                last_etag = etag
+
+            if not connection.in_atomic_block:
+                # The database connection is not kept while waiting
+                connection.close()
+
+        if time.monotonic() >= end_time:
+            break
+        time.sleep(settings.CHART_STREAM_INTERVAL)
@@ -9,6 +9,7 @@ from django.utils.text import slugify
 
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends.locmem import EmailBackend
 
 from .models import (
     Company,
@@ -25,6 +26,15 @@ from .models import (
 from .tools import init_event
 
 
+class FailingEmailBackend(EmailBackend):
+    """ Test mail backend refusing messages sent to addresses starting with "fail" """
+
+    def send_messages(self, messages):
+        for message in messages:
+            if any(address.startswith("fail") for address in message.recipients()):
+                raise ConnectionError("Serveur indisponible")
+        return super().send_messages(messages)
+
 
 def create_dummy_user(company, username, group=None, staff=False, admin=False):
     email = username + "@toto.com"
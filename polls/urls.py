@@ -8,9 +8,11 @@ app_name = "polls"
 urlpatterns = [
     path("", views.index, name="index"),
     path("get_chart_data/", views.get_chart_data, name="chart_data"),
+    path("get_chart_stream/", views.get_chart_stream, name="chart_stream"),
     path("set_proxy/", views.set_proxy, name="set_proxy"),
     path("accept_proxy/", views.accept_proxy, name="accept_proxy"),
     path("cancel_proxy/", views.cancel_proxy, name="cancel_proxy"),
+    path("job_status/<int:job_id>/", views.job_status, name="job_status"),
     path("sign_up/", views.new_user, name="sign_up"),
     path("login/", views.login_user, name="login"),
     path("logout/", views.logout_user, name="logout"),
@@ -34,6 +36,8 @@ urlpatterns = [
     path("<slug:comp_slug>/admin_group_detail/<int:grp_id>/", views.adm_group_detail, name="adm_group_detail"),
     path("<slug:comp_slug>/admin_delete_group/<int:grp_id>", views.adm_delete_group, name="adm_delete_group"),
 
+    path("<slug:comp_slug>/admin_export/members.<slug:file_format>", views.export_members, name="export_members"),
+
     path("<slug:comp_slug>/admin_options/", views.adm_options, name="adm_options"),
     path("<slug:comp_slug>/admin_update_options/", views.adm_update_options, name="adm_update_options"),
 
@@ -41,4 +45,10 @@ urlpatterns = [
     path("<slug:comp_slug>/<slug:event_slug>/<int:question_no>", views.question, name="question"),
     path("<slug:comp_slug>/<slug:event_slug>/<int:question_no>/vote", views.vote, name="vote"),
     path("<slug:comp_slug>/<slug:event_slug>/results", views.results, name="results"),
+    path("<slug:comp_slug>/<slug:event_slug>/close", views.close_event_results, name="close_event"),
+    path(
+        "<slug:comp_slug>/<slug:event_slug>/export/<slug:export_name>.<slug:file_format>",
+        views.export_event,
+        name="export_event",
+    ),
 ]
@@ -1,17 +1,19 @@
 # -*-coding:Utf-8 -*
 
-from django.http import JsonResponse
-from django.shortcuts import render, redirect, reverse
+from django.http import JsonResponse, StreamingHttpResponse, Http404
+from django.shortcuts import render, redirect, reverse, get_object_or_404
 # from django.template.loader import render_to_string
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required, user_passes_test
+from django.views.decorators.http import condition
 from django.contrib.auth.forms import PasswordChangeForm
 from django.db.models import Sum
 from django.contrib import messages
 from django.forms import formset_factory
 # from django.utils.text import slugify
-# from django.conf import settings
+from django.conf import settings
+from django.core.files.storage import default_storage
 # from django.contrib.auth.password_validation import validate_password
 # from django.core.exceptions import ValidationError
 # from django.core.files import File
@@ -23,10 +25,6 @@ from django.forms import formset_factory
 # from django.views.generic.list import ListView
 # from django.core.exceptions import ValidationError
 
-import openpyxl
-
-import re
-
 from .forms import (
     ChoiceDetail,
     CreateUserForm,
@@ -41,11 +39,23 @@ from .forms import (
 )
 
 # from .tools import define_password
-from .tools import set_chart_data, init_event, user_is_admin, create_new_user
+from .tools import (
+    get_cached_chart_data,
+    chart_data_stream,
+    idempotent_vote,
+    close_event,
+    user_is_admin,
+    create_new_user,
+)
 
+from .journal import journal_ballot
+from .jobs import start_event, submit_job
+from .exports import CONTENT_TYPES, export_response, members_rows, participation_rows, results_rows
 from .pollsmail import PollsMail
 
 import json
+import os
+import uuid
 
 from .models import (
     Company,
@@ -57,6 +67,7 @@ from .models import (
     Result,
     Procuration,
     UserComp,
+    Job,
 )
 
 
@@ -173,15 +184,17 @@ def event(request, comp_slug, event_slug):
     nb_questions = len(question_list)
 
     # Check if connected user is part of the event and is authorized to vote
+    # Members and procurations of the event are read at once
+    proxy_graph = Procuration.get_proxy_graph(event)
     user_can_vote = False
     if request.user.usercomp.is_admin: user_can_vote = True
 
-    if UserGroup.user_in_event(event, request.user.usercomp): 
+    if proxy_graph.is_member(request.user.usercomp):
         user_can_vote = True
 
         # Get user's proxy status
         proxy_list, user_proxy, user_proxy_list = Procuration.get_proxy_status(
-            event, request.user.usercomp
+            event, request.user.usercomp, proxy_graph
         )
 
     return render(request, "polls/event.html", locals())
@@ -201,23 +214,34 @@ def question(request, comp_slug, event_slug, question_no):
     last_question = False
 
     # Start event - occur when staff only used "Launch event" button
+    # A closed event can not be launched again
     total_grp_weights = UserGroup.objects.filter(event=event).aggregate(Sum("weight"))["weight__sum"]
-    if request.user.usercomp.is_admin and not event.current:
+    # A launch whose job is dead is started again
+    if request.user.usercomp.is_admin and not event.current and not event.closed:
         # Event can be launched only if total groups' weight == 100
         if total_grp_weights != 100:
             return redirect("polls:event", comp_slug=comp_slug, event_slug=event_slug)
         else:
-            # Initialize users vote & results table
-            init_event(event)
+            # Initialize results tables in the background
+            start_event(event)
+            event.refresh_from_db()
+
+    # Event being launched : its progress is displayed until it is current
+    if event.starting:
+        job = Job.get_event_job(event, "launch_event")
+        return render(request, "polls/starting.html", locals())
 
     # Gather user's info about the current question
     if not request.user.usercomp.is_admin:
-        user_vote = UserVote.get_user_vote(event, request.user.usercomp, question_no)
+        user_vote = UserVote.get_voter_status(event, request.user.usercomp, question)
 
     # Check if current question is the last one
     if question_no == len(Question.get_question_list(event)):
         last_question = True
 
+    # Live results are pushed by the server, or polled by the page
+    chart_stream = settings.CHART_STREAM
+
     return render(request, "polls/question.html", locals())
 
 
@@ -227,39 +251,147 @@ def results(request, comp_slug, event_slug):
 
     # company = Company.get_company(comp_slug)
     event = Event.get_event(comp_slug, event_slug)
-    question_list = Question.get_question_list(event)
-    nb_questions = len(question_list)
+    # All questions' results are calculated at once
+    event_results = event.get_results()
+    nb_questions = len(event_results)
 
     return render(request, "polls/results.html", locals())
 
 
+@login_required
+def close_event_results(request, comp_slug, event_slug):
+    """ Close the event : its results are frozen """
+    if not user_is_admin(comp_slug, request.user):
+        raise Http404
+
+    event = Event.get_event(comp_slug, event_slug)
+    if request.method == "POST" and not event.closed:
+        if close_event(event):
+            messages.success(request, "Evénement {} clôturé : les résultats sont figés.".format(event.event_name))
+        else:
+            messages.error(
+                request,
+                "L'événement {} est en cours de lancement : il ne peut pas encore être clôturé.".format(event.event_name),
+            )
+
+    return redirect("polls:results", comp_slug=comp_slug, event_slug=event_slug)
+
+
 # =======================
 #      Action views
 # =======================
 
 
+def get_chart_params(request):
+    """ Company, event and question number of a charts data request - None if missing or invalid """
+    try:
+        return request.GET["comp_slug"], request.GET["event_slug"], int(request.GET["question_no"])
+    except (KeyError, ValueError):
+        return None
+
+
+def chart_data_etag(request):
+    """ Charts data change only when a new vote is saved for the question
+        The version is kept in the request, so that the view does not read it again """
+    params = get_chart_params(request)
+    if params is None:
+        return None
+    request.results_etag = Question.get_results_etag(*params)
+    return request.results_etag
+
+
+@condition(etag_func=chart_data_etag)
 def get_chart_data(request):
-    """ Gather and send information to build charts via ajax get request """
+    """ Gather and send information to build charts via ajax get request
+        Unchanged data are not computed again : a 304 response is sent instead """
 
-    comp_slug = request.GET["comp_slug"]
-    event_slug = request.GET["event_slug"]
-    question_no = int(request.GET["question_no"])
+    params = get_chart_params(request)
+    if params is None:
+        return JsonResponse({"success": "KO"}, status=400)
+    comp_slug, event_slug, question_no = params
 
     event = Event.get_event(comp_slug, event_slug)
-    evt_group_list = UserGroup.get_group_list(event)
+    question = Question.get_question(event, question_no)
+    if question is None:
+        raise Http404
 
-    data = set_chart_data(event, evt_group_list, question_no)
+    data = get_cached_chart_data(comp_slug, event, question, getattr(request, "results_etag", None))
+    if data is None:
+        raise Http404
 
     return JsonResponse(data)
 
 
+@login_required
+def get_chart_stream(request):
+    """ Send charts data each time they change, as Server-Sent Events
+        Each stream holds a server worker until it ends : only available with CHART_STREAM setting """
+
+    if not settings.CHART_STREAM:
+        raise Http404
+
+    params = get_chart_params(request)
+    if params is None:
+        return JsonResponse({"success": "KO"}, status=400)
+    comp_slug, event_slug, question_no = params
+
+    event = Event.get_event(comp_slug, event_slug)
+    question = Question.get_question(event, question_no)
+    if question is None:
+        raise Http404
+
+    # On reconnection, the browser sends the id of the last data received
+    last_etag = request.META.get("HTTP_LAST_EVENT_ID")
+
+    response = StreamingHttpResponse(
+        chart_data_stream(comp_slug, event, question, last_etag),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+def job_status(request, job_id):
+    """
+    Send a background job's status and progress via ajax get request
+    Voters only follow their event's launch : other jobs are reserved to the company's admins
+    """
+
+    job = get_object_or_404(Job, id=job_id, company=request.user.usercomp.company)
+    if job.kind != "launch_event" and not user_is_admin(job.company.comp_slug, request.user):
+        raise Http404
+
+    return JsonResponse(job.get_status())
+
+
+@login_required
+@idempotent_vote
 def vote(request, comp_slug, event_slug, question_no):
     """ Manage users' votes """
 
-    choice = request.POST["choice"]
-    user_vote = UserVote.set_vote(event, request.user.usercomp, question, choices=[choice])
+    try:
+        choice_id = int(request.POST["choice"])
+    except (KeyError, ValueError):
+        return JsonResponse({"success": "KO"}, status=400)
+
+    if settings.VOTES_JOURNAL:
+        # Ballot is checked and one of the user's votes reserved, then it is written
+        # in the journal : it will be counted later in a batch
+        ballot = UserVote.get_ballot(request.user.usercomp, comp_slug, event_slug, question_no, choice_id)
+        if ballot is None or not journal_ballot(ballot):
+            return JsonResponse({"success": "KO"}, status=403)
+        data = {"success": "OK", "nb_votes": ballot["nb_user_votes"] - 1, "pending": True}
+        return JsonResponse(data, status=202)
+
+    nb_votes = UserVote.cast_vote(request.user.usercomp, comp_slug, event_slug, question_no, choice_id)
+
+    if nb_votes is None:
+        # No vote left, event not in progress or unknown choice
+        return JsonResponse({"success": "KO"}, status=403)
 
-    data = {"success": "OK", "nb_votes": user_vote.nb_user_votes}
+    data = {"success": "OK", "nb_votes": nb_votes}
 
     return JsonResponse(data)
 
@@ -271,7 +403,9 @@ def set_proxy(request):
     proxy = User.objects.get(id=request.POST["proxy"])
     event = Event.get_event(request.POST["comp_slug"], request.POST["event_slug"])
 
-    Procuration.set_user_proxy(event, user, proxy)
+    if not Procuration.set_user_proxy(event, user, proxy):
+        # Event launched : users' rights can not change anymore
+        return JsonResponse({"success": "KO"}, status=403)
     PollsMail(
         "ask_proxy",
         event,
@@ -300,7 +434,9 @@ def accept_proxy(request):
     event = Event.get_event(request.POST["comp_slug"], request.POST["event_slug"])
 
     for proxy_id in proxy_list:
-        Procuration.confirm_proxy(event, user, int(proxy_id))
+        if not Procuration.confirm_proxy(event, user, int(proxy_id)):
+            # Event launched : users' rights can not change anymore
+            return JsonResponse({"status": "Refused"}, status=403)
         PollsMail(
             "confirm_proxy", event, sender=[user.email], user=user, proxy_id=proxy_id
         )
@@ -313,16 +449,17 @@ def accept_proxy(request):
 def cancel_proxy(request):
     """ Cancel or refuse proxy """
 
-    event_slug = request.POST["event"]
+    event = get_object_or_404(Event, slug=request.POST["event"])
 
+    # Procurations are left unchanged once the event is launched
     if request.POST["Action"] == "Refuse":
         proxy_list = request.POST.getlist("user_proxy")
         for proxy in proxy_list:
-            Procuration.cancel_proxy(event_slug, int(proxy), request.user)
+            Procuration.cancel_proxy(event, int(proxy), request.user.usercomp)
     else:
-        Procuration.cancel_proxy(event_slug, request.user)
+        Procuration.cancel_proxy(event, request.user.usercomp)
 
-    return redirect("polls:event", event_slug=event_slug)
+    return redirect("polls:event", comp_slug=event.company.comp_slug, event_slug=event.slug)
 
 
 # ========================================
@@ -372,6 +509,15 @@ def adm_users(request, comp_slug):
     '''
     # Company's users list
     company = Company.get_company(comp_slug)
+
+    # Users' import : progress is displayed until it is finished, then its summary is delivered once
+    job_id = request.GET.get("job", "")
+    if job_id.isdigit():
+        job = get_object_or_404(Job, id=job_id, company=company, kind="import_users")
+        if job.status in ("DONE", "FAILED"):
+            add_import_messages(request, job)
+            return redirect("polls:adm_users", comp_slug=comp_slug)
+
     user_list = UserComp.objects.order_by('user__last_name').filter(company=company)
 
     # Prepare form to upload users from file
@@ -485,118 +631,38 @@ def adm_load_users(request, comp_slug):
         if form.is_valid():
             f = request.FILES['file']
 
-            wb = openpyxl.load_workbook(f)
-            sheet = request.POST['sheet']
-            ws = wb[sheet]
-
-            # Check the files has the required information
-            elt_list = ['Nom', 'Prénom', 'Mail', 'Téléphone', 'Username']
-
-            # Gather values in file's first row - supposed to be headers to retreive data
-            header = ws[1]
-            titles = [cell.value for cell in header]
-
-            try:
-                index_list = [titles.index(elt) for elt in elt_list]
-            except:
-                messages.error(request, "Chargement du fichier impossible : la structure ne correspond pas à ce qui est attendu")
-                return redirect("polls:adm_users")
-
-            nb_lines = 0
-            nb_warn = 0
-            nb_err = 0
-            err_messages = []
-            warn_messages = []
-
-            for row in ws.iter_rows(min_row=2, values_only=True):
-                nb_lines += 1
-                unique_user = True
-
-                last_name = row[0]
-                first_name = row[1]
-                email = row[2]
-                phone_num = row[3]
-                if row[4] is not None:
-                    username = row[4]
-                else:
-                    username = last_name.lower()
-
-                # Data controls :
-                # - user unicity : if username alreay exists;
-                #       * for provided usernames, raise an error and reject line
-                #       * else (username == last_name) : check first name and email
-                #           if both are equal, reject row
-                #           else : define new id with first-name chars
-                # - phone numer format (warning only)
-
-                if User.objects.filter(username=username).exists():
-                    db_user = User.objects.get(username=username)
-                    if (db_user.last_name == last_name and db_user.first_name == first_name \
-                                                      and db_user.email == email) \
-                        or (row[4] is not None):
-                        # user already exists
-                        nb_err += 1
-                        err_messages.insert(0, "Utilisateur {0} {1} non créé : il existe déjà".format(last_name, first_name))
-                        continue  # directly goes no next iteration
-
-                    else:
-                        unique_user = False
-                        i = 0
-                        while unique_user == False:
-                            username += first_name.lower()[i:i+1]
-                            i += 1
-                            if User.objects.filter(username=username).exists():
-                                # It's another user than before : needs to check unicity again
-                                db_user = User.objects.get(username=username)
-                                if (db_user.last_name == last_name and db_user.first_name == first_name \
-                                                                and db_user.email == email) \
-                                    or (row[4] is not None):
-                                    # user already exists
-                                    nb_err += 1
-                                    err_messages.insert(0, "Utilisateur {0} {1} non créé : il existe déjà".format(last_name, first_name))
-                                    break
-
-                                elif i >= len(first_name.lower()):
-                                    # Not able to automatically define a unique username
-                                    nb_err += 1
-                                    err_messages.insert(0, "Utilisateur {0} {1} non créé : impossible de définir un nom d'utilisateur unique".format(last_name, first_name))
-                                    break
-                            else:
-                                unique_user = True
-
-                # Out of while loop : check if a unique username has been found
-                if unique_user is True:
-                    if phone_num is not None and not re.match(r'^0[0-9]([ .-]?[0-9]{2}){4}$', str(phone_num)):
-                        phone_num = ''    # integrate no phone number rather than invalid one
-                        nb_warn += 1
-                        warn_messages.insert(0, "Utilisateur {0} {1} : numéro de téléphone invalide".format(last_name, first_name))
-
-                    # Create user & usercomp
-                    new_user = User.objects.create_user(
-                        username=username,
-                        password=username,
-                        last_name=last_name,
-                        first_name=first_name,
-                        email=email
-                    )
-
-                    company = Company.get_company(request.session['comp_slug'])
-                    usr_comp = UserComp.create_usercomp(
-                        user=new_user,
-                        company=company,
-                        phone_num=phone_num
-                    )
-            
-            # Messages are created at the end to ensure having the right order
-            msg = "{0} utilisateurs sur {1} correctement intégrés, {2} avertissement(s).".format((nb_lines - nb_err), nb_lines, nb_warn)
-            messages.success(request, msg)
-
-            for err_msg in err_messages:
-                messages.error(request, err_msg)
-            for warn_msg in warn_messages:
-                messages.warning(request, warn_msg)
+            # File is imported in the background : its progress is displayed on users' page
+            company = Company.get_company(comp_slug)
+            path = default_storage.save(
+                "imports/{}{}".format(uuid.uuid4().hex, os.path.splitext(f.name)[1]), f
+            )
+            job = submit_job(
+                "import_users", company=company, runner=settings.USERS_IMPORT_RUNNER,
+                path=path, sheet=request.POST['sheet'],
+            )
+
+            return redirect(reverse("polls:adm_users", args=[comp_slug]) + "?job={}".format(job.id))
+
+    return redirect("polls:adm_users", comp_slug=comp_slug)
 
-            return redirect("polls:adm_users", comp_slug=comp_slug)
+
+def add_import_messages(request, job):
+    """ Summary of a finished users' import, delivered as messages """
+    if job.status == "FAILED":
+        messages.error(request, job.message)
+        return
+
+    # Messages are created at the end to ensure having the right order
+    result = job.get_result()
+    msg = "{0} utilisateurs sur {1} correctement intégrés, {2} avertissement(s).".format(
+        result["nb_users"], result["nb_lines"], result["nb_warnings"]
+    )
+    messages.success(request, msg)
+
+    for err_msg in result["errors"]:
+        messages.error(request, err_msg)
+    for warn_msg in result["warnings"]:
+        messages.warning(request, warn_msg)
 
 
 # Groups management
@@ -684,6 +750,33 @@ def adm_delete_group(request, comp_slug, grp_id):
     return redirect("polls:adm_groups", comp_slug=comp_slug)
 
 
+# Exports
+
+@login_required
+def export_members(request, comp_slug, file_format):
+    """ Company's members and their groups, as a csv or xlsx file """
+    if not user_is_admin(comp_slug, request.user) or file_format not in CONTENT_TYPES:
+        raise Http404
+
+    company = Company.get_company(comp_slug)
+    return export_response(members_rows(company), "membres-" + comp_slug, file_format)
+
+
+@login_required
+def export_event(request, comp_slug, event_slug, export_name, file_format):
+    """ Event's participation or results, as a csv or xlsx file """
+    event_exports = {"participation": participation_rows, "results": results_rows}
+    if (
+        not user_is_admin(comp_slug, request.user)
+        or export_name not in event_exports
+        or file_format not in CONTENT_TYPES
+    ):
+        raise Http404
+
+    event = Event.get_event(comp_slug, event_slug)
+    return export_response(event_exports[export_name](event), "{}-{}".format(export_name, event_slug), file_format)
+
+
 # Event management
 
 @user_passes_test(lambda u: u.is_superuser or (u.id is not None and u.usercomp.is_admin))
@@ -89,6 +89,26 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# Local memory is enough for a single process (dev, tests) : use a shared
+# backend (memcached...) in production so that all processes share charts data
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Data which must be shared by all processes and servers, even in dev (votes journaled
+    # but not counted yet, responses to votes) : its table is created by "manage.py migrate"
+    # (by "manage.py createcachetable" if LOCATION is changed)
+    # Another backend may be used if it is shared (memcached, redis...), never a local memory one
+    "shared": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "polls_shared_cache",
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -132,6 +152,57 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media/")
 LOGIN_URL = "/polls/login/"
 
 
+# Live results stream (Server-Sent Events) : each open stream holds a server worker
+# until it is closed, so it requires a threaded or asynchronous server (e.g. gunicorn
+# with gthread or gevent workers). When disabled, pages poll charts data every 5 s
+CHART_STREAM = False
+# Delay between two checks of the new votes' signal, kept in the cache (shared by
+# all processes with a shared cache backend) : the database is read only when it
+# changes, or at least every CHART_STREAM_CHECK_INTERVAL
+CHART_STREAM_INTERVAL = 0.5
+CHART_STREAM_CHECK_INTERVAL = 5
+# Duration before the stream is closed (browsers reconnect by themselves)
+CHART_STREAM_DURATION = 30
+
+# Charts data are cached for each version of a question's results
+CHART_DATA_CACHE_TIMEOUT = 300
+
+# Ballots are recorded in a ledger : with compaction, they are counted in results
+# in batches by "manage.py compact_votes" instead of at each vote
+VOTES_COMPACTION = False
+
+# Responses to votes are kept in the "shared" cache, to answer requests sent again
+# with the same Idempotency-Key
+VOTE_IDEMPOTENCY_TIMEOUT = 3600
+
+# Votes ingestion for very large events : when a file is set, votes are appended
+# to this journal and counted in batches by "manage.py flush_votes" (Unix only)
+# None : votes are counted as soon as they are sent
+VOTES_JOURNAL = None    # e.g. os.path.join(BASE_DIR, "journal/votes.log")
+VOTES_JOURNAL_BATCH = 500
+# Journaled votes are reserved in the "shared" cache until they are counted :
+# "manage.py flush_votes" must be run more often than that
+VOTES_JOURNAL_RESERVATION_TIMEOUT = 24 * 3600
+
+# Users imported from a file are inserted by batches of this size
+USERS_IMPORT_BATCH = 1000
+# Imports are run by the "manage.py run_jobs" worker (see JOBS_RUNNER below), where
+# initial passwords are hashed by a pool of processes (None : one process per CPU)
+# With another runner, web processes are not forked : passwords are hashed one by one
+USERS_IMPORT_RUNNER = "worker"
+PASSWORD_HASH_WORKERS = None
+
+# Background jobs (event launch...) are run by :
+#   "thread" : a pool of JOBS_WORKERS threads in each web process
+#   "worker" : the "manage.py run_jobs" command
+#   "sync" : the request itself, before the response is sent
+JOBS_RUNNER = "thread"
+JOBS_WORKERS = 2
+# A job whose progress has not changed for this delay (seconds) is considered dead :
+# an event's launch is then started again by the next admin's visit
+JOBS_STALE_TIMEOUT = 600
+
+
 # List of colors used in charts
 BACKGROUND_COLORS = [
     "rgba(124, 252, 0, 0.2)",
@@ -157,3 +228,21 @@ BORDER_COLORS = [
     "rgba(222, 184, 135, 1)",
     "rgba(127, 255, 212, 1)",
 ]
+
+# Mails are saved in an outbox, then sent by :
+#   "thread" : the background jobs' threads of the web process, once saved
+#   "worker" : the "manage.py send_mails" command
+#   "sync" : the request itself, before the response is sent
+MAIL_RUNNER = "thread"
+# They are sent by MAIL_WORKERS parallel SMTP connections,
+# each one sending MAIL_BATCH messages before being closed
+MAIL_WORKERS = 4
+MAIL_BATCH = 100
+# A mail which could not be sent is tried again after MAIL_RETRY_DELAY seconds,
+# delay doubled at each attempt, until MAIL_MAX_ATTEMPTS
+# Mails are tried again by "manage.py send_mails --interval" only : with the "thread" runner,
+# the worker is still needed for retries (otherwise, they wait for the company's next mails)
+MAIL_RETRY_DELAY = 60
+MAIL_MAX_ATTEMPTS = 5
+# Mails still being sent after this delay (seconds) are sent again
+MAIL_SENDING_TIMEOUT = 600